@@ -0,0 +1,16 @@
+a = [];
+i = 0;
+while (i < 20000) {
+    push(a, (i * 7919) % 10007);
+    i = i + 1;
+}
+
+total = 0;
+i = 0;
+while (i < a.length) {
+    total = total + a[i];
+    i = i + 1;
+}
+
+sort(a);
+print(total + a[0] + a[a.length - 1]);
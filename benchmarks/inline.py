@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+
+"""Usage: inline.py [-n <repeat>] [<iterations>]
+
+Time a call-heavy script - a loop of <iterations> (default 20000) calling
+small helper functions - the best of <repeat> runs on the untranslated
+interpreter, with the calls of the helpers inlined at compile time (see
+js/inliner.py) and without.
+"""
+
+
+import os
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+from js import parser  # noqa
+from js.bytecode import CompilerContext  # noqa
+from js.inliner import Inliner  # noqa
+from js.interpreter import interpret  # noqa
+
+
+SOURCE = '''
+function sq(x) {
+    return x * x;
+};
+function add(a, b) {
+    return a + b;
+};
+function dist2(x1, y1, x2, y2) {
+    return sq(x1 - x2) + sq(y1 - y2);
+};
+function clamp(v) {
+    return v %% 1000;
+};
+function run(n) {
+    i = 0;
+    total = 0;
+    while (i < n) {
+        total = clamp(add(total, dist2(i, add(i, 1), 3, 4)));
+        i = i + 1;
+    }
+    return total;
+};
+print(run(%d));
+'''
+
+
+def measure(source, inline):
+    start = time.time()
+    ast = parser.parse(source)
+    bc = CompilerContext.compile_ast(
+        ast, lazy=True, inliner=Inliner(ast) if inline else None)
+    compiled = time.time()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        interpret(bc)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return compiled - start, time.time() - compiled
+
+
+def main(argv):
+    repeat = 3
+    if argv[1:2] == ['-n']:
+        repeat = int(argv[2])
+        argv = argv[2:]
+    if len(argv) > 2:
+        print __doc__
+        return 1
+    iterations = int(argv[1]) if len(argv) == 2 else 20000
+    source = SOURCE % iterations
+    print '%-12s %12s %12s' % ('', 'compile', 'run')
+    times = {}
+    for name, inline in [('not inlined', False), ('inlined', True)]:
+        results = [measure(source, inline) for _ in range(repeat)]
+        times[name] = min(r[1] for r in results)
+        print '%-12s %11.3fs %11.3fs' % (name, min(r[0] for r in results),
+                                         times[name])
+    print '%-12s %24.1fx' % ('speedup', times['not inlined'] /
+                             times['inlined'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
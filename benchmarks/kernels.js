@@ -0,0 +1,20 @@
+n = 20000;
+a = Float64Array(n);
+b = Float64Array(n);
+i = 0;
+while (i < n) {
+    a[i] = i % 10;
+    b[i] = i % 7;
+    i = i + 1;
+}
+
+total = 0;
+round = 0;
+while (round < 100) {
+    total = total + dot(a, b);
+    scale(a, 0.5);
+    add(a, b);
+    round = round + 1;
+}
+
+print(total);
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+
+"""Usage: library.py [-n <repeat>] [<size>]
+
+Time running a generated script that defines <size> helper functions
+(default 3000) but only calls a handful of them, the best of <repeat> runs
+on the untranslated interpreter: compiling every function body up front,
+compiling them on their first call, and also only pre-parsing them (matching
+their braces) until then.
+"""
+
+
+import os
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+from js import parser  # noqa
+from js.bytecode import CompilerContext  # noqa
+from js.interpreter import interpret  # noqa
+
+
+def library(size):
+    lines = []
+    for i in range(size):
+        lines.append('''\
+function helper%d(a, b) {
+    total = 0;
+    i = 0;
+    while (i < a) {
+        if (i %% 2 == 0) {
+            total = total + i * b;
+        } else {
+            total = total - {x: i, y: "%d"}.x;
+        }
+        i = i + 1;
+    }
+    return [total, a, b].length + total;
+};''' % (i, i))
+    for i in range(0, size, max(size // 5, 1)):
+        lines.append('r%d = helper%d(10, 2);' % (i, i))
+    return '\n'.join(lines)
+
+
+def measure(source, lazy, preparse):
+    start = time.time()
+    ast = parser.parse(source, lazy=preparse)
+    parsed = time.time()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        interpret(CompilerContext.compile_ast(ast, lazy=lazy))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return parsed - start, time.time() - parsed
+
+
+def main(argv):
+    repeat = 3
+    if argv[1:2] == ['-n']:
+        repeat = int(argv[2])
+        argv = argv[2:]
+    if len(argv) > 2:
+        print __doc__
+        return 1
+    size = int(argv[1]) if len(argv) == 2 else 3000
+    source = library(size)
+    print '%-12s %12s %18s' % ('', 'parse', 'compile and run')
+    for name, lazy, preparse in [('eager', False, False),
+                                 ('lazy', True, False),
+                                 ('pre-parsed', True, True)]:
+        results = [measure(source, lazy, preparse) for _ in range(repeat)]
+        print '%-12s %11.3fs %17.3fs' % (name, min(r[0] for r in results),
+                                         min(r[1] for r in results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,8 @@
+i = 0;
+total = 0;
+while (i < 30000) {
+    total = total + i % 7;
+    i = i + 1;
+}
+
+print(total);
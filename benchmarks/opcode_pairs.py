@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+
+"""Usage: opcode_pairs.py [-n <count>] [--no-fuse] [<filename> ...]
+
+Run scripts on the untranslated interpreter and report the <count> most
+frequently executed opcodes and pairs of consecutive opcodes, which is
+what superinstructions are chosen from. --no-fuse leaves the existing
+superinstructions out, to see the pairs they were made of. Runs every
+benchmarks/*.js script when no filename is given.
+"""
+
+
+import os
+import sys
+from glob import glob
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+from js import bytecode, interpreter, parser  # noqa
+
+
+class CountingDriver(object):
+
+    ''' Stands in for the JitDriver: the interpreter reaches its merge
+    point once per executed instruction
+    '''
+
+    def __init__(self):
+        self.ops = {}
+        self.pairs = {}
+        self.last = None
+
+    def jit_merge_point(self, pc, code, bc, **reds):
+        op, _, _ = bytecode.read_instruction(code, pc)
+        name = bytecode.bytecodes[op]
+        self.ops[name] = self.ops.get(name, 0) + 1
+        if self.last is not None:
+            pair = (self.last, name)
+            self.pairs[pair] = self.pairs.get(pair, 0) + 1
+        self.last = name
+
+    def can_enter_jit(self, **kwargs):
+        pass
+
+
+def report(title, counts, limit):
+    total = float(sum(counts.values()))
+    print title
+    for key, count in sorted(counts.items(), key=lambda i: -i[1])[:limit]:
+        if isinstance(key, tuple):
+            key = ' + '.join(key)
+        print '  %6.2f%%  %10d  %s' % (100 * count / total, count, key)
+
+
+def main(argv):
+    limit = 15
+    if argv[1:2] == ['-n']:
+        limit = int(argv[2])
+        argv = argv[2:]
+    if argv[1:2] == ['--no-fuse']:
+        bytecode.fuse = lambda ctx: None
+        argv = argv[1:]
+    filenames = argv[1:] or sorted(
+        glob(os.path.join(ROOT, 'benchmarks', '*.js')))
+
+    driver = CountingDriver()
+    interpreter.jitdriver = driver
+    stdout = sys.stdout
+    for filename in filenames:
+        with open(filename) as f:
+            source = f.read()
+        bc = bytecode.CompilerContext.compile_ast(
+            parser.parse(source, filename=filename))
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            interpreter.interpret(bc)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        driver.last = None
+
+    report('opcodes', driver.ops, limit)
+    report('opcode pairs', driver.pairs, limit)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
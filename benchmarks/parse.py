@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+
+"""Usage: parse.py [-n <repeat>] [<size>]
+
+Time parsing generated scripts of about <size> statements (default 2000),
+the best of <repeat> runs, with the hand-written front end (js.parser) and
+the one generated from tests/grammar.txt (tests.grammar_parser), once its
+tables are built.
+"""
+
+
+import os
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+from js import parser  # noqa
+from tests.grammar_parser import GrammarParser  # noqa
+
+
+def statements(size):
+    ''' Assignments, calls, loops and functions, as typical scripts have '''
+    lines = []
+    for i in range(size // 4):
+        lines.append('function f%d(a, b) {' % i)
+        lines.append('    if (a < b) { return a * 2 + b; } '
+                     'else { return [a, b].length; }')
+        lines.append('};')
+        lines.append('x%d = {a: f%d(%d, 2.5), b: "s%d"};' % (i, i, i, i))
+        lines.append('while (x%d.a > 0) { x%d.a = x%d.a - 1; }' % (i, i, i))
+    return '\n'.join(lines)
+
+
+def chain(size):
+    ''' A single expression of size operands '''
+    return 'x = %s1;' % ('y * 2 + ' * size)
+
+
+def measure(module, source, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        try:
+            module.parse(source)
+        except RuntimeError:  # maximum recursion depth exceeded
+            return None
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main(argv):
+    repeat = 3
+    if argv[1:2] == ['-n']:
+        repeat = int(argv[2])
+        argv = argv[2:]
+    if len(argv) > 2:
+        print __doc__
+        return 1
+    size = int(argv[1]) if len(argv) == 2 else 2000
+    grammar_parser = GrammarParser()
+    print '%-24s %12s %12s' % ('', 'hand-written', 'grammar')
+    for name, source in [('statements', statements(size)),
+                         ('operator chain', chain(size))]:
+        results = []
+        for module in (parser, grammar_parser):
+            result = measure(module, source, repeat)
+            results.append('recursion' if result is None else
+                           '%11.3fs' % result)
+        print '%-24s %12s %12s' % (name, results[0], results[1])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,18 @@
+function vec(x, y) {
+    return {x: x, y: y};
+};
+
+function add(a, b) {
+    return vec(a.x + b.x, a.y + b.y);
+};
+
+i = 0;
+pos = vec(0, 0);
+step = vec(1, 2);
+while (i < 20000) {
+    pos = add(pos, step);
+    pos.x = pos.x % 1000;
+    i = i + 1;
+}
+
+print(pos.x + pos.y);
@@ -0,0 +1,8 @@
+i = 0;
+report = "";
+while (i < 20000) {
+    report = report + "row " + i + ": " + i * 3 + "\n";
+    i = i + 1;
+}
+
+print(report == report + "");
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+
+"""Usage: run.py [-n <repeat>] [--stats] [<filename> ...]
+
+Time scripts on the untranslated interpreter and report the best of
+<repeat> runs, split into compile (parse + bytecode) and execution time.
+--stats also reports the interpreter's allocation counters for one run.
+Runs every benchmarks/*.js script when no filename is given.
+"""
+
+
+import os
+import sys
+import time
+from glob import glob
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+from js import parser  # noqa
+from js.bytecode import CompilerContext  # noqa
+from js.interpreter import interpret, stats  # noqa
+
+
+def measure(source, filename):
+    start = time.time()
+    bc = CompilerContext.compile_ast(parser.parse(source, filename=filename))
+    compiled = time.time()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    stats.reset()
+    try:
+        interpret(bc)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return compiled - start, time.time() - compiled
+
+
+def main(argv):
+    repeat = 3
+    if argv[1:2] == ['-n']:
+        repeat = int(argv[2])
+        argv = argv[2:]
+    show_stats = argv[1:2] == ['--stats']
+    if show_stats:
+        argv = argv[1:]
+    filenames = argv[1:] or sorted(
+        glob(os.path.join(ROOT, 'benchmarks', '*.js')))
+
+    for filename in filenames:
+        with open(filename) as f:
+            source = f.read()
+        results = [measure(source, filename) for _ in range(repeat)]
+        compile_time = min(r[0] for r in results)
+        run_time = min(r[1] for r in results)
+        print '%-30s compile %8.2f ms    run %10.2f ms' % (
+            os.path.basename(filename), compile_time * 1000, run_time * 1000)
+        if show_stats:
+            print '    frames %d allocated, %d reused; functions %d' % (
+                stats.frames_allocated, stats.frames_reused,
+                stats.functions_allocated)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+
+"""Usage: startup.py [-n <repeat>] [<baseline>]
+
+Time `import js.interpreter` in a fresh (untranslated) process, the best of
+<repeat> runs, and the same import from <baseline>, another checkout of the
+interpreter (e.g. `git worktree add /tmp/baseline <commit>`), such as one
+whose parser still builds its tables from the grammar at import time.
+"""
+
+
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+TIMED = '''\
+import sys, time
+sys.path.insert(0, %r)
+start = time.time()
+import js.interpreter
+sys.stdout.write('%%f' %% (time.time() - start))
+'''
+
+
+def measure(root, repeat):
+    code = TIMED % root
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         stderr=open(os.devnull, 'w'))
+        times.append(float(output))
+    return min(times)
+
+
+def main(argv):
+    repeat = 5
+    if argv[1:2] == ['-n']:
+        repeat = int(argv[2])
+        argv = argv[2:]
+    if len(argv) > 2:
+        print __doc__
+        return 1
+    current = measure(ROOT, repeat)
+    print '%-24s %8.3fs' % ('this tree', current)
+    if len(argv) == 2:
+        baseline = measure(os.path.abspath(argv[1]), repeat)
+        print '%-24s %8.3fs' % ('baseline', baseline)
+        print '%-24s %8.1fx' % ('speedup', baseline / current)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,404 @@
+# -*- encoding: utf-8 -*-
+
+
+from rpython.rlib import jit, rerased
+from rpython.rlib.listsort import make_timsort_class
+
+
+from js.base_objects import W_Numeric, W_IntObject, W_FloatObject, \
+    OperationalError, w_Undefined, w_Null, newint, newbool, NAN
+
+
+class W_Array(W_Numeric):
+
+    ''' An array. Its items are kept in storage in the representation picked
+    by strategy - unboxed while they are all ints or all numbers, switching
+    to a list of objects for good once anything else is stored
+    '''
+
+    def __init__(self, strategy, storage):
+        self.strategy = strategy
+        self.storage = storage
+
+    @staticmethod
+    def from_values(values_w):
+        strategy = empty_strategy
+        for w_value in values_w:
+            if not strategy.accepts(w_value):
+                strategy = strategy.generalized_for(w_value)
+        return W_Array(strategy, strategy.store(values_w))
+
+    def get_strategy(self):
+        return jit.promote(self.strategy)
+
+    def length(self):
+        return self.get_strategy().length(self)
+
+    def getitem(self, i):
+        if i < 0 or i >= self.length():
+            return w_Undefined
+        return self.get_strategy().getitem(self, i)
+
+    def setitem(self, i, w_value):
+        length = self.length()
+        if i < length:
+            self.make_room_for(w_value)
+            self.get_strategy().setitem(self, i, w_value)
+        else:
+            if i - length > MAX_HOLES:
+                raise OperationalError('RangeError: Invalid array length')
+            while length < i:  # leaves holes
+                self.append(w_Undefined)
+                length += 1
+            self.append(w_value)
+
+    def append(self, w_value):
+        self.make_room_for(w_value)
+        self.get_strategy().append(self, w_value)
+
+    def pop(self):
+        if self.length() == 0:
+            return w_Undefined
+        return self.get_strategy().pop(self)
+
+    def slice(self, start, stop):
+        strategy = self.get_strategy()
+        return W_Array(strategy, strategy.slice(self, start, stop))
+
+    def sort(self):
+        self.get_strategy().sort(self)
+
+    def make_room_for(self, w_value):
+        ''' Switch to a strategy that can store w_value along with the
+        current items
+        '''
+        strategy = self.get_strategy()
+        if not strategy.accepts(w_value):
+            new_strategy = strategy.generalized_for(w_value)
+            values_w = strategy.fetch_all(self)
+            self.strategy = new_strategy
+            self.storage = new_strategy.store(values_w)
+
+    def get_item(self, w_index):
+        i = array_index(w_index)
+        if i < 0:
+            return W_Numeric.get_item(self, w_index)
+        return self.getitem(i)
+
+    def set_item(self, w_index, w_value):
+        i = array_index(w_index)
+        if i < 0:
+            W_Numeric.set_item(self, w_index, w_value)
+        else:
+            self.setitem(i, w_value)
+
+    def get_property(self, name):
+        if name == 'length':
+            return newint(self.length())
+        return w_Undefined
+
+    def is_true(self):
+        return True
+
+    def to_string(self):
+        parts = []
+        for i in xrange(self.length()):
+            w_value = self.getitem(i)
+            if w_value is w_Undefined or w_value is w_Null:
+                parts.append('')
+            else:
+                parts.append(w_value.to_string())
+        return ','.join(parts)
+
+    def get_floatval(self):
+        return NAN
+
+    def eq(self, other):
+        return newbool(self is other)
+
+    def eq_bool(self, other):
+        return self is other
+
+    def __repr__(self):
+        ''' NOT_RPYTHON '''
+        return '<%s %s: %r>' % (type(self).__name__,
+                                type(self.strategy).__name__,
+                                self.strategy.fetch_all(self))
+
+
+def array_index(w_index):
+    ''' The array index w_index stands for, or -1 if it is none '''
+    if isinstance(w_index, W_IntObject):
+        if w_index.intval >= 0:
+            return w_index.intval
+    elif isinstance(w_index, W_FloatObject):
+        floatval = w_index.floatval
+        if 0.0 <= floatval < MAX_INDEX and floatval == int(floatval):
+            return int(floatval)
+    return -1
+
+
+MAX_INDEX = float(2 ** 31)
+
+# the most holes storing past the end of an array may leave - the items are
+# not sparse, each hole takes the room of an item
+MAX_HOLES = 1 << 20
+
+
+class ArrayStrategy(object):
+
+    ''' How the items of W_Arrays are stored - the strategies are stateless
+    singletons, the items are in W_Array.storage
+    '''
+
+    def accepts(self, w_value):
+        raise NotImplementedError
+
+    def generalized_for(self, w_value):
+        ''' The strategy to switch to for storing w_value '''
+        raise NotImplementedError
+
+    def store(self, values_w):
+        ''' Storage holding values_w, which this strategy accepts '''
+        raise NotImplementedError
+
+    def fetch_all(self, w_array):
+        raise NotImplementedError
+
+    def length(self, w_array):
+        raise NotImplementedError
+
+    def getitem(self, w_array, i):
+        raise NotImplementedError
+
+    def setitem(self, w_array, i, w_value):
+        raise NotImplementedError
+
+    def append(self, w_array, w_value):
+        raise NotImplementedError
+
+    def pop(self, w_array):
+        raise NotImplementedError
+
+    def slice(self, w_array, start, stop):
+        raise NotImplementedError
+
+    def sort(self, w_array):
+        ''' Sort the items in the order of the JS default sort, whatever
+        the strategy, see object_lt
+        '''
+        values_w = self.fetch_all(w_array)
+        ObjectSort(values_w).sort()
+        w_array.storage = self.store(values_w)
+
+
+class EmptyArrayStrategy(ArrayStrategy):
+
+    erase, unerase = rerased.new_erasing_pair('empty')
+    erase = staticmethod(erase)
+    unerase = staticmethod(unerase)
+
+    def accepts(self, w_value):
+        return False
+
+    def generalized_for(self, w_value):
+        if isinstance(w_value, W_IntObject):
+            return int_strategy
+        elif isinstance(w_value, W_FloatObject):
+            return float_strategy
+        return object_strategy
+
+    def store(self, values_w):
+        assert not values_w
+        return self.erase(None)
+
+    def fetch_all(self, w_array):
+        return []
+
+    def length(self, w_array):
+        return 0
+
+    def slice(self, w_array, start, stop):
+        return self.erase(None)
+
+    def sort(self, w_array):
+        pass
+
+
+class ObjectArrayStrategy(ArrayStrategy):
+
+    erase, unerase = rerased.new_erasing_pair('object')
+    erase = staticmethod(erase)
+    unerase = staticmethod(unerase)
+
+    def accepts(self, w_value):
+        return True
+
+    def store(self, values_w):
+        return self.erase(values_w[:])
+
+    def fetch_all(self, w_array):
+        return self.unerase(w_array.storage)[:]
+
+    def length(self, w_array):
+        return len(self.unerase(w_array.storage))
+
+    def getitem(self, w_array, i):
+        return self.unerase(w_array.storage)[i]
+
+    def setitem(self, w_array, i, w_value):
+        self.unerase(w_array.storage)[i] = w_value
+
+    def append(self, w_array, w_value):
+        self.unerase(w_array.storage).append(w_value)
+
+    def pop(self, w_array):
+        return self.unerase(w_array.storage).pop()
+
+    def slice(self, w_array, start, stop):
+        return self.erase(self.unerase(w_array.storage)[start:stop])
+
+    def sort(self, w_array):
+        ObjectSort(self.unerase(w_array.storage)).sort()
+
+
+def object_lt(w_a, w_b):
+    ''' Order of the JS default sort: by string value, undefined last '''
+    if w_b is w_Undefined:
+        return w_a is not w_Undefined
+    if w_a is w_Undefined:
+        return False
+    return w_a.to_string() < w_b.to_string()
+
+
+ObjectSort = make_timsort_class(lt=object_lt)
+
+
+class IntArrayStrategy(ArrayStrategy):
+
+    erase, unerase = rerased.new_erasing_pair('int')
+    erase = staticmethod(erase)
+    unerase = staticmethod(unerase)
+
+    def accepts(self, w_value):
+        return isinstance(w_value, W_IntObject)
+
+    def generalized_for(self, w_value):
+        if isinstance(w_value, W_FloatObject):
+            return float_strategy
+        return object_strategy
+
+    def store(self, values_w):
+        ints = []
+        for w_value in values_w:
+            assert isinstance(w_value, W_IntObject)
+            ints.append(w_value.intval)
+        return self.erase(ints)
+
+    def fetch_all(self, w_array):
+        return [newint(i) for i in self.unerase(w_array.storage)]
+
+    def length(self, w_array):
+        return len(self.unerase(w_array.storage))
+
+    def getitem(self, w_array, i):
+        return newint(self.unerase(w_array.storage)[i])
+
+    def setitem(self, w_array, i, w_value):
+        assert isinstance(w_value, W_IntObject)
+        self.unerase(w_array.storage)[i] = w_value.intval
+
+    def append(self, w_array, w_value):
+        assert isinstance(w_value, W_IntObject)
+        self.unerase(w_array.storage).append(w_value.intval)
+
+    def pop(self, w_array):
+        return newint(self.unerase(w_array.storage).pop())
+
+    def slice(self, w_array, start, stop):
+        return self.erase(self.unerase(w_array.storage)[start:stop])
+
+    def sort(self, w_array):
+        IntSort(self.unerase(w_array.storage)).sort()
+
+
+def int_lt(a, b):
+    ''' object_lt of unboxed ints '''
+    return str(a) < str(b)
+
+
+IntSort = make_timsort_class(lt=int_lt)
+
+
+class FloatArrayStrategy(ArrayStrategy):
+
+    ''' Numbers that are not all ints - the ints among them are read back
+    as W_FloatObjects
+    '''
+
+    erase, unerase = rerased.new_erasing_pair('float')
+    erase = staticmethod(erase)
+    unerase = staticmethod(unerase)
+
+    def accepts(self, w_value):
+        return isinstance(w_value, W_FloatObject) or \
+            isinstance(w_value, W_IntObject)
+
+    def generalized_for(self, w_value):
+        return object_strategy
+
+    def store(self, values_w):
+        return self.erase([w_value.get_floatval() for w_value in values_w])
+
+    def fetch_all(self, w_array):
+        return [W_FloatObject(f) for f in self.unerase(w_array.storage)]
+
+    def length(self, w_array):
+        return len(self.unerase(w_array.storage))
+
+    def getitem(self, w_array, i):
+        return W_FloatObject(self.unerase(w_array.storage)[i])
+
+    def setitem(self, w_array, i, w_value):
+        self.unerase(w_array.storage)[i] = w_value.get_floatval()
+
+    def append(self, w_array, w_value):
+        self.unerase(w_array.storage).append(w_value.get_floatval())
+
+    def pop(self, w_array):
+        return W_FloatObject(self.unerase(w_array.storage).pop())
+
+    def slice(self, w_array, start, stop):
+        return self.erase(self.unerase(w_array.storage)[start:stop])
+
+
+empty_strategy = EmptyArrayStrategy()
+object_strategy = ObjectArrayStrategy()
+int_strategy = IntArrayStrategy()
+float_strategy = FloatArrayStrategy()
+
+
+def slice_bounds(length, w_start, w_stop):
+    ''' Positions of a slice from w_start to w_stop (both may be undefined
+    or negative, counting from the end) of an array of length
+    '''
+    start = slice_position(length, w_start, 0)
+    stop = slice_position(length, w_stop, length)
+    if stop < start:
+        stop = start
+    return start, stop
+
+
+def slice_position(length, w_pos, default):
+    if w_pos is w_Undefined:
+        return default
+    if not isinstance(w_pos, W_IntObject):
+        raise OperationalError('TypeError: slice bounds must be integers')
+    pos = w_pos.intval
+    if pos < 0:
+        pos += length
+        if pos < 0:
+            pos = 0
+    elif pos > length:
+        pos = length
+    return pos
@@ -5,6 +5,16 @@
 # does not really implement javascript
 
 
+import math
+
+from rpython.rlib import jit
+from rpython.rlib.objectmodel import compute_hash
+from rpython.rlib.rarithmetic import ovfcheck
+from rpython.rlib.rfloat import INFINITY, NAN, isnan, isinf, copysign, \
+    formatd, string_to_float
+from rpython.rlib.rstring import StringBuilder, ParseStringError
+
+
 class OperationalError(Exception):
     pass
 
@@ -20,16 +30,36 @@ class W_Root(object):
     def eq(self, other):
         raise NotImplementedError
 
+    def lt_bool(self, other):
+        return self.lt(other).is_true()
+
+    def eq_bool(self, other):
+        return self.eq(other).is_true()
+
     def add(self, other):
         raise NotImplementedError
 
     def to_string(self):
         raise NotImplementedError
 
+    def get_property(self, name):
+        return w_Undefined
+
+    def set_property(self, name, w_value):
+        pass  # primitives have no properties of their own
+
+    def get_item(self, w_index):
+        return self.get_property(w_index.to_string())
+
+    def set_item(self, w_index, w_value):
+        self.set_property(w_index.to_string(), w_value)
+
 
 class W_Numeric(W_Root):
 
     def add(self, other):
+        if isinstance(other, W_StringObject):
+            return concat(W_StringObject(self.to_string()), other)
         return W_FloatObject(self.get_floatval() + other.get_floatval())
 
     def sub(self, other):
@@ -39,24 +69,31 @@ class W_Numeric(W_Root):
         return W_FloatObject(self.get_floatval() * other.get_floatval())
 
     def div(self, other):
-        return W_FloatObject(self.get_floatval() / other.get_floatval())
+        return W_FloatObject(
+            float_div(self.get_floatval(), other.get_floatval()))
 
     def mod(self, other):
-        return W_FloatObject(float(
-            int(self.get_floatval()) % int(other.get_floatval())))
+        return W_FloatObject(
+            float_mod(self.get_floatval(), other.get_floatval()))
 
     def lt(self, other):
-        return W_BoolObject(self.get_floatval() < other.get_floatval())
+        return newbool(self.get_floatval() < other.get_floatval())
 
     def eq(self, other):
-        return W_BoolObject(self.get_floatval() == other.get_floatval())
+        return newbool(self.get_floatval() == other.get_floatval())
+
+    def lt_bool(self, other):
+        return self.get_floatval() < other.get_floatval()
+
+    def eq_bool(self, other):
+        return self.get_floatval() == other.get_floatval()
 
     def get_floatval(self):
         raise NotImplementedError
 
 
 class W_BoolObject(W_Numeric):
-    #_immutable_fields_ = ['boolval']
+    _immutable_fields_ = ['boolval']
 
     def __init__(self, boolval):
         self.boolval = bool(boolval)
@@ -76,16 +113,16 @@ class W_BoolObject(W_Numeric):
 
 
 class W_FloatObject(W_Numeric):
-    #_immutable_fields_ = ['floatval']
+    _immutable_fields_ = ['floatval']
 
     def __init__(self, floatval):
         self.floatval = floatval
 
     def is_true(self):
-        return bool(self.floatval)
+        return self.floatval != 0.0 and not isnan(self.floatval)
 
     def to_string(self):
-        return str(self.floatval)
+        return float_to_string(self.floatval)
 
     def get_floatval(self):
         return self.floatval
@@ -100,36 +137,509 @@ class W_FloatObject(W_Numeric):
         return '<%s: %f>' % (type(self).__name__, self.floatval)
 
 
+class W_IntObject(W_Numeric):
+
+    ''' A number that is an integer in the range of a machine word - the
+    operations fall back to floats on overflow
+    '''
+    _immutable_fields_ = ['intval']
+
+    def __init__(self, intval):
+        self.intval = intval
+
+    def is_true(self):
+        return self.intval != 0
+
+    def to_string(self):
+        return str(self.intval)
+
+    def get_floatval(self):
+        return float(self.intval)
+
+    def add(self, other):
+        if isinstance(other, W_IntObject):
+            try:
+                return newint(ovfcheck(self.intval + other.intval))
+            except OverflowError:
+                pass
+        return W_Numeric.add(self, other)
+
+    def sub(self, other):
+        if isinstance(other, W_IntObject):
+            try:
+                return newint(ovfcheck(self.intval - other.intval))
+            except OverflowError:
+                pass
+        return W_Numeric.sub(self, other)
+
+    def mul(self, other):
+        if isinstance(other, W_IntObject):
+            x = self.intval
+            y = other.intval
+            # a zero product of a negative number is -0, a float
+            if (x != 0 and y != 0) or (x >= 0 and y >= 0):
+                try:
+                    return newint(ovfcheck(x * y))
+                except OverflowError:
+                    pass
+        return W_Numeric.mul(self, other)
+
+    def div(self, other):
+        if isinstance(other, W_IntObject):
+            x = self.intval
+            y = other.intval
+            if y > 0 and x % y == 0:
+                return newint(x // y)
+        return W_Numeric.div(self, other)
+
+    def mod(self, other):
+        if isinstance(other, W_IntObject):
+            return int_mod(self.intval, other.intval)
+        return W_Numeric.mod(self, other)
+
+    def lt(self, other):
+        if isinstance(other, W_IntObject):
+            return newbool(self.intval < other.intval)
+        return W_Numeric.lt(self, other)
+
+    def eq(self, other):
+        if isinstance(other, W_IntObject):
+            return newbool(self.intval == other.intval)
+        return W_Numeric.eq(self, other)
+
+    def lt_bool(self, other):
+        if isinstance(other, W_IntObject):
+            return self.intval < other.intval
+        return W_Numeric.lt_bool(self, other)
+
+    def eq_bool(self, other):
+        if isinstance(other, W_IntObject):
+            return self.intval == other.intval
+        return W_Numeric.eq_bool(self, other)
+
+    def __eq__(self, other):
+        ''' NOT_RPYTHON '''
+        return isinstance(self, type(other)) and self.intval == other.intval
+
+    def __repr__(self):
+        ''' NOT_RPYTHON '''
+        return '<%s: %d>' % (type(self).__name__, self.intval)
+
+
 class W_StringObject(W_Numeric):
-    #_immutable_fields_ = ['stringval']
 
-    def __init__(self, stringval):
+    ''' A string, either flat or a rope - the lazy concatenation of two
+    strings, flattened the first time its contents are needed
+    '''
+    _immutable_fields_ = ['length']
+
+    def __init__(self, stringval, left=None, right=None):
         self.stringval = stringval
+        self.left = left
+        self.right = right
+        if stringval is None:
+            self.length = left.length + right.length
+        else:
+            self.length = len(stringval)
+        self.hash = 0  # not computed yet
+        self.interned = False
+
+    def get_string(self):
+        if self.stringval is None:
+            self.flatten()
+        return self.stringval
+
+    def flatten(self):
+        # ropes built in a loop are as deep as the loop is long, so walk
+        # them with an explicit stack rather than recursively
+        builder = StringBuilder(self.length)
+        todo = [self]
+        while todo:
+            w_str = todo.pop()
+            if w_str.stringval is not None:
+                builder.append(w_str.stringval)
+            else:
+                todo.append(w_str.right)
+                todo.append(w_str.left)
+        self.stringval = builder.build()
+        self.left = None
+        self.right = None
+
+    def get_hash(self):
+        if self.hash == 0:
+            h = compute_hash(self.get_string())
+            self.hash = h if h != 0 else 1
+        return self.hash
 
     def is_true(self):
-        return bool(self.stringval)
+        return self.length != 0
 
     def to_string(self):
-        return str(self.stringval)
+        return self.get_string()
+
+    def get_floatval(self):
+        s = self.get_string().strip(' \t\n\r')
+        if not s:
+            return 0.0
+        try:
+            return string_to_float(s)
+        except ParseStringError:
+            return NAN
+
+    def add(self, other):
+        if isinstance(other, W_StringObject):
+            return concat(self, other)
+        return concat(self, W_StringObject(other.to_string()))
+
+    def lt(self, other):
+        return newbool(self.lt_bool(other))
+
+    def eq(self, other):
+        return newbool(self.eq_bool(other))
+
+    def lt_bool(self, other):
+        if isinstance(other, W_StringObject):
+            return self.get_string() < other.get_string()
+        return W_Numeric.lt_bool(self, other)
+
+    def eq_bool(self, other):
+        if isinstance(other, W_StringObject):
+            return self.str_eq(other)
+        return W_Numeric.eq_bool(self, other)
+
+    def str_eq(self, other):
+        if self is other:
+            return True
+        if self.length != other.length or \
+                (self.interned and other.interned):
+            return False
+        # strings compared once are usually compared again, in a loop
+        if self.get_hash() != other.get_hash():
+            return False
+        return self.get_string() == other.get_string()
 
     def __eq__(self, other):
         ''' NOT_RPYTHON '''
         return isinstance(
-            self, type(other)) and self.stringval == other.stringval
+            self, type(other)) and self.get_string() == other.get_string()
+
+    def __repr__(self):
+        ''' NOT_RPYTHON '''
+        return '<%s: %r>' % (type(self).__name__, self.get_string())
+
+
+class W_Undefined(W_Numeric):
+
+    def is_true(self):
+        return False
+
+    def to_string(self):
+        return 'undefined'
+
+    def get_floatval(self):
+        return float('nan')
+
+    def get_property(self, name):
+        raise OperationalError(
+            'TypeError: cannot read property "%s" of undefined' % name)
+
+    def set_property(self, name, w_value):
+        raise OperationalError(
+            'TypeError: cannot set property "%s" of undefined' % name)
+
+    def __repr__(self):
+        ''' NOT_RPYTHON '''
+        return '<W_Undefined>'
+
+
+class W_Null(W_Numeric):
+
+    def is_true(self):
+        return False
+
+    def to_string(self):
+        return 'null'
+
+    def get_floatval(self):
+        return 0.0
+
+    def get_property(self, name):
+        raise OperationalError(
+            'TypeError: cannot read property "%s" of null' % name)
+
+    def set_property(self, name, w_value):
+        raise OperationalError(
+            'TypeError: cannot set property "%s" of null' % name)
+
+    def __repr__(self):
+        ''' NOT_RPYTHON '''
+        return '<W_Null>'
+
+
+# the only instances of these values, compared by identity
+w_True = W_BoolObject(True)
+w_False = W_BoolObject(False)
+w_Undefined = W_Undefined()
+w_Null = W_Null()
+
+
+def newbool(boolval):
+    if boolval:
+        return w_True
+    return w_False
+
+
+# W_IntObjects of the most common values are shared
+SMALL_INT_MIN = -128
+SMALL_INT_MAX = 1024
+small_ints = [W_IntObject(i) for i in range(SMALL_INT_MIN, SMALL_INT_MAX)]
+
+
+def newint(intval):
+    if SMALL_INT_MIN <= intval < SMALL_INT_MAX:
+        return small_ints[intval - SMALL_INT_MIN]
+    return W_IntObject(intval)
+
+
+# shorter results are copied right away, a rope would only be overhead
+MIN_ROPE_LENGTH = 64
+
+
+def concat(w_left, w_right):
+    if w_left.length == 0:
+        return w_right
+    if w_right.length == 0:
+        return w_left
+    if w_left.length + w_right.length < MIN_ROPE_LENGTH:
+        return W_StringObject(w_left.get_string() + w_right.get_string())
+    return W_StringObject(None, w_left, w_right)
+
+
+# identifier-like strings are interned, so that equal ones are usually the
+# same object and unequal ones can be told apart without comparing them
+MAX_INTERNED_LENGTH = 32
+interned_strings = {}
+
+
+def is_identifier_like(s):
+    if not s or len(s) > MAX_INTERNED_LENGTH:
+        return False
+    for c in s:
+        if not (c.isalnum() or c == '_' or c == '$'):
+            return False
+    return True
+
+
+def newstring(s):
+    if not is_identifier_like(s):
+        return W_StringObject(s)
+    try:
+        return interned_strings[s]
+    except KeyError:
+        w_str = W_StringObject(s)
+        w_str.interned = True
+        interned_strings[s] = w_str
+        return w_str
+
+
+def int_mod(x, y):
+    ''' x % y with the sign of x, as in JS '''
+    if y == 0:
+        return W_FloatObject(NAN)
+    if y == -1:
+        res = 0  # avoids the overflow of -sys.maxint - 1 % -1
+    else:
+        res = x % y
+        if res != 0 and (res < 0) != (x < 0):
+            res -= y
+    if res == 0 and x < 0:
+        return W_FloatObject(-0.0)
+    return newint(res)
+
+
+def float_div(x, y):
+    if y == 0.0:
+        if x == 0.0 or isnan(x):
+            return NAN
+        return copysign(INFINITY, x) * copysign(1.0, y)
+    return x / y
+
+
+def float_mod(x, y):
+    ''' x % y with the sign of x, as in JS '''
+    if isnan(x) or isnan(y) or isinf(x) or y == 0.0:
+        return NAN
+    if isinf(y):
+        return x
+    return math.fmod(x, y)
+
+
+def float_to_string(floatval):
+    ''' Format a number the way JS does, for the common cases '''
+    if isnan(floatval):
+        return 'NaN'
+    if isinf(floatval):
+        return 'Infinity' if floatval > 0 else '-Infinity'
+    if floatval == 0.0:
+        return '0'  # also -0
+    if floatval == math.floor(floatval) and abs(floatval) < 1e21:
+        return formatd(floatval, 'f', 0)
+    res = formatd(floatval, 'r', 0)
+    exp = res.find('e')
+    if exp >= 0:  # 1e-07 is 1e-7 in JS
+        digits = exp + 2
+        while digits < len(res) - 1 and res[digits] == '0':
+            digits += 1
+        res = res[:exp + 2] + res[digits:]
+    return res
+
+
+class Map(object):
+
+    ''' Hidden class of W_Objects: the names of their properties and where
+    each is stored. Objects that got the same properties in the same order
+    share a map, so that the position of a property can be cached per map
+    '''
+
+    _immutable_fields_ = ['indexes', 'transitions']
+
+    def __init__(self, indexes):
+        self.indexes = indexes  # property name -> index in the storage
+        self.transitions = {}  # property name -> map with it added
+
+    @jit.elidable
+    def find_index(self, name):
+        return self.indexes.get(name, -1)
+
+    @jit.elidable
+    def with_property(self, name):
+        try:
+            return self.transitions[name]
+        except KeyError:
+            indexes = self.indexes.copy()
+            indexes[name] = len(self.indexes)
+            new_map = Map(indexes)
+            self.transitions[name] = new_map
+            return new_map
 
     def __repr__(self):
         ''' NOT_RPYTHON '''
-        return '<%s: %f>' % (type(self).__name__, self.stringval)
+        names = sorted(self.indexes, key=self.indexes.get)
+        return '<Map %s>' % ', '.join(names)
+
+
+EMPTY_MAP = Map({})
+
+
+class W_Object(W_Numeric):
+
+    ''' An object with properties, stored in the order they were added
+    '''
+
+    def __init__(self, map=EMPTY_MAP):
+        self.map = map
+        self.storage = []
+
+    def is_true(self):
+        return True
+
+    def to_string(self):
+        return '[object Object]'
+
+    def get_floatval(self):
+        return NAN
+
+    def eq(self, other):
+        return newbool(self is other)
+
+    def eq_bool(self, other):
+        return self is other
+
+    def get_property(self, name):
+        index = jit.promote(self.map).find_index(name)
+        if index < 0:
+            return w_Undefined
+        return self.storage[index]
+
+    def set_property(self, name, w_value):
+        map = jit.promote(self.map)
+        index = map.find_index(name)
+        if index < 0:
+            self.add_property(map.with_property(name), w_value)
+        else:
+            self.storage[index] = w_value
+
+    def add_property(self, new_map, w_value):
+        ''' Add a property, new_map being the map with it added '''
+        self.map = new_map
+        self.storage.append(w_value)
+
+    def __repr__(self):
+        ''' NOT_RPYTHON '''
+        names = sorted(self.map.indexes, key=self.map.indexes.get)
+        return '<W_Object {%s}>' % ', '.join(
+            '%s: %r' % (name, self.storage[self.map.indexes[name]])
+            for name in names)
+
+
+class Arguments(object):
+
+    ''' Arguments of a builtin call - a view of the caller's value stack,
+    valid until the call returns
+    '''
+
+    _immutable_fields_ = ['values', 'start', 'count']
+
+    def __init__(self, values, start, count):
+        self.values = values
+        self.start = start
+        self.count = count
+
+    def get(self, i):
+        if i >= self.count:
+            return w_Undefined
+        return self.values[self.start + i]
 
 
 class W_BuilinFunction(W_Root):
 
-    def call(self, arg_list):
+    def call(self, args):
         raise NotImplementedError
 
 
+class Cell(object):
+
+    ''' A variable of a function loaded by a nested function, None while
+    it is not assigned
+    '''
+
+    def __init__(self, w_value):
+        self.w_value = w_value
+
+
 class W_Function(W_Root):
 
-    def __init__(self, bytecode, parent_frame):
-        self.bytecode = bytecode
-        self.parent_frame = parent_frame
+    ''' Function defined by the LOAD_CONSTANT_FN of nested function index
+    of code object outer. Its own code object is only looked up - compiled
+    or loaded from an image if need be, see ByteCode.get_constant_fn - when
+    it is first called.
+
+    It only keeps the cells of the variables of enclosing functions it
+    loads, see ByteCode.freevars, and the frame of the globals
+    '''
+
+    _immutable_fields_ = ['outer', 'index', 'closure[*]', 'global_frame']
+
+    def __init__(self, outer, index, closure, global_frame):
+        self.outer = outer
+        self.index = index
+        self.bytecode = None
+        self.closure = closure
+        self.global_frame = global_frame
+
+    def get_bytecode(self):
+        bytecode = self.bytecode
+        if bytecode is None:
+            bytecode = self.outer.get_constant_fn(self.index)
+            self.bytecode = bytecode
+        return bytecode
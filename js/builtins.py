@@ -1,25 +1,177 @@
 # -*- encoding: utf-8 -*-
 
 
-from js.base_objects import W_BuilinFunction, W_StringObject
+from js.base_objects import W_BuilinFunction, W_FloatObject, \
+    W_IntObject, OperationalError, w_True, w_False, w_Undefined, w_Null, \
+    newint, newstring
+from js.arrays import W_Array, slice_bounds
+from js.typedarrays import W_TypedArray, MAP_OPS, new_typed_array, \
+    typed_sum, typed_dot, typed_scale, typed_add, typed_map, typed_fill, \
+    typed_copy
 
 
 class W_PrintFn(W_BuilinFunction):
 
-    def call(self, arg_list):
-        print arg_list[0].to_string()
+    def call(self, args):
+        print args.get(0).to_string()
+        return w_Undefined
 
 
 class W_TypeOf(W_BuilinFunction):
 
-    def call(self, arg_list):
-        obj = arg_list[0]
+    def call(self, args):
+        obj = args.get(0)
+        if isinstance(obj, W_FloatObject) or isinstance(obj, W_IntObject):
+            return newstring('number')
         clsname = obj.__class__.__name__[2:]
 
-        return W_StringObject(clsname)
+        return newstring(clsname)
+
+
+def get_array(args):
+    w_array = args.get(0)
+    if not isinstance(w_array, W_Array):
+        raise OperationalError('TypeError: %s is not an array' %
+                               w_array.to_string())
+    return w_array
+
+
+class W_Push(W_BuilinFunction):
+
+    def call(self, args):
+        w_array = get_array(args)
+        for i in xrange(1, args.count):
+            w_array.append(args.get(i))
+        return newint(w_array.length())
+
+
+class W_Pop(W_BuilinFunction):
+
+    def call(self, args):
+        return get_array(args).pop()
+
+
+class W_Slice(W_BuilinFunction):
+
+    def call(self, args):
+        w_array = get_array(args)
+        start, stop = slice_bounds(w_array.length(), args.get(1), args.get(2))
+        return w_array.slice(start, stop)
+
+
+class W_Sort(W_BuilinFunction):
+
+    def call(self, args):
+        w_array = get_array(args)
+        w_array.sort()
+        return w_array
+
+
+class W_TypedArrayFn(W_BuilinFunction):
+
+    def __init__(self, is_float):
+        self.is_float = is_float
+
+    def call(self, args):
+        return new_typed_array(self.is_float, args.get(0))
+
+
+def get_typed_array(args, i):
+    w_arr = args.get(i)
+    if not isinstance(w_arr, W_TypedArray):
+        raise OperationalError('TypeError: %s is not a typed array' %
+                               w_arr.to_string())
+    return w_arr
+
+
+def get_number(args, i):
+    w_value = args.get(i)
+    if not isinstance(w_value, W_IntObject) and \
+            not isinstance(w_value, W_FloatObject):
+        raise OperationalError('TypeError: %s is not a number' %
+                               w_value.to_string())
+    return w_value.get_floatval()
+
+
+class W_Sum(W_BuilinFunction):
+
+    def call(self, args):
+        return typed_sum(get_typed_array(args, 0))
+
+
+class W_Dot(W_BuilinFunction):
+
+    def call(self, args):
+        return typed_dot(get_typed_array(args, 0), get_typed_array(args, 1))
+
+
+class W_Scale(W_BuilinFunction):
+
+    def call(self, args):
+        w_arr = get_typed_array(args, 0)
+        typed_scale(w_arr, get_number(args, 1))
+        return w_arr
+
+
+class W_Add(W_BuilinFunction):
+
+    def call(self, args):
+        w_arr = get_typed_array(args, 0)
+        typed_add(w_arr, get_typed_array(args, 1))
+        return w_arr
+
+
+class W_Map(W_BuilinFunction):
+
+    def call(self, args):
+        w_arr = get_typed_array(args, 0)
+        name = args.get(1).to_string()
+        try:
+            op = MAP_OPS[name]
+        except KeyError:
+            raise OperationalError('TypeError: unknown operation "%s"' % name)
+        typed_map(w_arr, op)
+        return w_arr
+
+
+class W_Fill(W_BuilinFunction):
+
+    def call(self, args):
+        w_arr = get_typed_array(args, 0)
+        typed_fill(w_arr, get_number(args, 1))
+        return w_arr
+
+
+class W_Copy(W_BuilinFunction):
+
+    def call(self, args):
+        return typed_copy(get_typed_array(args, 0))
 
 
 BUILTINS = {
     'print': W_PrintFn(),
     'typeof': W_TypeOf(),
+    'push': W_Push(),
+    'pop': W_Pop(),
+    'slice': W_Slice(),
+    'sort': W_Sort(),
+    'Float64Array': W_TypedArrayFn(True),
+    'Int32Array': W_TypedArrayFn(False),
+    'sum': W_Sum(),
+    'dot': W_Dot(),
+    'scale': W_Scale(),
+    'add': W_Add(),
+    'map': W_Map(),
+    'fill': W_Fill(),
+    'copy': W_Copy(),
+    'true': w_True,
+    'false': w_False,
+    'undefined': w_Undefined,
+    'null': w_Null,
 }
+
+# builtins are resolved to an index at compile time (see LOAD_BUILTIN),
+# so the interpreter never looks them up by name
+BUILTIN_NAMES = sorted(BUILTINS.keys())
+BUILTIN_INDEX = dict((name, i) for i, name in enumerate(BUILTIN_NAMES))
+BUILTIN_VALUES = [BUILTINS[name] for name in BUILTIN_NAMES]
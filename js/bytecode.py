@@ -1,14 +1,32 @@
 # -*- encoding: utf-8 -*-
 
 
+from rpython.rlib import jit
+from rpython.rlib.listsort import TimSort
+from rpython.rlib.longlong2float import float2longlong
+
+
+from js.base_objects import W_FloatObject, newint, newstring
+from js.builtins import BUILTIN_INDEX
+
+
 old_globals = dict(globals())
 
-LOAD_CONSTANT_FLOAT, LOAD_CONSTANT_STRING, LOAD_CONSTANT_FN, LOAD_VAR, ASSIGN, \
+LOAD_CONSTANT_FLOAT, LOAD_CONSTANT_STRING, LOAD_CONSTANT_FN, \
+    LOAD_FAST, LOAD_DEREF, LOAD_GLOBAL, LOAD_BUILTIN, ASSIGN, \
     DISCARD_TOP, RETURN, JUMP_IF_FALSE, JUMP_ABSOLUTE, \
     BINARY_ADD, BINARY_SUB, BINARY_MUL, BINARY_DIV, BINARY_EQ, BINARY_LT, \
     BINARY_MOD, \
-    CALL, MAKE_FN \
-    = range(18)
+    CALL, MAKE_FN, EXTENDED_ARG, \
+    JUMP_IF_NOT_LT, JUMP_IF_NOT_EQ, INCR_FAST, LOAD_FAST_FAST, RETURN_BINARY, \
+    LOAD_CONSTANT_INT, NEW_OBJECT, INIT_ATTR, LOAD_ATTR, STORE_ATTR, \
+    NEW_ARRAY, LOAD_ITEM, STORE_ITEM, LOAD_CELL, STORE_CELL, TAIL_CALL, \
+    BINARY_ADD_FLOAT, BINARY_SUB_FLOAT, BINARY_MUL_FLOAT, BINARY_DIV_FLOAT, \
+    BINARY_EQ_FLOAT, BINARY_LT_FLOAT, BINARY_MOD_FLOAT, BINARY_ADD_STRING, \
+    JUMP_IF_NOT_LT_FLOAT, \
+    BINARY_ADD_INT, BINARY_SUB_INT, BINARY_MUL_INT, BINARY_EQ_INT, \
+    BINARY_LT_INT, BINARY_MOD_INT, JUMP_IF_NOT_LT_INT, INCR_FAST_INT \
+    = range(55)
 
 bytecodes = dict((globals()[f], f) for f in globals()
                  if f not in old_globals and f != 'old_globals')
@@ -24,27 +42,214 @@ BINOP = {
     '%': BINARY_MOD,
 }
 
+BINARY_OPS = [BINARY_ADD, BINARY_SUB, BINARY_MUL, BINARY_DIV, BINARY_EQ,
+              BINARY_LT, BINARY_MOD]
 
-class CompilerContext(object):
+# opcodes whose argument is a position in the code
+JUMPS = [JUMP_IF_FALSE, JUMP_ABSOLUTE, JUMP_IF_NOT_LT, JUMP_IF_NOT_EQ]
 
-    def __init__(self, names=None):
-        self.data = []
+# opcodes never followed by the next instruction
+ENDS_BLOCK = [JUMP_ABSOLUTE, RETURN, RETURN_BINARY, TAIL_CALL]
+
+# quickened opcodes are only written to ByteCode.quickened by the
+# interpreter, never emitted by the compiler
+FIRST_QUICKENED = BINARY_ADD_FLOAT
+FLOAT_VARIANTS = {
+    BINARY_ADD: BINARY_ADD_FLOAT,
+    BINARY_SUB: BINARY_SUB_FLOAT,
+    BINARY_MUL: BINARY_MUL_FLOAT,
+    BINARY_DIV: BINARY_DIV_FLOAT,
+    BINARY_EQ: BINARY_EQ_FLOAT,
+    BINARY_LT: BINARY_LT_FLOAT,
+    BINARY_MOD: BINARY_MOD_FLOAT,
+    JUMP_IF_NOT_LT: JUMP_IF_NOT_LT_FLOAT,
+}
+INT_VARIANTS = {
+    BINARY_ADD: BINARY_ADD_INT,
+    BINARY_SUB: BINARY_SUB_INT,
+    BINARY_MUL: BINARY_MUL_INT,
+    BINARY_EQ: BINARY_EQ_INT,
+    BINARY_LT: BINARY_LT_INT,
+    BINARY_MOD: BINARY_MOD_INT,
+    JUMP_IF_NOT_LT: JUMP_IF_NOT_LT_INT,
+    INCR_FAST: INCR_FAST_INT,
+}
+STRING_VARIANTS = {
+    BINARY_ADD: BINARY_ADD_STRING,
+}
+GENERIC = {}
+for _generic, _quick in FLOAT_VARIANTS.items() + INT_VARIANTS.items() + \
+        STRING_VARIANTS.items():
+    GENERIC[_quick] = _generic
+del _generic, _quick
+
+# number of type misses a quickened instruction may have before it stays
+# generic
+MAX_QUICKEN_MISSES = 2
+
+# superinstructions with two operands of one byte each, packed into the
+# argument as (first << 8) | second
+TWO_OPERANDS = [INCR_FAST, LOAD_FAST_FAST]
+
+# opcodes that push a value without any side effect
+PURE_LOADS = [LOAD_CONSTANT_FLOAT, LOAD_CONSTANT_INT, LOAD_CONSTANT_STRING,
+              LOAD_CONSTANT_FN, LOAD_BUILTIN, NEW_OBJECT]
+
+NOP = -1  # marks instructions removed by the optimizer, never emitted
+
+
+def stack_effect(op, arg):
+    ''' Net change of the value stack depth caused by an instruction
+    '''
+    if op in (LOAD_CONSTANT_FLOAT, LOAD_CONSTANT_INT, LOAD_CONSTANT_STRING,
+              LOAD_CONSTANT_FN, LOAD_FAST, LOAD_DEREF, LOAD_GLOBAL,
+              LOAD_BUILTIN, NEW_OBJECT, LOAD_CELL):
+        return 1
+    elif op in (ASSIGN, STORE_CELL, DISCARD_TOP, JUMP_IF_FALSE, INIT_ATTR,
+                LOAD_ITEM, BINARY_ADD, BINARY_SUB, BINARY_MUL, BINARY_DIV,
+                BINARY_EQ, BINARY_LT, BINARY_MOD):
+        return -1
+    elif op in (JUMP_IF_NOT_LT, JUMP_IF_NOT_EQ, RETURN_BINARY, STORE_ATTR):
+        return -2
+    elif op == LOAD_FAST_FAST:
+        return 2
+    elif op == STORE_ITEM:
+        return -3
+    elif op == NEW_ARRAY:
+        return 1 - arg
+    elif op == RETURN:
+        return -arg
+    elif op == CALL:
+        return -arg  # pops the arguments and the function, pushes result
+    elif op == TAIL_CALL:
+        return -arg - 1
+    return 0
+
+
+def compute_stacksize(code):
+    ''' Maximum depth of the value stack reached by code
+    '''
+    ops = []
+    args = []
+    index = {}  # code position -> instruction number
+    pc = 0
+    while pc < len(code):
+        index[pc] = len(ops)
+        op, arg, pc = read_instruction(code, pc)
+        ops.append(op)
+        args.append(arg)
+
+    depths = [-1] * len(ops)
+    max_depth = 0
+    todo = [(0, 0)]
+    while todo:
+        i, depth = todo.pop()
+        if i >= len(ops) or depths[i] >= 0:
+            continue
+        depths[i] = depth
+        op = ops[i]
+        depth += stack_effect(op, args[i])
+        if depth > max_depth:
+            max_depth = depth
+        if op in JUMPS:
+            todo.append((index[args[i]], depth))
+        if op not in ENDS_BLOCK:
+            todo.append((i + 1, depth))
+    return max_depth
+
+
+class ConstantPool(object):
+
+    ''' Deduplicated, boxed constants of one compilation unit, shared by
+    all code objects compiled from it
+    '''
+
+    def __init__(self):
         self.constants_float = []
+        self.floats_to_numbers = {}
+        self.constants_int = []
+        self.ints_to_numbers = {}
         self.constants_string = []
-        self.constants_fn = []
+        self.strings_to_numbers = {}
+
+    def register_float(self, v):
+        # keyed by bit pattern, so that 0.0 and -0.0 stay apart
+        key = float2longlong(v)
+        try:
+            return self.floats_to_numbers[key]
+        except KeyError:
+            self.floats_to_numbers[key] = len(self.constants_float)
+            self.constants_float.append(W_FloatObject(v))
+            return len(self.constants_float) - 1
+
+    def register_int(self, v):
+        try:
+            return self.ints_to_numbers[v]
+        except KeyError:
+            self.ints_to_numbers[v] = len(self.constants_int)
+            self.constants_int.append(newint(v))
+            return len(self.constants_int) - 1
+
+    def register_string(self, v):
+        try:
+            return self.strings_to_numbers[v]
+        except KeyError:
+            self.strings_to_numbers[v] = len(self.constants_string)
+            self.constants_string.append(newstring(v))
+            return len(self.constants_string) - 1
+
+
+class CompilerContext(object):
+
+    def __init__(self, names=None, parent=None, optimize=True, lazy=False,
+                 inliner=None, co_name=None, co_filename=None,
+                 co_firstlineno=0):
+        self.data = []
+        if parent is None:
+            self.pool = ConstantPool()
+        else:
+            self.pool = parent.pool
+        self.constants_fn = []  # CompilerContexts of nested functions
         self.names = []
         self.names_to_numbers = {}
+        # slots of the variables loaded by nested functions, kept in cells
+        self.cellvars = []
+        self.cellvars_to_numbers = {}
+        # variables of enclosing functions loaded by this one or by its
+        # nested functions, passed in the cells of its closure
+        self.freevars = []
+        self.freevars_to_numbers = {}
+        # the cells each nested function is closed over, see closure_index
+        self.closures = []
+        self.declared = {}
+        self.parent = parent
+        self.optimize = optimize
+        # compile nested functions on their first call, see defer
+        self.lazy = lazy
+        self.body = None  # the AST of a deferred function
+        # the calls to inline when folding, see js.inliner
+        self.inliner = inliner
+        # slots of the temporaries of the inlined calls, see bind_temp
+        self.temps = []
+        self.live_temps = 0
+        self.co_name = co_name
+        self.co_filename = co_filename
+        self.co_firstlineno = co_firstlineno
         if names is not None:
             for name in names:
+                self.declare(name)
                 self.register_var(name)
+        # the initial names are the arguments
+        self.co_argcount = len(self.names)
 
     def register_constant_float(self, v):
-        self.constants_float.append(v)
-        return len(self.constants_float) - 1
+        return self.pool.register_float(v)
+
+    def register_constant_int(self, v):
+        return self.pool.register_int(v)
 
     def register_constant_string(self, v):
-        self.constants_string.append(v)
-        return len(self.constants_string) - 1
+        return self.pool.register_string(v)
 
     def register_constant_fn(self, v):
         self.constants_fn.append(v)
@@ -58,65 +263,653 @@ class CompilerContext(object):
             self.names.append(name)
             return len(self.names) - 1
 
+    def register_cellvar(self, slot):
+        try:
+            return self.cellvars_to_numbers[slot]
+        except KeyError:
+            self.cellvars_to_numbers[slot] = len(self.cellvars)
+            self.cellvars.append(slot)
+            return len(self.cellvars) - 1
+
+    def register_freevar(self, name):
+        try:
+            return self.freevars_to_numbers[name]
+        except KeyError:
+            self.freevars_to_numbers[name] = len(self.freevars)
+            self.freevars.append(name)
+            return len(self.freevars) - 1
+
+    def closure_index(self, name):
+        ''' Find the cell of variable name for the closure of a nested
+        function, making it a cell variable if it is a local
+        :returns: the index of a cell variable, -2 - the index of a free
+        variable, or -1 if it is not a variable of a function
+        '''
+        if self.parent is None:  # globals are not captured
+            return -1
+        if name in self.declared:
+            return self.register_cellvar(self.register_var(name))
+        if name in self.freevars_to_numbers:
+            return -2 - self.freevars_to_numbers[name]
+        return -1
+
+    def declare(self, name):
+        ''' Mark name as local to this scope (a parameter or assigned to)
+        '''
+        self.declared[name] = None
+
+    def bind_temp(self, name):
+        ''' Bind name, a temporary of an inlined call (see js.inliner), to
+        the first slot no other live temporary holds, so that the calls
+        inlined one after the other share their slots
+        :returns: the slot
+        '''
+        if self.live_temps == len(self.temps):
+            self.temps.append(self.register_var('inlined.%d' %
+                                                self.live_temps))
+        slot = self.temps[self.live_temps]
+        self.live_temps += 1
+        self.declare(name)
+        self.names_to_numbers[name] = slot
+        return slot
+
+    def release_temps(self, names):
+        ''' Free the slots of the temporaries names, bound by bind_temp '''
+        for name in names:
+            del self.declared[name]
+            del self.names_to_numbers[name]
+        self.live_temps -= len(names)
+
+    def resolve_var(self, name):
+        ''' Resolve a variable reference at compile time
+        :returns: (opcode, arg) pair that loads the variable
+        '''
+        if name in self.declared:
+            return LOAD_FAST, self.register_var(name)
+        return self.resolve_outer(name)
+
+    def resolve_outer(self, name):
+        ''' Resolve name as if it were not a local of this scope - which
+        is what a local loads until it is first assigned, see
+        create_bytecode
+        :returns: (opcode, arg) pair that loads the variable
+        '''
+        if name in self.freevars_to_numbers:
+            return LOAD_DEREF, self.freevars_to_numbers[name]
+        scope = self.parent
+        while scope is not None:
+            if scope.parent is None and name in scope.declared:
+                return LOAD_GLOBAL, scope.register_var(name)
+            scope = scope.parent
+        if name in BUILTIN_INDEX:
+            return LOAD_BUILTIN, BUILTIN_INDEX[name]
+        # never assigned anywhere - give it a local slot that stays unbound,
+        # so loading it reports the name as not defined
+        return LOAD_FAST, self.register_var(name)
+
     def emit(self, bc, arg=0):
         self.data.append(bc)
         self.data.append(arg)
 
-    def create_bytecode(self,
-                        co_name=None, co_filename=None, co_firstlineno=0):
-        return ByteCode(
-            to_code(self.data),
+    def jumps_to(self, pos):
+        for i in xrange(0, len(self.data), 2):
+            if self.data[i] in JUMPS and self.data[i + 1] == pos:
+                return True
+        return False
+
+    def compile(self, astnode):
+        if self.optimize:
+            astnode = astnode.fold(self.inliner)
+        astnode.collect_locals(self)
+        astnode.compile(self)
+        if len(self.data) < 2 or \
+                (self.data[-2] != RETURN and self.data[-2] != TAIL_CALL) or \
+                self.jumps_to(len(self.data)):
+            self.emit(RETURN, 0)
+        self.use_cells()
+        if self.optimize:
+            peephole(self)
+            fuse(self)
+
+    def use_cells(self):
+        ''' Load and store the variables captured by nested functions
+        through their cells, now that they are all known
+        '''
+        for i in xrange(0, len(self.data), 2):
+            op = self.data[i]
+            if (op == LOAD_FAST or op == ASSIGN) and \
+                    self.data[i + 1] in self.cellvars_to_numbers:
+                self.data[i] = LOAD_CELL if op == LOAD_FAST else STORE_CELL
+                self.data[i + 1] = self.cellvars_to_numbers[self.data[i + 1]]
+
+    def compile_function(self, astnode, names,
+                         co_name=None, co_filename=None, co_firstlineno=0):
+        ''' Compile the body of a function nested in this context - or
+        keep it to be compiled on its first call if lazy, see FunctionCompiler
+        :returns: index of the function in constants_fn
+        '''
+        c = CompilerContext(names=names, parent=self, optimize=self.optimize,
+                            lazy=self.lazy, inliner=self.inliner,
+                            co_name=co_name,
+                            co_filename=co_filename,
+                            co_firstlineno=co_firstlineno)
+        if not self.lazy:
+            astnode = astnode.resolve()
+        self.closures.append(c.find_freevars(astnode))
+        if self.lazy:
+            c.body = astnode
+        else:
+            c.compile(astnode)
+        return self.register_constant_fn(c)
+
+    def find_freevars(self, astnode):
+        ''' Make the variables of the enclosing functions the function body
+        astnode or its nested functions may load the free variables of this
+        context. This is known before they are compiled, but only from the
+        names in them: a local of a nested function may be taken for one
+        loaded from an enclosing function, which only costs a cell
+        :returns: their closure indexes in the parent context
+        '''
+        astnode.collect_locals(self)
+        names = {}
+        astnode.collect_names(names)
+        # only the arguments are registered yet: the other locals may be
+        # loaded before they are assigned, see resolve_outer
+        free = [name for name in names if name not in self.names_to_numbers]
+        TimSort(free).sort()
+        closure = []
+        for name in free:
+            index = self.parent.closure_index(name)
+            if index != -1:
+                self.register_freevar(name)
+                closure.append(index)
+        return closure
+
+    def create_bytecode(self, constants_float=None, constants_string=None,
+                        constants_int=None):
+        ''' Create the bytecode object of this context and all nested
+        functions, once the whole compilation unit is compiled
+        '''
+        if constants_float is None:
+            constants_float = self.pool.constants_float[:]
+        if constants_string is None:
+            constants_string = self.pool.constants_string[:]
+        if constants_int is None:
+            constants_int = self.pool.constants_int[:]
+        code = assemble(self.data)
+        if self.lazy:
+            constants_fn = [None] * len(self.constants_fn)
+        else:
+            constants_fn = [c.create_bytecode(constants_float,
+                                              constants_string, constants_int)
+                            for c in self.constants_fn]
+        ncells = len(self.cellvars)
+        closures = [[index if index >= 0 else ncells - 2 - index
+                     for index in closure] for closure in self.closures]
+        # what each local that is not an argument loads while unbound
+        unbound_ops = [LOAD_FAST] * len(self.names)
+        unbound_args = [0] * len(self.names)
+        for i in range(len(self.names)):
+            if i >= self.co_argcount:
+                unbound_ops[i], unbound_args[i] = \
+                    self.resolve_outer(self.names[i])
+            else:
+                unbound_args[i] = i
+        bc = ByteCode(
+            code,
             self.names[:],
-            self.constants_float[:],
-            self.constants_string[:],
-            self.constants_fn[:],
-            co_name=co_name,
-            co_filename=co_filename,
-            co_firstlineno=co_firstlineno)
+            constants_float,
+            constants_string,
+            constants_fn,
+            constants_int=constants_int,
+            cellvars=self.cellvars[:],
+            freevars=self.freevars[:],
+            closures=closures,
+            unbound_ops=unbound_ops,
+            unbound_args=unbound_args,
+            co_stacksize=compute_stacksize(code),
+            co_argcount=self.co_argcount,
+            co_name=self.co_name,
+            co_filename=self.co_filename,
+            co_firstlineno=self.co_firstlineno)
+        if self.lazy and self.constants_fn:
+            bc.fn_loader = FunctionCompiler(self.constants_fn)
+        return bc
 
     @staticmethod
-    def compile_ast(astnode, names=None,
-                    co_name=None, co_filename=None, co_firstlineno=0):
+    def compile_ast(astnode, names=None, optimize=True, lazy=False,
+                    inliner=None, co_name=None, co_filename=None,
+                    co_firstlineno=0):
         ''' Create bytecode object from an ast node
         :names: initial names for CompilerContext
+        :optimize: fold constants and run the peephole optimizer
+        :lazy: compile nested functions on their first call
+        :inliner: the js.inliner.Inliner of astnode, to inline the calls of
+        small functions when optimizing
         '''
-        c = CompilerContext(names=names)
-        astnode.compile(c)
-        if len(c.data) < 2 or c.data[-2] != RETURN:
-            c.emit(RETURN, 0)
-        return c.create_bytecode(
-            co_name=co_name,
-            co_filename=co_filename,
-            co_firstlineno=co_firstlineno)
+        c = CompilerContext(names=names, optimize=optimize, lazy=lazy,
+                            inliner=inliner,
+                            co_name=co_name,
+                            co_filename=co_filename,
+                            co_firstlineno=co_firstlineno)
+        c.compile(astnode)
+        return c.create_bytecode()
+
+
+class FunctionLoader(object):
+
+    ''' Provides the code objects of nested functions that are created
+    after the code object defining them, see ByteCode.get_constant_fn
+    '''
+
+    def load(self, i):
+        raise NotImplementedError
+
+
+class FunctionCompiler(FunctionLoader):
+
+    ''' Compiles deferred nested functions, from their CompilerContexts.
+    Their constants are added to the pool of the compilation unit, so they
+    get their own, longer copies of the constant lists
+    '''
+
+    def __init__(self, contexts):
+        self.contexts = contexts
+
+    def load(self, i):
+        ctx = self.contexts[i]
+        body = ctx.body.resolve()  # raises again on every call if invalid
+        ctx.body = None
+        ctx.compile(body)
+        return ctx.create_bytecode()
+
+
+def peephole(ctx):
+    ''' Rewrite ctx.data into shorter equivalent bytecode: thread jumps,
+    resolve jumps on constant conditions, drop stores nobody reads and
+    values that are loaded only to be discarded, and remove unreachable
+    code
+    '''
+    ops, args = _decode(ctx.data)
+    while True:
+        changed = _thread_jumps(ops, args)
+        if _fold_constant_jumps(ops, args, ctx):
+            changed = True
+        if ctx.parent is not None and _remove_dead_stores(ops, args):
+            changed = True
+        if _remove_discarded_loads(ops, args):
+            changed = True
+        if _remove_unreachable(ops, args):
+            changed = True
+        if not changed:
+            break
+        ops, args = _compact(ops, args)
+    ctx.data = _encode(ops, args)
+
+
+def fuse(ctx):
+    ''' Replace the most frequently executed instruction sequences (see
+    benchmarks/opcode_pairs.py) with superinstructions
+    '''
+    ops, args = _decode(ctx.data)
+    targets = _jump_targets(ops, args)
+    i = 0
+    while i < len(ops) - 1:
+        op = ops[i]
+        if (i + 1) in targets:  # only the first instruction can be jumped to
+            i += 1
+            continue
+        next_op = ops[i + 1]
+        if op == LOAD_FAST and i + 3 < len(ops) and \
+                next_op == LOAD_CONSTANT_INT and \
+                ops[i + 2] == BINARY_ADD and ops[i + 3] == ASSIGN and \
+                args[i + 3] == args[i] and \
+                (i + 2) not in targets and (i + 3) not in targets and \
+                args[i] <= 0xff and args[i + 1] <= 0xff:
+            # x = x + integer constant
+            ops[i] = INCR_FAST
+            args[i] = (args[i] << 8) | args[i + 1]
+            ops[i + 1] = ops[i + 2] = ops[i + 3] = NOP
+            i += 4
+            continue
+        if op == LOAD_FAST and next_op == LOAD_FAST and \
+                args[i] <= 0xff and args[i + 1] <= 0xff:
+            ops[i] = LOAD_FAST_FAST
+            args[i] = (args[i] << 8) | args[i + 1]
+            ops[i + 1] = NOP
+            i += 2
+            continue
+        if (op == BINARY_LT or op == BINARY_EQ) and next_op == JUMP_IF_FALSE:
+            # compare and branch, without boxing the comparison result
+            if op == BINARY_LT:
+                ops[i] = JUMP_IF_NOT_LT
+            else:
+                ops[i] = JUMP_IF_NOT_EQ
+            args[i] = args[i + 1]
+            ops[i + 1] = NOP
+            i += 2
+            continue
+        if op in BINARY_OPS and next_op == RETURN and args[i + 1] == 1:
+            ops[i] = RETURN_BINARY
+            args[i] = op
+            ops[i + 1] = NOP
+            i += 2
+            continue
+        i += 1
+    ops, args = _compact(ops, args)
+    ctx.data = _encode(ops, args)
+
+
+def _decode(data):
+    ''' Split data into opcode and argument lists, jump arguments
+    becoming instruction indexes
+    '''
+    ops = []
+    args = []
+    for i in xrange(0, len(data), 2):
+        op = data[i]
+        arg = data[i + 1]
+        if op in JUMPS:
+            arg = arg // 2
+        ops.append(op)
+        args.append(arg)
+    return ops, args
+
+
+def _encode(ops, args):
+    data = []
+    for i in xrange(len(ops)):
+        arg = args[i]
+        if ops[i] in JUMPS:
+            arg = arg * 2
+        data.append(ops[i])
+        data.append(arg)
+    return data
+
+
+def _jump_targets(ops, args):
+    targets = {}
+    for i in xrange(len(ops)):
+        if ops[i] in JUMPS:
+            targets[args[i]] = None
+    return targets
+
+
+def _thread_jumps(ops, args):
+    ''' Retarget jumps that land on an unconditional jump, and remove
+    jumps to the next instruction
+    '''
+    changed = False
+    for i in xrange(len(ops)):
+        if ops[i] not in JUMPS:
+            continue
+        target = args[i]
+        hops = 0
+        while ops[target] == JUMP_ABSOLUTE and args[target] != target and \
+                hops < len(ops):  # guard against jump cycles
+            target = args[target]
+            hops += 1
+        if target != args[i]:
+            args[i] = target
+            changed = True
+        if ops[i] == JUMP_ABSOLUTE and target == i + 1:
+            ops[i] = NOP
+            changed = True
+    return changed
+
+
+def _fold_constant_jumps(ops, args, ctx):
+    ''' A conditional jump on a constant either always or never jumps
+    '''
+    changed = False
+    targets = _jump_targets(ops, args)
+    for i in xrange(len(ops) - 1):
+        if ops[i + 1] != JUMP_IF_FALSE or (i + 1) in targets:
+            continue
+        if ops[i] == LOAD_CONSTANT_FLOAT:
+            is_true = ctx.pool.constants_float[args[i]].is_true()
+        elif ops[i] == LOAD_CONSTANT_INT:
+            is_true = ctx.pool.constants_int[args[i]].is_true()
+        elif ops[i] == LOAD_CONSTANT_STRING:
+            is_true = ctx.pool.constants_string[args[i]].is_true()
+        else:
+            continue
+        ops[i] = NOP
+        if is_true:
+            ops[i + 1] = NOP
+        else:
+            ops[i + 1] = JUMP_ABSOLUTE
+        changed = True
+    return changed
+
+
+def _remove_dead_stores(ops, args):
+    ''' Discard values assigned to locals that are never loaded - those
+    loaded by nested functions are stored in cells, with STORE_CELL
+    '''
+    changed = False
+    loaded = {}
+    for i in xrange(len(ops)):
+        if ops[i] == LOAD_FAST:
+            loaded[args[i]] = None
+    for i in xrange(len(ops)):
+        if ops[i] == ASSIGN and args[i] not in loaded:
+            ops[i] = DISCARD_TOP
+            args[i] = 0
+            changed = True
+    return changed
+
+
+def _remove_discarded_loads(ops, args):
+    changed = False
+    targets = _jump_targets(ops, args)
+    for i in xrange(len(ops) - 1):
+        if ops[i] in PURE_LOADS and ops[i + 1] == DISCARD_TOP and \
+                (i + 1) not in targets:
+            ops[i] = NOP
+            ops[i + 1] = NOP
+            changed = True
+    return changed
+
+
+def _remove_unreachable(ops, args):
+    changed = False
+    reachable = [False] * len(ops)
+    todo = [0]
+    while todo:
+        i = todo.pop()
+        if i >= len(ops) or reachable[i]:
+            continue
+        reachable[i] = True
+        op = ops[i]
+        if op in JUMPS:
+            todo.append(args[i])
+        if op not in ENDS_BLOCK:
+            todo.append(i + 1)
+    for i in xrange(len(ops)):
+        if not reachable[i] and ops[i] != NOP:
+            ops[i] = NOP
+            changed = True
+    return changed
+
+
+def _compact(ops, args):
+    ''' Drop NOPs; jumps to a dropped instruction go to the next one
+    '''
+    new_index = [0] * (len(ops) + 1)
+    count = 0
+    for i in xrange(len(ops)):
+        new_index[i] = count
+        if ops[i] != NOP:
+            count += 1
+    new_index[len(ops)] = count
+    new_ops = []
+    new_args = []
+    for i in xrange(len(ops)):
+        if ops[i] == NOP:
+            continue
+        arg = args[i]
+        if ops[i] in JUMPS:
+            arg = new_index[arg]
+        new_ops.append(ops[i])
+        new_args.append(arg)
+    return new_ops, new_args
 
 
 class ByteCode(object):
-    # _immutable_fields_ = [
-    #     'code', 'names[*]', 'constants_float', 'constants_string', 'constants_fn'
-    # ]
+    _immutable_fields_ = [
+        'code', 'names[*]', 'constants_float[*]', 'constants_string[*]',
+        'constants_int[*]', 'cellvars[*]', 'freevars[*]', 'closures[*]',
+        'unbound_ops[*]', 'unbound_args[*]', 'strings[*]',
+        'co_stacksize', 'co_argcount',
+        'co_name', 'co_filename', 'co_firstlineno',
+    ]
 
     def __init__(self, code, names, constants_float, constants_string, constants_fn,
+                 constants_int=None, cellvars=None, freevars=None,
+                 closures=None, unbound_ops=None, unbound_args=None,
+                 co_stacksize=-1, co_argcount=0,
                  co_name=None, co_filename=None, co_firstlineno=0):
         self.code = code
         self.names = names
         self.constants_float = constants_float
         self.constants_string = constants_string
+        # None for the functions not compiled or loaded from an image yet,
+        # see get_constant_fn
         self.constants_fn = constants_fn
+        self.fn_loader = None
+        self.constants_int = constants_int or []
+        # slots of the locals loaded by nested functions, which each call
+        # keeps in a fresh cell
+        self.cellvars = cellvars or []
+        # names of the variables of enclosing functions in the cells of the
+        # closure of the function
+        self.freevars = freevars or []
+        # for each nested function, the cells its closure is made of: the
+        # cell variables first, then the cells of the closure
+        self.closures = closures or [[] for _ in constants_fn]
+        # for each local, the (opcode, arg) loading what it stands for
+        # until it is assigned - the variable of the same name of an
+        # enclosing scope or a builtin - or (LOAD_FAST, itself) if none
+        self.unbound_ops = unbound_ops or [LOAD_FAST] * len(names)
+        self.unbound_args = unbound_args or range(len(names))
+        if co_stacksize < 0:
+            co_stacksize = compute_stacksize(code)
+        self.co_stacksize = co_stacksize
+        # arguments are passed in the first co_argcount slots of names
+        self.co_argcount = co_argcount
         self.co_name = co_name or '__main__'
         self.co_filename = co_filename or '__file__'
         self.co_firstlineno = co_firstlineno or 0
+        # opcodes specialised to the operand types seen at run time, see
+        # interpreter.quicken - mutable, so not used by the JIT
+        self.quickened = [ord(c) for c in code]
+        self.quicken_misses = [0] * len(code)
+        # frames of finished calls, reused by interpreter.Frame.enter
+        self.free_frames = []
+        # the string constants unboxed, property names of the *_ATTR
+        # instructions
+        self.strings = [w_str.to_string() for w_str in constants_string]
+        # inline caches of the *_ATTR instructions, see
+        # interpreter.find_attr - the map last seen at each position, the
+        # index of the property in it and the map after adding the property
+        self.attr_maps = [None] * len(code)
+        self.attr_indexes = [0] * len(code)
+        self.attr_new_maps = [None] * len(code)
+
+    @jit.elidable
+    def get_constant_fn(self, i):
+        fn_bc = self.constants_fn[i]
+        if fn_bc is None:
+            fn_bc = self.fn_loader.load(i)
+            self.constants_fn[i] = fn_bc
+        return fn_bc
 
     def get_repr(self):
         return "<code object %s, file '%s', line %d>" % (
             self.co_name, self.co_filename, self.co_firstlineno + 1)
 
 
+def read_instruction(code, pc):
+    ''' Decode the instruction at pc together with its EXTENDED_ARG
+    prefixes
+    :returns: (opcode, argument, position of the next instruction)
+    '''
+    op = ord(code[pc])
+    arg = ord(code[pc + 1])
+    pc += 2
+    while op == EXTENDED_ARG:
+        op = ord(code[pc])
+        arg = (arg << 8) | ord(code[pc + 1])
+        pc += 2
+    return op, arg, pc
+
+
+def instruction_size(arg):
+    ''' Number of bytes taken by an instruction with argument arg, each
+    EXTENDED_ARG prefix carrying 8 more bits of it
+    '''
+    size = 2
+    while arg > 0xff:
+        arg >>= 8
+        size += 2
+    return size
+
+
+def encode_instruction(chars, op, arg):
+    shift = (instruction_size(arg) - 2) * 4
+    while shift > 0:
+        chars.append(chr(EXTENDED_ARG))
+        chars.append(chr((arg >> shift) & 0xff))
+        shift -= 8
+    chars.append(chr(op))
+    chars.append(chr(arg & 0xff))
+
+
+def assemble(data):
+    ''' Create the code string from data, a list of opcode and argument
+    pairs in which jump arguments are positions in data
+    '''
+    count = len(data) // 2
+    offsets = [2 * i for i in xrange(count + 1)]
+    while True:  # until jump arguments fit, prefixes only ever get added
+        new_offsets = [0] * (count + 1)
+        changed = False
+        pos = 0
+        for i in xrange(count):
+            new_offsets[i] = pos
+            if pos != offsets[i]:
+                changed = True
+            arg = data[2 * i + 1]
+            if data[2 * i] in JUMPS:
+                arg = offsets[arg // 2]
+            pos += instruction_size(arg)
+        new_offsets[count] = pos
+        if pos != offsets[count]:
+            changed = True
+        offsets = new_offsets
+        if not changed:
+            break
+    chars = []
+    for i in xrange(count):
+        arg = data[2 * i + 1]
+        if data[2 * i] in JUMPS:
+            arg = offsets[arg // 2]
+        encode_instruction(chars, data[2 * i], arg)
+    return ''.join(chars)
+
+
 def dis_to_list(code):
     ''' Disassemble code - for debugging
     '''
     dump = []
-    for i in xrange(0, len(code), 2):
-        dump.append('%s %s' % (dis_one(code[i]), ord(code[i + 1])))
+    pc = 0
+    while pc < len(code):
+        op, arg, pc = read_instruction(code, pc)
+        if op in TWO_OPERANDS:
+            dump.append('%s %s %s' % (bytecodes[op], arg >> 8, arg & 0xff))
+        else:
+            dump.append('%s %s' % (bytecodes[op], arg))
     return dump
 
 
@@ -130,9 +923,10 @@ def dis_to_line(code):
     return ' | '.join(dis_to_list(code))
 
 
-def dis_one(code):
-    return bytecodes[ord(code)]
-
-
 def to_code(bytecode_list):
-    return ''.join([chr(c) for c in bytecode_list])
+    ''' Encode a list of opcode and argument pairs as is
+    '''
+    chars = []
+    for i in xrange(0, len(bytecode_list), 2):
+        encode_instruction(chars, bytecode_list[i], bytecode_list[i + 1])
+    return ''.join(chars)
@@ -0,0 +1,347 @@
+# -*- encoding: utf-8 -*-
+
+
+import os
+
+from rpython.rlib.longlong2float import float2longlong, longlong2float
+from rpython.rlib.rarithmetic import r_uint, r_ulonglong, r_int64, intmask, \
+    longlongmask, LONG_BIT
+from rpython.rlib import rmmap
+from rpython.rlib.rsha import RSHA
+from rpython.rlib.streamio import open_file_as_stream
+
+
+from js import bytecode
+from js.base_objects import OperationalError, W_FloatObject, newint, \
+    newstring
+
+
+MAGIC = 'JSC'
+
+# bump whenever the format or the meaning of the bytecode changes - the
+# number of opcodes and the word size are checked as well
+FORMAT_VERSION = 5
+
+HEADER = MAGIC + chr(FORMAT_VERSION) + chr(len(bytecode.bytecodes)) + \
+    chr(LONG_BIT)
+
+
+class CacheError(Exception):
+    pass
+
+
+def source_hash(source):
+    return RSHA(source).digest()
+
+
+def cache_path(filename, cache_dir=None):
+    ''' Where the compiled code of filename is cached: next to it, or in
+    cache_dir under a name unique to the path
+    '''
+    if cache_dir is None:
+        return filename + 'c' if filename.endswith('.js') else \
+            filename + '.jsc'
+    basename = filename.split('/')[-1]
+    return '%s/%s-%s.jsc' % (cache_dir, basename,
+                             RSHA(filename).hexdigest()[:12])
+
+
+def load(path, source=None, inline=True):
+    ''' The code cached at path, or None if there is none for source
+    compiled with the calls of small functions inlined or not, as inline
+    says (any source if None, to run a precompiled image by itself).
+
+    The file is mapped into memory rather than read: only the code of the
+    main program is decoded here, nested functions when they are first
+    defined, so that untouched parts of the file are never even paged in
+    '''
+    try:
+        fd = os.open(path, os.O_RDONLY, 0)
+    except OSError:
+        return None
+    try:
+        data = rmmap.mmap(fd, 0, rmmap.MAP_SHARED, rmmap.PROT_READ)
+    except (rmmap.RValueError, rmmap.RTypeError, OSError):
+        return None
+    finally:
+        os.close(fd)
+    try:
+        bc = decode(MMapReader(data), source, inline)
+    except CacheError:
+        data.close()
+        return None
+    if bc.fn_loader is None:
+        data.close()  # no nested function is left to decode from it
+    return bc
+
+
+def store(path, source, bc, inline=True):
+    ''' Cache bc at path, silently giving up if it can not be written, or
+    if a function in it does not compile (the error is reported when it is
+    called, as without the cache)
+    '''
+    try:
+        data = dump(bc, source, inline)
+    except OperationalError:
+        return
+    tmp_path = path + '.tmp'
+    try:
+        f = open_file_as_stream(tmp_path, 'w')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+    except (OSError, IOError):
+        pass
+
+
+def dump(bc, source, inline=True):
+    ''' Serialize bc, the code of the whole source compiled with the calls
+    of small functions inlined or not, with the constant pool its nested
+    functions share
+    '''
+    pool = unit_constants(bc)
+    writer = Writer()
+    writer.chars.append(HEADER)
+    writer.chars.append(source_hash(source))
+    writer.chars.append(chr(int(inline)))
+    writer.write_uint(len(pool.constants_float))
+    for w_float in pool.constants_float:
+        writer.write_float(w_float.floatval)
+    writer.write_uint(len(pool.constants_int))
+    for w_int in pool.constants_int:
+        writer.write_int(w_int.intval)
+    writer.write_uint(len(pool.constants_string))
+    for s in pool.strings:
+        writer.write_str(s)
+    writer.write_code(bc)
+    return ''.join(writer.chars)
+
+
+def unit_constants(bc):
+    ''' The code object with all the constants of the compilation unit of
+    bc, once all its nested functions are compiled: the constant lists of
+    each code object are copies of the pool of the unit at the time it was
+    compiled, so the one compiled last has the longest
+    '''
+    best = bc
+    todo = [bc]
+    while todo:
+        code = todo.pop()
+        if len(code.constants_float) + len(code.constants_int) + \
+                len(code.constants_string) > len(best.constants_float) + \
+                len(best.constants_int) + len(best.constants_string):
+            best = code
+        for i in xrange(len(code.constants_fn)):
+            todo.append(code.get_constant_fn(i))
+    return best
+
+
+def undump(data, source=None, inline=True):
+    ''' Inverse of dump, raising CacheError if data is not the code of
+    source compiled by this version of the interpreter, with the same
+    inline option
+    '''
+    return decode(Reader(data), source, inline)
+
+
+def decode(reader, source, inline):
+    if reader.read_bytes(len(HEADER)) != HEADER:
+        raise CacheError('incompatible cache')
+    digest = reader.read_bytes(20)
+    if source is not None and digest != source_hash(source):
+        raise CacheError('source changed')
+    if reader.read_byte() != int(inline) and source is not None:
+        raise CacheError('compiled with other options')
+    constants_float = [W_FloatObject(reader.read_float())
+                       for _ in xrange(reader.read_uint())]
+    constants_int = [newint(reader.read_int())
+                     for _ in xrange(reader.read_uint())]
+    constants_string = [newstring(reader.read_str())
+                        for _ in xrange(reader.read_uint())]
+    bc = reader.read_code(constants_float, constants_string, constants_int)
+    if reader.pos != reader.length:
+        raise CacheError('trailing data')
+    return bc
+
+
+class Writer(object):
+
+    def __init__(self):
+        self.chars = []
+
+    def write_uint(self, value):
+        value = r_uint(value)
+        while value >= 0x80:
+            self.chars.append(chr(intmask(value & 0x7f) | 0x80))
+            value >>= 7
+        self.chars.append(chr(intmask(value)))
+
+    def write_int(self, value):
+        self.write_uint(value)  # two's complement, as an r_uint
+
+    def write_float(self, value):
+        bits = r_ulonglong(float2longlong(value))
+        for i in xrange(8):
+            self.chars.append(chr(intmask((bits >> (8 * i)) & 0xff)))
+
+    def write_str(self, s):
+        self.write_uint(len(s))
+        self.chars.append(s)
+
+    def write_code(self, bc):
+        self.write_str(bc.code)
+        self.write_uint(len(bc.names))
+        for name in bc.names:
+            self.write_str(name)
+        self.write_uint(len(bc.cellvars))
+        for slot in bc.cellvars:
+            self.write_uint(slot)
+        self.write_uint(len(bc.freevars))
+        for name in bc.freevars:
+            self.write_str(name)
+        for i in xrange(len(bc.names)):
+            self.write_uint(bc.unbound_ops[i])
+            self.write_uint(bc.unbound_args[i])
+        self.write_uint(bc.co_stacksize)
+        self.write_uint(bc.co_argcount)
+        self.write_str(bc.co_name)
+        self.write_str(bc.co_filename)
+        self.write_uint(bc.co_firstlineno)
+        # nested functions are prefixed with their size, to be skipped
+        # until they are needed
+        self.write_uint(len(bc.constants_fn))
+        for i in xrange(len(bc.constants_fn)):
+            closure = bc.closures[i]
+            self.write_uint(len(closure))
+            for index in closure:
+                self.write_uint(index)
+            writer = Writer()
+            writer.write_code(bc.get_constant_fn(i))
+            self.write_str(''.join(writer.chars))
+
+
+class Reader(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.length = len(data)
+        self.pos = 0
+
+    def getslice(self, start, count):
+        return self.data[start:start + count]
+
+    def getbyte(self, pos):
+        return ord(self.data[pos])
+
+    def skip(self, count):
+        if count < 0 or self.pos + count > self.length:
+            raise CacheError('truncated cache')
+        self.pos += count
+
+    def read_bytes(self, count):
+        start = self.pos
+        self.skip(count)
+        return self.getslice(start, count)
+
+    def read_byte(self):
+        self.skip(1)
+        return self.getbyte(self.pos - 1)
+
+    def read_uint(self):
+        value = r_uint(0)
+        shift = 0
+        while True:
+            if shift >= LONG_BIT:
+                raise CacheError('malformed cache')
+            byte = self.read_byte()
+            value |= r_uint(byte & 0x7f) << shift
+            if byte < 0x80:
+                return intmask(value)
+            shift += 7
+
+    def read_int(self):
+        return self.read_uint()
+
+    def read_float(self):
+        bits = r_ulonglong(0)
+        for i in xrange(8):
+            bits |= r_ulonglong(self.read_byte()) << (8 * i)
+        return longlong2float(r_int64(longlongmask(bits)))
+
+    def read_str(self):
+        return self.read_bytes(self.read_uint())
+
+    def read_code(self, constants_float, constants_string, constants_int):
+        code = self.read_str()
+        names = [self.read_str() for _ in xrange(self.read_uint())]
+        cellvars = [self.read_uint() for _ in xrange(self.read_uint())]
+        freevars = [self.read_str() for _ in xrange(self.read_uint())]
+        unbound_ops = [0] * len(names)
+        unbound_args = [0] * len(names)
+        for i in xrange(len(names)):
+            unbound_ops[i] = self.read_uint()
+            unbound_args[i] = self.read_uint()
+        co_stacksize = self.read_uint()
+        co_argcount = self.read_uint()
+        co_name = self.read_str()
+        co_filename = self.read_str()
+        co_firstlineno = self.read_uint()
+        count = self.read_uint()
+        offsets = [0] * count
+        closures = [None] * count
+        for i in xrange(count):
+            closures[i] = [self.read_uint() for _ in xrange(self.read_uint())]
+            size = self.read_uint()
+            offsets[i] = self.pos
+            self.skip(size)
+        bc = bytecode.ByteCode(
+            code, names, constants_float, constants_string,
+            [None] * len(offsets),
+            constants_int=constants_int, cellvars=cellvars,
+            freevars=freevars, closures=closures,
+            unbound_ops=unbound_ops, unbound_args=unbound_args,
+            co_stacksize=co_stacksize, co_argcount=co_argcount,
+            co_name=co_name, co_filename=co_filename,
+            co_firstlineno=co_firstlineno)
+        if offsets:
+            bc.fn_loader = ImageLoader(self, offsets, constants_float,
+                                       constants_string, constants_int)
+        return bc
+
+
+class MMapReader(Reader):
+
+    def __init__(self, data):
+        self.mmap = data
+        self.length = data.len()
+        self.pos = 0
+
+    def getslice(self, start, count):
+        return self.mmap.getslice(start, count)
+
+    def getbyte(self, pos):
+        return ord(self.mmap.getitem(pos))
+
+
+class ImageLoader(bytecode.FunctionLoader):
+
+    ''' Decodes the nested functions of a code object on demand '''
+
+    def __init__(self, reader, offsets, constants_float, constants_string,
+                 constants_int):
+        self.reader = reader
+        self.offsets = offsets
+        self.constants_float = constants_float
+        self.constants_string = constants_string
+        self.constants_int = constants_int
+
+    def load(self, i):
+        self.reader.pos = self.offsets[i]
+        try:
+            return self.reader.read_code(self.constants_float,
+                                         self.constants_string,
+                                         self.constants_int)
+        except CacheError:
+            raise OperationalError('corrupt bytecode image')
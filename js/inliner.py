@@ -0,0 +1,119 @@
+# -*- encoding: utf-8 -*-
+
+
+from js.base_objects import OperationalError
+from js.parser import Block, Stmt, FnDef, LazyBlock, Return, Inlined, \
+    Variable, ConstantNum, ConstantInt, ConstantStr
+
+
+# the most nodes the returned expression of an inlined function may have
+MAX_SIZE = 16
+
+# how deep the calls in the bodies of inlined functions are inlined in turn
+MAX_DEPTH = 3
+
+# longest pre-parsed function body (in characters) that is parsed up front
+# to see whether the function can be inlined
+MAX_BODY_SOURCE = 400
+
+
+class Inliner(object):
+
+    ''' Finds the functions of a program whose calls can be replaced by
+    their body at compile time, which AstNode.fold does with expand.
+
+    Those are the function statements the program starts with - nothing can
+    run before they are all defined - whose body only returns an expression
+    of at most max_size nodes, without calling the function itself. The
+    name of such a function must be bound nowhere else, not even to a local
+    or an argument of another function, so it is that function in every
+    scope from the start. The other variables its body loads must not be
+    bound in any function either, so they mean the same in every caller
+    '''
+
+    def __init__(self, program, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self.bindings = {}  # name -> number of times it is bound
+        self.function_locals = {}  # names bound in some function
+        self.arguments = {}  # name -> the arguments of the function
+        self.bodies = {}  # name -> the expression the function returns
+        self.count = 0  # of the inlined calls, to name their temporaries
+        self.depth = 0  # of the inlined calls being expanded
+        program.collect_bindings(self, False)
+        if isinstance(program, Block):
+            for stmt in program.stmts:
+                if not isinstance(stmt, Stmt) or \
+                        not isinstance(stmt.expr, FnDef):
+                    break
+                self.consider(stmt.expr)
+
+    def bind(self, name, in_function):
+        self.bindings[name] = self.bindings.get(name, 0) + 1
+        if in_function:
+            self.function_locals[name] = None
+
+    def consider(self, fndef):
+        ''' Record fndef if its calls can be inlined '''
+        if self.bindings.get(fndef.name, 0) != 1:
+            return
+        body = fndef.body
+        if isinstance(body, LazyBlock):
+            if body.end - body.start > MAX_BODY_SOURCE:
+                return
+            try:
+                body = body.resolve()
+            except OperationalError:
+                return  # reported on the first call, as usual
+        if not isinstance(body, Block) or len(body.stmts) != 1:
+            return
+        stmt = body.stmts[0]
+        if not isinstance(stmt, Return) or stmt.expr is None:
+            return
+        expr = stmt.expr
+        if expr.inline_size() > self.max_size:
+            return
+        names = {}
+        expr.collect_names(names)
+        for name in names:
+            if name == fndef.name:
+                return  # recursive
+            if name not in fndef.arg_list and name in self.function_locals:
+                return  # may be a local of the caller
+        self.arguments[fndef.name] = fndef.arg_list
+        self.bodies[fndef.name] = expr
+
+    def expand(self, name, args):
+        ''' The folded body of function name, taking args, to replace a call
+        with - or None if it can not be inlined. Constant arguments are put
+        in place, the others are evaluated once into temporary variables.
+        The calls in the body are inlined as well, down to MAX_DEPTH, which
+        also stops functions calling each other
+        '''
+        if name not in self.bodies or self.depth >= MAX_DEPTH:
+            return None
+        arg_list = self.arguments[name]
+        if len(args) != len(arg_list):
+            return None
+        self.count += 1
+        mapping = {}
+        temps = []
+        values = []
+        for i in range(len(args)):
+            arg = args[i]
+            if isinstance(arg, ConstantNum) or isinstance(arg, ConstantInt) \
+                    or isinstance(arg, ConstantStr):
+                mapping[arg_list[i]] = arg
+            else:
+                # not a valid identifier, so it clashes with no variable
+                temp = '%s.%s.%d' % (name, arg_list[i], self.count)
+                mapping[arg_list[i]] = Variable(temp)
+                temps.append(temp)
+                values.append(arg)
+        self.depth += 1
+        try:
+            expr = self.bodies[name].substitute(mapping).fold(self)
+        finally:
+            self.depth -= 1
+        if not temps:
+            return expr
+        return Inlined(temps, values, expr)
@@ -6,90 +6,261 @@ from rpython.rlib import jit
 
 from js import parser
 from js import bytecode
-from js.builtins import BUILTINS
-from js.base_objects import OperationalError
-from js.base_objects import W_FloatObject, W_StringObject, W_Function, W_BuilinFunction
+from js.builtins import BUILTIN_VALUES
+from js.arrays import W_Array
+from js.inliner import Inliner
+from js.base_objects import OperationalError, Arguments, Cell
+from js.base_objects import W_Function, W_BuilinFunction, W_FloatObject, \
+    W_IntObject, W_StringObject, W_Object, w_True, w_False, w_Undefined, \
+    newbool, newint, concat, int_mod, float_div, float_mod
+from rpython.rlib.rarithmetic import ovfcheck
 
 
 def get_printable_location(pc, code, bc):
-    return '%s #%d %s' % (bc.get_repr(), pc, bytecode.dis_one(code[pc]))
+    op, _, _ = bytecode.read_instruction(code, pc)
+    return '%s #%d %s' % (bc.get_repr(), pc, bytecode.bytecodes[op])
 
 
+# the frame is switched on calls and returns inside the interpreter loop,
+# which a virtualizable does not allow - frames that do not escape are
+# removed by the JIT's allocation removal instead
 jitdriver = jit.JitDriver(
     greens=['pc', 'code', 'bc'],
     reds=['frame'],
-    virtualizables=['frame'],
     get_printable_location=get_printable_location)
 
 
-class Frame(object):
+# maximum number of nested JS calls
+MAX_CALL_DEPTH = 10000
+
+# maximum number of finished frames kept for reuse per code object
+MAX_FREE_FRAMES = 16
+
+
+class Stats(object):
+
+    ''' Allocation counters of the interpreter '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.frames_allocated = 0
+        self.frames_reused = 0
+        self.functions_allocated = 0
 
-    _virtualizable2_ = ['valuestack[*]', 'valuestack_pos', 'vars[*]',
-                        'names[*]', 'parent']
 
-    def __init__(self, bc, parent=None):
-        self = jit.hint(self, fresh_virtualizable=True, access_directly=True)
-        self.valuestack = [None] * 10  # TODO - get upper bound staticaly
-        # TODO - or maybe have even smaller initial estimate and resize when
-        # needed?
-        self.valuestack_pos = 0
+stats = Stats()
+
+
+class Frame(object):
+
+    def __init__(self, bc, global_frame=None, closure=None, back=None,
+                 max_call_depth=MAX_CALL_DEPTH):
+        stats.frames_allocated += 1
+        self.bc = bc
+        # local variables followed by the value stack, in one array
+        self.nlocals = len(bc.names)
+        self.locals_stack = [None] * (self.nlocals + bc.co_stacksize)
         self.names = bc.names
-        self.vars = [None] * len(bc.names)
-        self.parent = parent
+        # the cells of bc.cellvars, fresh for each call, see make_cells
+        self.cells = [None] * len(bc.cellvars)
+        self.activate(global_frame, closure, back, max_call_depth)
+
+    def activate(self, global_frame, closure, back,
+                 max_call_depth=MAX_CALL_DEPTH):
+        self.valuestack_pos = self.nlocals
+        if global_frame is None:
+            self.global_frame = self
+        else:
+            self.global_frame = global_frame
+        # the cells of bc.freevars, of the function called
+        self.closure = closure
+        # calling frame and where to continue in it
+        self.back = back
+        self.pc = 0
+        if back is None:
+            self.calls_left = max_call_depth
+        else:
+            self.calls_left = back.calls_left - 1
 
     def push(self, v):
         pos = self.valuestack_pos
         assert pos >= 0
-        self.valuestack[pos] = v
+        self.locals_stack[pos] = v
         self.valuestack_pos = pos + 1
 
     def pop(self):
         new_pos = self.valuestack_pos - 1
         assert new_pos >= 0
-        v = self.valuestack[new_pos]
+        v = self.locals_stack[new_pos]
         self.valuestack_pos = new_pos
         return v
 
-    def lookup(self, arg):
-        value = self._lookup(arg)
+    def load_fast(self, arg):
+        value = self.locals_stack[arg]
         if value is None:
-            name = self.names[arg]
-            value = BUILTINS.get(name, None)
-            if value is None:
-                raise OperationalError('Variable "%s" is not defined' % name)
+            return self.load_unbound(arg)
         return value
 
-    def _lookup(self, arg):
-        value = self.vars[arg]
-        if value is not None:
-            return value
-        if self.parent is not None:
-            name = self.names[arg]
-            return self.parent.lookup_by_name(name)
-
-    def lookup_by_name(self, name):
-        # linear search
-        for i, n in enumerate(self.names):
-            if n == name:
-                return self.vars[i]
-        if self.parent:
-            return self.parent.lookup_by_name(name)
+    def load_unbound(self, slot):
+        ''' The value of the local in slot before it is first assigned: the
+        variable of the same name of an enclosing scope, or a builtin
+        '''
+        op = self.bc.unbound_ops[slot]
+        arg = self.bc.unbound_args[slot]
+        if op == bytecode.LOAD_DEREF:
+            return self.load_deref(arg)
+        elif op == bytecode.LOAD_GLOBAL:
+            return self.global_frame.load_fast(arg)
+        elif op == bytecode.LOAD_BUILTIN:
+            return BUILTIN_VALUES[arg]
+        raise OperationalError(
+            'Variable "%s" is not defined' % self.names[slot])
 
     @jit.unroll_safe
-    def call(self, fn, arg_list):
-        frame = Frame(fn.bytecode, parent=fn.parent_frame)
-        for i, value in enumerate(arg_list):
-            frame.vars[i] = value
-        return execute(frame, fn.bytecode)
+    def make_cells(self):
+        ''' Create the cells of the call, those of arguments holding their
+        value
+        '''
+        cellvars = self.bc.cellvars
+        for i in xrange(len(cellvars)):
+            self.cells[i] = Cell(self.locals_stack[cellvars[i]])
+
+    def load_cell(self, arg):
+        w_value = self.cells[arg].w_value
+        if w_value is None:
+            return self.load_unbound(self.bc.cellvars[arg])
+        return w_value
+
+    def load_deref(self, arg):
+        w_value = self.closure[arg].w_value
+        if w_value is None:
+            raise OperationalError('Variable "%s" is not defined' %
+                                   self.bc.freevars[arg])
+        return w_value
+
+    @jit.unroll_safe
+    def make_closure(self, index):
+        ''' The cells of the closure of nested function index '''
+        indexes = self.bc.closures[index]
+        ncells = len(self.cells)
+        closure = [None] * len(indexes)
+        for i in xrange(len(indexes)):
+            if indexes[i] < ncells:
+                closure[i] = self.cells[indexes[i]]
+            else:
+                closure[i] = self.closure[indexes[i] - ncells]
+        return closure
+
+    def pop_values(self, n):
+        ''' Pop the top n values of the stack, as a list in stack order '''
+        stop = self.valuestack_pos
+        start = stop - n
+        assert start >= 0
+        assert stop >= 0
+        values_w = self.locals_stack[start:stop]
+        self.valuestack_pos = start
+        return values_w
+
+    def peek(self, depth):
+        pos = self.valuestack_pos - 1 - depth
+        assert pos >= 0
+        return self.locals_stack[pos]
+
+    def call_builtin(self, fn, nargs):
+        ''' Call fn with the top nargs values of the stack, replacing them
+        and fn with the result
+        '''
+        start = self.valuestack_pos - nargs
+        w_res = fn.call(Arguments(self.locals_stack, start, nargs))
+        self.valuestack_pos = start - 1
+        self.push(w_res)
+
+    def enter(self, fn, nargs, pc):
+        ''' Create the frame of a call to fn with the top nargs values of
+        the stack, to continue at pc in this frame when it returns
+        '''
+        if self.calls_left <= 0:
+            raise OperationalError(
+                'RangeError: Maximum call stack size exceeded')
+        self.pc = pc
+        return self.call_frame(fn, nargs, self)
+
+    def tail_enter(self, fn, nargs):
+        ''' Like enter, for a call whose result this frame returns: the
+        frame of the call replaces this one, which is kept for reuse, so
+        that tail calls take no stack
+        '''
+        frame = self.call_frame(fn, nargs, self.back)
+        self.back = None
+        self.release()
+        return frame
+
+    @jit.unroll_safe
+    def call_frame(self, fn, nargs, back):
+        ''' The frame of a call to fn with the top nargs values of the
+        stack, returning to back
+        '''
+        bc = fn.get_bytecode()
+        ncopy = min(nargs, bc.co_argcount)
+        if bc.free_frames and not jit.we_are_jitted():
+            stats.frames_reused += 1
+            frame = bc.free_frames.pop()
+            frame.activate(fn.global_frame, fn.closure, back)
+            for i in xrange(ncopy, frame.nlocals):
+                frame.locals_stack[i] = None
+        else:
+            frame = Frame(bc, global_frame=fn.global_frame,
+                          closure=fn.closure, back=back)
+        # the arguments go straight from this value stack to the locals
+        start = self.valuestack_pos - nargs
+        assert start >= 1
+        for i in xrange(ncopy):
+            frame.locals_stack[i] = self.locals_stack[start + i]
+        for i in xrange(ncopy, bc.co_argcount):
+            frame.locals_stack[i] = w_Undefined  # missing arguments
+        if bc.cellvars:
+            frame.make_cells()
+        self.valuestack_pos = start - 1
+        return frame
+
+    def leave(self, w_result):
+        ''' Return w_result to the calling frame, and keep this frame for
+        reuse - closures only keep the cells of its variables
+        :returns: the calling frame
+        '''
+        back = self.back
+        self.back = None
+        back.push(w_result)
+        self.release()
+        return back
+
+    def release(self):
+        ''' Keep this finished frame for reuse '''
+        if not jit.we_are_jitted():
+            free_frames = self.bc.free_frames
+            if len(free_frames) < MAX_FREE_FRAMES:
+                self.closure = None
+                free_frames.append(self)
+
+    @property
+    def vars(self):
+        ''' NOT_RPYTHON '''
+
+        return self.locals_stack[:self.nlocals]
 
     @property
     def test_valuestack(self):
         ''' NOT_RPYTHON '''
 
-        return self.valuestack[:self.valuestack_pos]
+        return self.locals_stack[self.nlocals:self.valuestack_pos]
 
 
 def execute(frame, bc):  # noqa
+    ''' Run frame until it returns. Calls and returns switch frames
+    inside this loop, so JS calls do not use the host stack
+    '''
     code = bc.code
     pc = 0
     while True:
@@ -98,100 +269,521 @@ def execute(frame, bc):  # noqa
         c = ord(code[pc])
         arg = ord(code[pc + 1])
         pc += 2
+        while c == bytecode.EXTENDED_ARG:
+            c = ord(code[pc])
+            arg = (arg << 8) | ord(code[pc + 1])
+            pc += 2
+        if not jit.we_are_jitted():
+            c = bc.quickened[pc - 2]
+
+        # quickened variants, each guarding on the operand types it was
+        # specialised for - checked first, they are the hottest
+        if c >= bytecode.FIRST_QUICKENED:
+            if c == bytecode.JUMP_IF_NOT_LT_INT:
+                right = frame.pop()
+                left = frame.pop()
+                if isinstance(left, W_IntObject) and \
+                        isinstance(right, W_IntObject):
+                    if not left.intval < right.intval:
+                        pc = arg
+                else:
+                    dequicken(bc, pc - 2)
+                    if not left.lt_bool(right):
+                        pc = arg
+            elif c == bytecode.INCR_FAST_INT:
+                slot = arg >> 8
+                w_incr = bc.constants_int[arg & 0xff]
+                w_value = frame.load_fast(slot)
+                if isinstance(w_value, W_IntObject):
+                    try:
+                        w_res = newint(ovfcheck(
+                            w_value.intval + w_incr.intval))
+                    except OverflowError:
+                        w_res = w_value.add(w_incr)
+                else:
+                    dequicken(bc, pc - 2)
+                    w_res = w_value.add(w_incr)
+                frame.locals_stack[slot] = w_res
+            elif c == bytecode.BINARY_ADD_INT:
+                right = frame.pop()
+                left = frame.pop()
+                if isinstance(left, W_IntObject) and \
+                        isinstance(right, W_IntObject):
+                    try:
+                        w_res = newint(ovfcheck(left.intval + right.intval))
+                    except OverflowError:
+                        w_res = left.add(right)
+                else:
+                    dequicken(bc, pc - 2)
+                    w_res = left.add(right)
+                frame.push(w_res)
+            elif c == bytecode.BINARY_SUB_INT:
+                right = frame.pop()
+                left = frame.pop()
+                if isinstance(left, W_IntObject) and \
+                        isinstance(right, W_IntObject):
+                    try:
+                        w_res = newint(ovfcheck(left.intval - right.intval))
+                    except OverflowError:
+                        w_res = left.sub(right)
+                else:
+                    dequicken(bc, pc - 2)
+                    w_res = left.sub(right)
+                frame.push(w_res)
+            elif c == bytecode.BINARY_MUL_INT:
+                right = frame.pop()
+                left = frame.pop()
+                w_res = None
+                if isinstance(left, W_IntObject) and \
+                        isinstance(right, W_IntObject):
+                    x = left.intval
+                    y = right.intval
+                    # a zero product of a negative number is -0, a float
+                    if (x != 0 and y != 0) or (x >= 0 and y >= 0):
+                        try:
+                            w_res = newint(ovfcheck(x * y))
+                        except OverflowError:
+                            pass
+                else:
+                    dequicken(bc, pc - 2)
+                if w_res is None:
+                    w_res = left.mul(right)
+                frame.push(w_res)
+            elif c == bytecode.BINARY_LT_INT:
+                right = frame.pop()
+                left = frame.pop()
+                if isinstance(left, W_IntObject) and \
+                        isinstance(right, W_IntObject):
+                    frame.push(newbool(left.intval < right.intval))
+                else:
+                    dequicken(bc, pc - 2)
+                    frame.push(left.lt(right))
+            elif c == bytecode.BINARY_EQ_INT:
+                right = frame.pop()
+                left = frame.pop()
+                if isinstance(left, W_IntObject) and \
+                        isinstance(right, W_IntObject):
+                    frame.push(newbool(left.intval == right.intval))
+                else:
+                    dequicken(bc, pc - 2)
+                    frame.push(left.eq(right))
+            elif c == bytecode.BINARY_MOD_INT:
+                right = frame.pop()
+                left = frame.pop()
+                if isinstance(left, W_IntObject) and \
+                        isinstance(right, W_IntObject):
+                    frame.push(int_mod(left.intval, right.intval))
+                else:
+                    dequicken(bc, pc - 2)
+                    frame.push(left.mod(right))
+            elif c == bytecode.JUMP_IF_NOT_LT_FLOAT:
+                right = frame.pop()
+                left = frame.pop()
+                if float_operands(left, right):
+                    if not left.get_floatval() < right.get_floatval():
+                        pc = arg
+                else:
+                    dequicken(bc, pc - 2)
+                    if not left.lt_bool(right):
+                        pc = arg
+            elif c == bytecode.BINARY_ADD_FLOAT:
+                right = frame.pop()
+                left = frame.pop()
+                if float_operands(left, right):
+                    frame.push(W_FloatObject(
+                        left.get_floatval() + right.get_floatval()))
+                else:
+                    dequicken(bc, pc - 2)
+                    frame.push(left.add(right))
+            elif c == bytecode.BINARY_SUB_FLOAT:
+                right = frame.pop()
+                left = frame.pop()
+                if float_operands(left, right):
+                    frame.push(W_FloatObject(
+                        left.get_floatval() - right.get_floatval()))
+                else:
+                    dequicken(bc, pc - 2)
+                    frame.push(left.sub(right))
+            elif c == bytecode.BINARY_MUL_FLOAT:
+                right = frame.pop()
+                left = frame.pop()
+                if float_operands(left, right):
+                    frame.push(W_FloatObject(
+                        left.get_floatval() * right.get_floatval()))
+                else:
+                    dequicken(bc, pc - 2)
+                    frame.push(left.mul(right))
+            elif c == bytecode.BINARY_DIV_FLOAT:
+                right = frame.pop()
+                left = frame.pop()
+                if float_operands(left, right):
+                    frame.push(W_FloatObject(
+                        float_div(left.get_floatval(), right.get_floatval())))
+                else:
+                    dequicken(bc, pc - 2)
+                    frame.push(left.div(right))
+            elif c == bytecode.BINARY_LT_FLOAT:
+                right = frame.pop()
+                left = frame.pop()
+                if float_operands(left, right):
+                    frame.push(newbool(
+                        left.get_floatval() < right.get_floatval()))
+                else:
+                    dequicken(bc, pc - 2)
+                    frame.push(left.lt(right))
+            elif c == bytecode.BINARY_EQ_FLOAT:
+                right = frame.pop()
+                left = frame.pop()
+                if float_operands(left, right):
+                    frame.push(newbool(
+                        left.get_floatval() == right.get_floatval()))
+                else:
+                    dequicken(bc, pc - 2)
+                    frame.push(left.eq(right))
+            elif c == bytecode.BINARY_MOD_FLOAT:
+                right = frame.pop()
+                left = frame.pop()
+                if float_operands(left, right):
+                    frame.push(W_FloatObject(
+                        float_mod(left.get_floatval(), right.get_floatval())))
+                else:
+                    dequicken(bc, pc - 2)
+                    frame.push(left.mod(right))
+            elif c == bytecode.BINARY_ADD_STRING:
+                right = frame.pop()
+                left = frame.pop()
+                if isinstance(left, W_StringObject) and \
+                        isinstance(right, W_StringObject):
+                    frame.push(concat(left, right))
+                else:
+                    dequicken(bc, pc - 2)
+                    frame.push(left.add(right))
+            else:
+                assert False
 
-        if c == bytecode.LOAD_CONSTANT_FLOAT:
-            frame.push(W_FloatObject(bc.constants_float[arg]))
+        elif c == bytecode.LOAD_CONSTANT_FLOAT:
+            frame.push(bc.constants_float[arg])
+        elif c == bytecode.LOAD_CONSTANT_INT:
+            frame.push(bc.constants_int[arg])
         elif c == bytecode.LOAD_CONSTANT_STRING:
-            frame.push(W_StringObject(bc.constants_string[arg]))
+            frame.push(bc.constants_string[arg])
         elif c == bytecode.LOAD_CONSTANT_FN:
-            frame.push(W_Function(bc.constants_fn[arg], frame))
-        elif c == bytecode.LOAD_VAR:
-            frame.push(frame.lookup(arg))
+            stats.functions_allocated += 1
+            frame.push(W_Function(bc, arg, frame.make_closure(arg),
+                                  frame.global_frame))
+        elif c == bytecode.LOAD_FAST:
+            frame.push(frame.load_fast(arg))
+        elif c == bytecode.LOAD_DEREF:
+            frame.push(frame.load_deref(arg))
+        elif c == bytecode.LOAD_CELL:
+            frame.push(frame.load_cell(arg))
+        elif c == bytecode.STORE_CELL:
+            frame.cells[arg].w_value = frame.pop()
+        elif c == bytecode.LOAD_GLOBAL:
+            frame.push(frame.global_frame.load_fast(arg))
+        elif c == bytecode.LOAD_BUILTIN:
+            frame.push(BUILTIN_VALUES[arg])
         elif c == bytecode.ASSIGN:
-            frame.vars[arg] = frame.pop()
+            frame.locals_stack[arg] = frame.pop()
         elif c == bytecode.DISCARD_TOP:
             frame.pop()
+        elif c == bytecode.NEW_ARRAY:
+            frame.push(W_Array.from_values(frame.pop_values(arg)))
+        elif c == bytecode.LOAD_ITEM:
+            w_index = frame.pop()
+            w_obj = frame.pop()
+            frame.push(w_obj.get_item(w_index))
+        elif c == bytecode.STORE_ITEM:
+            w_value = frame.pop()
+            w_index = frame.pop()
+            w_obj = frame.pop()
+            w_obj.set_item(w_index, w_value)
+        elif c == bytecode.NEW_OBJECT:
+            frame.push(W_Object())
+        elif c == bytecode.INIT_ATTR:
+            w_value = frame.pop()
+            w_obj = frame.peek(0)
+            assert isinstance(w_obj, W_Object)
+            store_attr(bc, pc - 2, w_obj, bc.strings[arg], w_value)
+        elif c == bytecode.LOAD_ATTR:
+            w_obj = frame.pop()
+            name = bc.strings[arg]
+            if isinstance(w_obj, W_Object):
+                index = find_attr(bc, pc - 2, w_obj.map, name)
+                if index < 0:
+                    frame.push(w_Undefined)
+                else:
+                    frame.push(w_obj.storage[index])
+            else:
+                frame.push(w_obj.get_property(name))
+        elif c == bytecode.STORE_ATTR:
+            w_value = frame.pop()
+            w_obj = frame.pop()
+            name = bc.strings[arg]
+            if isinstance(w_obj, W_Object):
+                store_attr(bc, pc - 2, w_obj, name, w_value)
+            else:
+                w_obj.set_property(name, w_value)
 
         # TODO - remove repition
         elif c == bytecode.BINARY_ADD:
             right = frame.pop()
             left = frame.pop()
+            if not jit.we_are_jitted():
+                quicken(bc, pc - 2, c, left, right)
             w_res = left.add(right)
             frame.push(w_res)
         elif c == bytecode.BINARY_SUB:
             right = frame.pop()
             left = frame.pop()
+            if not jit.we_are_jitted():
+                quicken(bc, pc - 2, c, left, right)
             frame.push(left.sub(right))
         elif c == bytecode.BINARY_MUL:
             right = frame.pop()
             left = frame.pop()
+            if not jit.we_are_jitted():
+                quicken(bc, pc - 2, c, left, right)
             frame.push(left.mul(right))
         elif c == bytecode.BINARY_DIV:
             right = frame.pop()
             left = frame.pop()
+            if not jit.we_are_jitted():
+                quicken(bc, pc - 2, c, left, right)
             frame.push(left.div(right))
         elif c == bytecode.BINARY_LT:
             right = frame.pop()
             left = frame.pop()
+            if not jit.we_are_jitted():
+                quicken(bc, pc - 2, c, left, right)
             frame.push(left.lt(right))
         elif c == bytecode.BINARY_EQ:
             right = frame.pop()
             left = frame.pop()
+            if not jit.we_are_jitted():
+                quicken(bc, pc - 2, c, left, right)
             frame.push(left.eq(right))
         elif c == bytecode.BINARY_MOD:
             right = frame.pop()
             left = frame.pop()
+            if not jit.we_are_jitted():
+                quicken(bc, pc - 2, c, left, right)
             frame.push(left.mod(right))
+
         elif c == bytecode.JUMP_IF_FALSE:
-            if not frame.pop().is_true():
+            w_cond = frame.pop()
+            if w_cond is w_False or (
+                    w_cond is not w_True and not w_cond.is_true()):
                 pc = arg
         elif c == bytecode.JUMP_ABSOLUTE:
             pc = arg
+        elif c == bytecode.JUMP_IF_NOT_LT:
+            right = frame.pop()
+            left = frame.pop()
+            if not jit.we_are_jitted():
+                quicken(bc, pc - 2, c, left, right)
+            if not left.lt_bool(right):
+                pc = arg
+        elif c == bytecode.JUMP_IF_NOT_EQ:
+            right = frame.pop()
+            left = frame.pop()
+            if not left.eq_bool(right):
+                pc = arg
+        elif c == bytecode.INCR_FAST:
+            slot = arg >> 8
+            w_incr = bc.constants_int[arg & 0xff]
+            w_value = frame.load_fast(slot)
+            if not jit.we_are_jitted():
+                quicken(bc, pc - 2, c, w_value, w_incr)
+            frame.locals_stack[slot] = w_value.add(w_incr)
+        elif c == bytecode.LOAD_FAST_FAST:
+            frame.push(frame.load_fast(arg >> 8))
+            frame.push(frame.load_fast(arg & 0xff))
         elif c == bytecode.CALL:
-            arg_list = pop_args(frame, arg)
-            fn = frame.pop()
+            fn = frame.peek(arg)
             if isinstance(fn, W_BuilinFunction):
-                frame.push(fn.call(arg_list))
+                frame.call_builtin(fn, arg)
             else:
-                frame.push(frame.call(fn, arg_list))
+                if not isinstance(fn, W_Function):
+                    raise OperationalError('TypeError: not a function')
+                frame = frame.enter(fn, arg, pc)
+                bc = frame.bc
+                code = bc.code
+                pc = 0
+        elif c == bytecode.TAIL_CALL:
+            fn = frame.peek(arg)
+            if isinstance(fn, W_BuilinFunction):
+                frame.call_builtin(fn, arg)
+                frame = frame.leave(frame.pop())
+                pc = frame.pc
+            else:
+                if not isinstance(fn, W_Function):
+                    raise OperationalError('TypeError: not a function')
+                frame = frame.tail_enter(fn, arg)
+                pc = 0
+            bc = frame.bc
+            code = bc.code
         elif c == bytecode.RETURN:
             if arg:
-                return frame.pop()
+                w_result = frame.pop()
             else:
-                return None  # TODO - undefined
+                w_result = w_Undefined
+            if frame.back is None:
+                return w_result
+            frame = frame.leave(w_result)
+            bc = frame.bc
+            code = bc.code
+            pc = frame.pc
+        elif c == bytecode.RETURN_BINARY:
+            right = frame.pop()
+            left = frame.pop()
+            w_result = binary_op(arg, left, right)
+            if frame.back is None:
+                return w_result
+            frame = frame.leave(w_result)
+            bc = frame.bc
+            code = bc.code
+            pc = frame.pc
         else:
             assert False
 
 
-@jit.unroll_safe
-def pop_args(frame, n_args):
-    arg_list = []
-    for _ in xrange(n_args):
-        arg_list.append(frame.pop())
-    return arg_list
-
-
-def interpret(bc):
-    frame = Frame(bc)
+def quicken(bc, pos, op, left, right):
+    ''' Specialise the instruction at pos in bc.quickened to the operand
+    types it has just been executed with
+    '''
+    if bc.quicken_misses[pos] >= bytecode.MAX_QUICKEN_MISSES:
+        return
+    if isinstance(left, W_IntObject) and isinstance(right, W_IntObject):
+        variants = bytecode.INT_VARIANTS
+    elif float_operands(left, right):
+        variants = bytecode.FLOAT_VARIANTS
+    elif isinstance(left, W_StringObject) and \
+            isinstance(right, W_StringObject):
+        variants = bytecode.STRING_VARIANTS
+    else:
+        variants = None
+    if variants is not None and op in variants:
+        bc.quickened[pos] = variants[op]
+    else:
+        # no variant for these operands, stop trying after a few runs
+        bc.quicken_misses[pos] += 1
+
+
+def float_operands(left, right):
+    ''' Whether the FLOAT variants compute op on left and right: numbers,
+    at least one of them a float (the sum of two ints is an int)
+    '''
+    if isinstance(left, W_FloatObject):
+        return isinstance(right, W_FloatObject) or \
+            isinstance(right, W_IntObject)
+    return isinstance(left, W_IntObject) and isinstance(right, W_FloatObject)
+
+
+def dequicken(bc, pos):
+    ''' The guard of a quickened instruction failed, go back to the generic
+    instruction (which may quicken again, up to MAX_QUICKEN_MISSES times)
+    '''
+    bc.quickened[pos] = bytecode.GENERIC[bc.quickened[pos]]
+    bc.quicken_misses[pos] += 1
+
+
+def find_attr(bc, pos, map, name):
+    ''' Index of property name in objects with map, through the inline
+    cache of the *_ATTR instruction at pos - a monomorphic instruction only
+    compares the map. Traces specialise on the map instead
+    '''
+    if jit.we_are_jitted():
+        return jit.promote(map).find_index(name)
+    if bc.attr_maps[pos] is not map:
+        bc.attr_maps[pos] = map
+        bc.attr_indexes[pos] = map.find_index(name)
+        bc.attr_new_maps[pos] = None
+    return bc.attr_indexes[pos]
+
+
+def store_attr(bc, pos, w_obj, name, w_value):
+    map = w_obj.map
+    index = find_attr(bc, pos, map, name)
+    if index >= 0:
+        w_obj.storage[index] = w_value
+        return
+    if jit.we_are_jitted():
+        new_map = jit.promote(map).with_property(name)
+    else:
+        new_map = bc.attr_new_maps[pos]
+        if new_map is None:
+            new_map = map.with_property(name)
+            bc.attr_new_maps[pos] = new_map
+    w_obj.add_property(new_map, w_value)
+
+
+def binary_op(op, left, right):
+    if op == bytecode.BINARY_ADD:
+        return left.add(right)
+    elif op == bytecode.BINARY_SUB:
+        return left.sub(right)
+    elif op == bytecode.BINARY_MUL:
+        return left.mul(right)
+    elif op == bytecode.BINARY_DIV:
+        return left.div(right)
+    elif op == bytecode.BINARY_LT:
+        return left.lt(right)
+    elif op == bytecode.BINARY_EQ:
+        return left.eq(right)
+    elif op == bytecode.BINARY_MOD:
+        return left.mod(right)
+    assert False
+
+
+def interpret(bc, max_call_depth=MAX_CALL_DEPTH):
+    frame = Frame(bc, max_call_depth=max_call_depth)
     execute(frame, bc)
     return frame
 
 
-def interpret_source(source, filename=None):
-    ast = parser.parse(source, filename=filename)
-    bc = bytecode.CompilerContext.compile_ast(ast)
-    return interpret(bc)
+def interpret_source(source, filename=None, optimize=True, lazy=True,
+                     inline=True, max_call_depth=MAX_CALL_DEPTH):
+    ast = parser.parse(source, filename=filename, lazy=lazy)
+    bc = bytecode.CompilerContext.compile_ast(
+        ast, optimize=optimize, lazy=lazy,
+        inliner=Inliner(ast) if inline and optimize else None)
+    return interpret(bc, max_call_depth=max_call_depth)
 
 
-def run(source, filename=None):
+def run(source, filename=None, optimize=True,
+        max_call_depth=MAX_CALL_DEPTH):
+    bc = compile_source(source, filename=filename, optimize=optimize)
+    if bc is None:
+        return 1
+    return run_bytecode(bc, max_call_depth=max_call_depth)
+
+
+def compile_source(source, filename=None, optimize=True, lazy=True,
+                   inline=True):
+    ''' Compile source, reporting syntax errors - the bodies of functions
+    are only pre-parsed, and parsed and compiled when they are first called
+    (so syntax errors in them are only reported then), unless lazy is False.
+    The calls of small functions are inlined (see js.inliner) when
+    optimizing, unless inline is False
+    :returns: the bytecode, or None if the source has errors
+    '''
     try:
-        interpret_source(source, filename=filename)
+        ast = parser.parse(source, filename=filename, lazy=lazy)
     except parser.LexerError as e:
         print 'LexerError', e
-        return 1
+        return None
     except parser.ParseError as e:
         print 'ParseError', e
-        return 1
+        return None
+    return bytecode.CompilerContext.compile_ast(
+        ast, optimize=optimize, lazy=lazy,
+        inliner=Inliner(ast) if inline and optimize else None)
+
+
+def run_bytecode(bc, max_call_depth=MAX_CALL_DEPTH):
+    try:
+        interpret(bc, max_call_depth=max_call_depth)
     except OperationalError as e:
         print e
         return 1
@@ -0,0 +1,261 @@
+# -*- encoding: utf-8 -*-
+
+
+from rpython.rlib.parsing.deterministic import LexerError
+from rpython.rlib.parsing.lexer import SourcePos
+from rpython.rlib.parsing.parsing import ParseError, ErrorInformation
+
+
+# token kinds besides the punctuation and keywords, which are their own kind
+NUMBER = 'NUMBER'
+STRING = 'STRING'
+VARIABLE = 'VARIABLE'
+ADD_OPER = 'ADD_OPER'
+MULT_OPER = 'MULT_OPER'
+COMP_OPER = 'COMP_OPER'
+EOF = 'EOF'
+BODY = 'BODY'  # a function body, only pre-parsed
+
+KEYWORDS = {
+    'while': None,
+    'if': None,
+    'else': None,
+    'return': None,
+    'function': None,
+}
+
+PUNCTUATION = '(){}[],;.:'
+
+
+class Token(object):
+
+    ''' A token of kind, its text starting at index i of the source, on line
+    lineno and column columnno (both counting from 0)
+    '''
+
+    _immutable_fields_ = ['kind', 'text', 'i', 'lineno', 'columnno']
+
+    def __init__(self, kind, text, i, lineno, columnno):
+        self.kind = kind
+        self.text = text
+        self.i = i
+        self.lineno = lineno
+        self.columnno = columnno
+
+    def getsourcepos(self):
+        return SourcePos(self.i, self.lineno, self.columnno)
+
+    def __repr__(self):
+        ''' NOT_RPYTHON '''
+        return 'Token(%r, %r)' % (self.kind, self.text)
+
+
+class BodyToken(Token):
+
+    ''' The body of a function, from its opening brace at index i of source
+    up to end, with the names in it and those it may bind
+    '''
+
+    _immutable_fields_ = ['source', 'end', 'names', 'bound']
+
+    def __init__(self, source, i, end, lineno, columnno, names, bound):
+        Token.__init__(self, BODY, '{', i, lineno, columnno)
+        self.source = source
+        self.end = end
+        self.names = names
+        self.bound = bound
+
+
+def tokenize(source, start=0, end=-1, lineno=0, columnno=0, lazy=False):
+    ''' The tokens of source, ending with an EOF token, split the same way
+    as the NUMBER, STRING, VARIABLE and operator regexes of grammar.txt
+    would: the longest match wins, keywords over variables. Only the part
+    from start to end is read, starting at line lineno and column columnno.
+
+    If lazy is True, function bodies are only pre-parsed into a BodyToken
+    each, see skip_body
+    '''
+    tokens = []
+    length = len(source) if end < 0 else end
+    i = start
+    linestart = start - columnno
+    in_function = False
+    while i < length:
+        c = source[i]
+        first = i
+        if c == '\n':
+            i += 1
+            lineno += 1
+            linestart = i
+            continue
+        elif c == ' ' or c == '\t':
+            i += 1
+            continue
+        elif is_digit(c) or (c == '.' and i + 1 < length and
+                             is_digit(source[i + 1])):
+            i = scan_number(source, i)
+            kind = NUMBER
+        elif is_name_start(c):
+            i += 1
+            while i < length and is_name_char(source[i]):
+                i += 1
+            kind = VARIABLE
+            if source[first:i] in KEYWORDS:
+                kind = source[first:i]
+        elif c == '"':
+            i += 1
+            while i < length and source[i] != '"':
+                if source[i] == '\\':
+                    i += 1
+                i += 1
+            if i >= length:
+                raise LexerError(source, -1,
+                                 SourcePos(first, lineno, first - linestart))
+            i += 1
+            kind = STRING
+        elif c == '+' or c == '-':
+            i += 1
+            kind = ADD_OPER
+        elif c == '*' or c == '/' or c == '%':
+            i += 1
+            kind = MULT_OPER
+        elif c == '<' or c == '>' or c == '=' or c == '!':
+            i += 1
+            if i < length and source[i] == '=':
+                i += 1
+                kind = COMP_OPER
+            elif c == '=':
+                kind = '='
+            elif c == '!':
+                raise LexerError(source, -1,
+                                 SourcePos(first, lineno, first - linestart))
+            else:
+                kind = COMP_OPER
+        elif c == '{' and in_function:
+            names = {}
+            bound = {}
+            token_lineno = lineno
+            token_columnno = first - linestart
+            i, lineno, linestart = skip_body(source, i, length, lineno,
+                                             linestart, names, bound)
+            tokens.append(BodyToken(source, first, i, token_lineno,
+                                    token_columnno, names, bound))
+            in_function = False
+            continue
+        elif c in PUNCTUATION:
+            i += 1
+            kind = c
+        else:
+            raise LexerError(source, -1,
+                             SourcePos(first, lineno, first - linestart))
+        tokens.append(Token(kind, source[first:i], first, lineno,
+                            first - linestart))
+        if kind == 'function':
+            in_function = lazy
+        # strings may span lines
+        if kind == STRING:
+            for j in xrange(first, i):
+                if source[j] == '\n':
+                    lineno += 1
+                    linestart = j + 1
+    tokens.append(Token(EOF, 'EOF', length, lineno, length - linestart))
+    return tokens
+
+
+def skip_body(source, i, length, lineno, linestart, names, bound):
+    ''' Pre-parse the function body starting with the brace at i: only
+    check that its brackets match up (skipping strings), adding the names in
+    it to names. The names it may bind - those followed by an =, and the
+    names and arguments of nested functions - are added to bound as well.
+    :returns: (index, lineno, linestart) after its closing brace
+    '''
+    brackets = []
+    in_header = False  # between a function keyword and its body
+    while True:
+        if i >= length:
+            raise ParseError(SourcePos(i, lineno, i - linestart),
+                             ErrorInformation(i, [brackets[-1]]))
+        c = source[i]
+        first = i
+        i += 1
+        if c == '\n':
+            lineno += 1
+            linestart = i
+        elif is_name_start(c):
+            while i < length and is_name_char(source[i]):
+                i += 1
+            name = source[first:i]
+            if name == 'function':
+                in_header = True
+            elif name not in KEYWORDS:
+                names[name] = None
+                if in_header or is_assigned(source, i, length):
+                    bound[name] = None
+        elif c == '"':
+            while i < length and source[i] != '"':
+                if source[i] == '\\':
+                    i += 1
+                i += 1
+            if i >= length:
+                raise LexerError(source, -1,
+                                 SourcePos(first, lineno, first - linestart))
+            i += 1
+            for j in xrange(first, i):
+                if source[j] == '\n':
+                    lineno += 1
+                    linestart = j + 1
+        elif c == '{':
+            in_header = False
+            brackets.append('}')
+        elif c == '(':
+            brackets.append(')')
+        elif c == '[':
+            brackets.append(']')
+        elif c == '}' or c == ')' or c == ']':
+            expected = brackets.pop()
+            if c != expected:
+                raise ParseError(SourcePos(first, lineno, first - linestart),
+                                 ErrorInformation(first, [expected]))
+            if not brackets:
+                return i, lineno, linestart
+
+
+def is_assigned(source, i, length):
+    ''' Whether the name ending at i is followed by an = (but not ==) '''
+    while i < length and (source[i] == ' ' or source[i] == '\t' or
+                          source[i] == '\n'):
+        i += 1
+    return i < length and source[i] == '=' and \
+        (i + 1 >= length or source[i + 1] != '=')
+
+
+def scan_number(source, i):
+    ''' The end of the number starting at i: 0\\.?[0-9]* or
+    [1-9][0-9]*\\.?[0-9]* or \\.[0-9]+
+    '''
+    length = len(source)
+    if source[i] == '.':
+        i += 1
+    else:
+        if source[i] != '0':
+            while i < length and is_digit(source[i]):
+                i += 1
+        else:
+            i += 1
+        if i < length and source[i] == '.':
+            i += 1
+    while i < length and is_digit(source[i]):
+        i += 1
+    return i
+
+
+def is_digit(c):
+    return '0' <= c <= '9'
+
+
+def is_name_start(c):
+    return 'a' <= c <= 'z' or 'A' <= c <= 'Z' or c == '_'
+
+
+def is_name_char(c):
+    return is_name_start(c) or is_digit(c)
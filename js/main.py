@@ -2,7 +2,19 @@
 # -*- encoding: utf-8 -*-
 
 
-"""Usage: js <filename>"""
+"""Usage: js [options] <filename>
+
+<filename> is a script, or a compiled image of one (<filename>c) to run
+without its source.
+
+Options:
+  --max-call-depth <n>  Maximum number of nested calls
+  --no-cache            Neither read nor write the compiled code cache
+  --cache-dir <dir>     Cache compiled code in dir instead of next to
+                        the script (as <filename>c)
+  --compile-only        Compile and cache the script without running it
+  --no-inline           Do not inline the calls of small functions
+"""
 
 
 import sys
@@ -11,20 +23,81 @@ import sys
 from rpython.rlib.streamio import open_file_as_stream
 
 
-from js.interpreter import run
+from js import codecache
+from js.interpreter import compile_source, run_bytecode, MAX_CALL_DEPTH
 
 
 def main(argv):
-    if not len(argv) == 2:
+    max_call_depth = MAX_CALL_DEPTH
+    use_cache = True
+    cache_dir = None
+    compile_only = False
+    inline = True
+    filename = None
+    i = 1
+    while i < len(argv):
+        arg = argv[i]
+        if arg == '--max-call-depth' and i + 1 < len(argv):
+            try:
+                max_call_depth = int(argv[i + 1])
+            except ValueError:
+                max_call_depth = 0
+            if max_call_depth < 1:
+                filename = None
+                break
+            i += 1
+        elif arg == '--cache-dir' and i + 1 < len(argv):
+            cache_dir = argv[i + 1]
+            i += 1
+        elif arg == '--no-cache':
+            use_cache = False
+        elif arg == '--compile-only':
+            compile_only = True
+        elif arg == '--no-inline':
+            inline = False
+        elif filename is None and not arg.startswith('--'):
+            filename = arg
+        else:
+            filename = None
+            break
+        i += 1
+    if filename is None:
         print __doc__
         return 1
 
-    filename = argv[1]
+    if filename.endswith('.jsc'):
+        bc = codecache.load(filename)
+        if bc is None:
+            print 'invalid bytecode image: %s' % filename
+            return 1
+        if compile_only:
+            return 0
+        return run_bytecode(bc, max_call_depth=max_call_depth)
+
     f = open_file_as_stream(filename)
     source = f.readall()
     f.close()
 
-    return run(source, filename=filename)
+    bc = None
+    path = codecache.cache_path(filename, cache_dir)
+    if use_cache:
+        bc = codecache.load(path, source, inline)
+    if bc is not None:
+        if compile_only:
+            return 0
+        return run_bytecode(bc, max_call_depth=max_call_depth)
+
+    bc = compile_source(source, filename=filename, inline=inline)
+    if bc is None:
+        return 1
+    result = 0
+    if not compile_only:
+        result = run_bytecode(bc, max_call_depth=max_call_depth)
+    # caching compiles the functions not compiled yet, so only once the
+    # script has run
+    if use_cache:
+        codecache.store(path, source, bc, inline)
+    return result
 
 
 def entrypoint():
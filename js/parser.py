@@ -1,21 +1,17 @@
 # -*- encoding: utf-8 -*-
 
-from os import path
-
-
-from rpython.rlib.parsing.ebnfparse import parse_ebnf, make_parse_function
 from rpython.rlib.parsing.deterministic import LexerError
-from rpython.rlib.parsing.parsing import ParseError
-from rpython.rlib.parsing.tree import Symbol
+from rpython.rlib.parsing.parsing import ParseError, ErrorInformation
+from rpython.rlib.rfloat import isfinite
 
 
-from js import utils
 from js import bytecode
+from js import lexer
+from js.base_objects import OperationalError, W_FloatObject, W_IntObject
 
 
-grammar = open(path.join(path.dirname(__file__), "grammar.txt"), "r").read()
-regexs, rules, ToAST = parse_ebnf(grammar)
-_parse = make_parse_function(regexs, rules, eof=True)
+# inline_size of nodes that can not be inlined, more than any budget
+NOT_INLINABLE = 1 << 20
 
 
 class AstNode(object):
@@ -35,6 +31,50 @@ class AstNode(object):
                             if len(self._fields) > 1 else
                             repr(getattr(self, self._fields[0])))
 
+    def collect_locals(self, ctx):
+        ''' Declare in ctx all variables this node assigns to
+        (without descending into nested function bodies)
+        '''
+        pass
+
+    def collect_names(self, names):
+        ''' Add to the dict names all variables this node loads or
+        assigns to, including in nested function bodies
+        '''
+        pass
+
+    def collect_bindings(self, inliner, in_function):
+        ''' Tell inliner (see js.inliner) about every variable this node
+        binds, including in nested function bodies - in_function is whether
+        this node is in one
+        '''
+        pass
+
+    def fold(self, inliner=None):
+        ''' Return an equivalent node with operations on constants
+        evaluated at compile time, and the calls inliner (if any) can inline
+        replaced by the body of the function
+        '''
+        return self
+
+    def inline_size(self):
+        ''' The number of nodes of this expression, if it can be the body of
+        an inlined function (see substitute)
+        '''
+        return NOT_INLINABLE
+
+    def substitute(self, mapping):
+        ''' A copy of this expression with the variables in the dict
+        mapping replaced by the nodes they map to
+        '''
+        raise NotImplementedError
+
+    def resolve(self):
+        ''' The node to compile - the node itself, but for pre-parsed
+        function bodies
+        '''
+        return self
+
 
 class Block(AstNode):
 
@@ -45,6 +85,21 @@ class Block(AstNode):
     def __init__(self, stmts):
         self.stmts = stmts
 
+    def collect_locals(self, ctx):
+        for stmt in self.stmts:
+            stmt.collect_locals(ctx)
+
+    def collect_names(self, names):
+        for stmt in self.stmts:
+            stmt.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        for stmt in self.stmts:
+            stmt.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        return Block([stmt.fold(inliner) for stmt in self.stmts])
+
     def compile(self, ctx):
         for stmt in self.stmts:
             stmt.compile(ctx)
@@ -59,6 +114,18 @@ class Stmt(AstNode):
     def __init__(self, expr):
         self.expr = expr
 
+    def collect_locals(self, ctx):
+        self.expr.collect_locals(ctx)
+
+    def collect_names(self, names):
+        self.expr.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        self.expr.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        return Stmt(self.expr.fold(inliner))
+
     def compile(self, ctx):
         self.expr.compile(ctx)
         ctx.emit(bytecode.DISCARD_TOP)
@@ -73,11 +140,37 @@ class ConstantNum(AstNode):
     def __init__(self, floatval):
         self.floatval = floatval
 
+    def inline_size(self):
+        return 1
+
+    def substitute(self, mapping):
+        return self
+
     def compile(self, ctx):
         ctx.emit(bytecode.LOAD_CONSTANT_FLOAT,
                  ctx.register_constant_float(self.floatval))
 
 
+class ConstantInt(AstNode):
+
+    ''' Numeric constant written without a decimal point
+    '''
+    _fields = ('intval',)
+
+    def __init__(self, intval):
+        self.intval = intval
+
+    def inline_size(self):
+        return 1
+
+    def substitute(self, mapping):
+        return self
+
+    def compile(self, ctx):
+        ctx.emit(bytecode.LOAD_CONSTANT_INT,
+                 ctx.register_constant_int(self.intval))
+
+
 class ConstantStr(AstNode):
 
     ''' String constant
@@ -87,6 +180,12 @@ class ConstantStr(AstNode):
     def __init__(self, stringval):
         self.stringval = stringval
 
+    def inline_size(self):
+        return 1
+
+    def substitute(self, mapping):
+        return self
+
     def compile(self, ctx):
         ctx.emit(bytecode.LOAD_CONSTANT_STRING,
                  ctx.register_constant_string(self.stringval))
@@ -103,27 +202,44 @@ class BinOp(AstNode):
         self.left = left
         self.right = right
 
+    def collect_locals(self, ctx):
+        self.left.collect_locals(ctx)
+        self.right.collect_locals(ctx)
+
+    def collect_names(self, names):
+        self.left.collect_names(names)
+        self.right.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        self.left.collect_bindings(inliner, in_function)
+        self.right.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        left = self.left.fold(inliner)
+        right = self.right.fold(inliner)
+        if is_numeric(left) and is_numeric(right):
+            folded = fold_numeric(self.op, box_numeric(left),
+                                  box_numeric(right))
+            if folded is not None:
+                return folded
+        elif isinstance(left, ConstantStr) and isinstance(right, ConstantStr):
+            if self.op == '+':
+                return ConstantStr(left.stringval + right.stringval)
+        return BinOp(self.op, left, right)
+
+    def inline_size(self):
+        return 1 + self.left.inline_size() + self.right.inline_size()
+
+    def substitute(self, mapping):
+        return BinOp(self.op, self.left.substitute(mapping),
+                     self.right.substitute(mapping))
+
     def compile(self, ctx):
         self.left.compile(ctx)
         self.right.compile(ctx)
         ctx.emit(bytecode.BINOP[self.op])
 
 
-class UnOp(AstNode):
-
-    ''' Binary operation
-    '''
-    _fields = ('op', 'expr')
-
-    def __init__(self, op, expr):
-        self.op = op
-        self.expr = expr
-
-    def compile(self, ctx):
-        self.expr.compile(ctx)
-        ctx.emit(bytecode.UNOP[self.op])
-
-
 class Variable(AstNode):
 
     ''' Variable reference
@@ -133,8 +249,18 @@ class Variable(AstNode):
     def __init__(self, varname):
         self.varname = varname
 
+    def collect_names(self, names):
+        names[self.varname] = None
+
+    def inline_size(self):
+        return 1
+
+    def substitute(self, mapping):
+        return mapping.get(self.varname, self)
+
     def compile(self, ctx):
-        ctx.emit(bytecode.LOAD_VAR, ctx.register_var(self.varname))
+        op, arg = ctx.resolve_var(self.varname)
+        ctx.emit(op, arg)
 
 
 class Assignment(AstNode):
@@ -147,11 +273,251 @@ class Assignment(AstNode):
         self.varname = varname
         self.expr = expr
 
+    def collect_locals(self, ctx):
+        ctx.declare(self.varname)
+        self.expr.collect_locals(ctx)
+
+    def collect_names(self, names):
+        names[self.varname] = None
+        self.expr.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        inliner.bind(self.varname, in_function)
+        self.expr.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        return Assignment(self.varname, self.expr.fold(inliner))
+
     def compile(self, ctx):
         self.expr.compile(ctx)
         ctx.emit(bytecode.ASSIGN, ctx.register_var(self.varname))
 
 
+class ObjectLiteral(AstNode):
+
+    ''' Object with the given properties
+    '''
+    _fields = ('names', 'values')
+
+    def __init__(self, names, values):
+        self.names = names
+        self.values = values
+
+    def collect_locals(self, ctx):
+        for value in self.values:
+            value.collect_locals(ctx)
+
+    def collect_names(self, names):
+        for value in self.values:
+            value.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        for value in self.values:
+            value.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        return ObjectLiteral(self.names, [value.fold(inliner)
+                                          for value in self.values])
+
+    def inline_size(self):
+        size = 1
+        for value in self.values:
+            size += value.inline_size()
+        return size
+
+    def substitute(self, mapping):
+        return ObjectLiteral(self.names, [value.substitute(mapping)
+                                          for value in self.values])
+
+    def compile(self, ctx):
+        ctx.emit(bytecode.NEW_OBJECT)
+        for i in range(len(self.names)):
+            self.values[i].compile(ctx)
+            ctx.emit(bytecode.INIT_ATTR,
+                     ctx.register_constant_string(self.names[i]))
+
+
+class GetAttr(AstNode):
+
+    ''' Property access
+    '''
+    _fields = ('obj', 'name')
+
+    def __init__(self, obj, name):
+        self.obj = obj
+        self.name = name
+
+    def collect_locals(self, ctx):
+        self.obj.collect_locals(ctx)
+
+    def collect_names(self, names):
+        self.obj.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        self.obj.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        return GetAttr(self.obj.fold(inliner), self.name)
+
+    def inline_size(self):
+        return 1 + self.obj.inline_size()
+
+    def substitute(self, mapping):
+        return GetAttr(self.obj.substitute(mapping), self.name)
+
+    def compile(self, ctx):
+        self.obj.compile(ctx)
+        ctx.emit(bytecode.LOAD_ATTR, ctx.register_constant_string(self.name))
+
+
+class SetAttr(AstNode):
+
+    ''' Assign to a property
+    '''
+    _fields = ('obj', 'name', 'expr')
+
+    def __init__(self, obj, name, expr):
+        self.obj = obj
+        self.name = name
+        self.expr = expr
+
+    def collect_locals(self, ctx):
+        self.obj.collect_locals(ctx)
+        self.expr.collect_locals(ctx)
+
+    def collect_names(self, names):
+        self.obj.collect_names(names)
+        self.expr.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        self.obj.collect_bindings(inliner, in_function)
+        self.expr.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        return SetAttr(self.obj.fold(inliner), self.name,
+                       self.expr.fold(inliner))
+
+    def compile(self, ctx):
+        self.obj.compile(ctx)
+        self.expr.compile(ctx)
+        ctx.emit(bytecode.STORE_ATTR, ctx.register_constant_string(self.name))
+
+
+class ArrayLiteral(AstNode):
+
+    ''' Array with the given items
+    '''
+    _fields = ('values',)
+
+    def __init__(self, values):
+        self.values = values
+
+    def collect_locals(self, ctx):
+        for value in self.values:
+            value.collect_locals(ctx)
+
+    def collect_names(self, names):
+        for value in self.values:
+            value.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        for value in self.values:
+            value.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        return ArrayLiteral([value.fold(inliner) for value in self.values])
+
+    def inline_size(self):
+        size = 1
+        for value in self.values:
+            size += value.inline_size()
+        return size
+
+    def substitute(self, mapping):
+        return ArrayLiteral([value.substitute(mapping)
+                             for value in self.values])
+
+    def compile(self, ctx):
+        for value in self.values:
+            value.compile(ctx)
+        ctx.emit(bytecode.NEW_ARRAY, len(self.values))
+
+
+class GetItem(AstNode):
+
+    ''' Indexing, obj[index]
+    '''
+    _fields = ('obj', 'index')
+
+    def __init__(self, obj, index):
+        self.obj = obj
+        self.index = index
+
+    def collect_locals(self, ctx):
+        self.obj.collect_locals(ctx)
+        self.index.collect_locals(ctx)
+
+    def collect_names(self, names):
+        self.obj.collect_names(names)
+        self.index.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        self.obj.collect_bindings(inliner, in_function)
+        self.index.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        return GetItem(self.obj.fold(inliner), self.index.fold(inliner))
+
+    def inline_size(self):
+        return 1 + self.obj.inline_size() + self.index.inline_size()
+
+    def substitute(self, mapping):
+        return GetItem(self.obj.substitute(mapping),
+                       self.index.substitute(mapping))
+
+    def compile(self, ctx):
+        self.obj.compile(ctx)
+        self.index.compile(ctx)
+        ctx.emit(bytecode.LOAD_ITEM)
+
+
+class SetItem(AstNode):
+
+    ''' Assign to an item, obj[index] = expr
+    '''
+    _fields = ('obj', 'index', 'expr')
+
+    def __init__(self, obj, index, expr):
+        self.obj = obj
+        self.index = index
+        self.expr = expr
+
+    def collect_locals(self, ctx):
+        self.obj.collect_locals(ctx)
+        self.index.collect_locals(ctx)
+        self.expr.collect_locals(ctx)
+
+    def collect_names(self, names):
+        self.obj.collect_names(names)
+        self.index.collect_names(names)
+        self.expr.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        self.obj.collect_bindings(inliner, in_function)
+        self.index.collect_bindings(inliner, in_function)
+        self.expr.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        return SetItem(self.obj.fold(inliner), self.index.fold(inliner),
+                       self.expr.fold(inliner))
+
+    def compile(self, ctx):
+        self.obj.compile(ctx)
+        self.index.compile(ctx)
+        self.expr.compile(ctx)
+        ctx.emit(bytecode.STORE_ITEM)
+
+
 class Call(AstNode):
 
     ''' Function call with a list of arguments
@@ -162,11 +528,48 @@ class Call(AstNode):
         self.fn = fn
         self.args = args
 
+    def collect_locals(self, ctx):
+        self.fn.collect_locals(ctx)
+        for arg in self.args:
+            arg.collect_locals(ctx)
+
+    def collect_names(self, names):
+        self.fn.collect_names(names)
+        for arg in self.args:
+            arg.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        self.fn.collect_bindings(inliner, in_function)
+        for arg in self.args:
+            arg.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        fn = self.fn.fold(inliner)
+        args = [arg.fold(inliner) for arg in self.args]
+        if inliner is not None and isinstance(fn, Variable):
+            body = inliner.expand(fn.varname, args)
+            if body is not None:
+                return body
+        return Call(fn, args)
+
+    def inline_size(self):
+        size = 1 + self.fn.inline_size()
+        for arg in self.args:
+            size += arg.inline_size()
+        return size
+
+    def substitute(self, mapping):
+        return Call(self.fn.substitute(mapping),
+                    [arg.substitute(mapping) for arg in self.args])
+
     def compile(self, ctx):
+        self.compile_call(ctx, bytecode.CALL)
+
+    def compile_call(self, ctx, op):
         self.fn.compile(ctx)
         for arg in self.args:
             arg.compile(ctx)
-        ctx.emit(bytecode.CALL, len(self.args))
+        ctx.emit(op, len(self.args))
 
 
 class If(AstNode):
@@ -180,6 +583,30 @@ class If(AstNode):
         self.body = body
         self.else_block = else_block
 
+    def collect_locals(self, ctx):
+        self.cond.collect_locals(ctx)
+        self.body.collect_locals(ctx)
+        if self.else_block:
+            self.else_block.collect_locals(ctx)
+
+    def collect_names(self, names):
+        self.cond.collect_names(names)
+        self.body.collect_names(names)
+        if self.else_block:
+            self.else_block.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        self.cond.collect_bindings(inliner, in_function)
+        self.body.collect_bindings(inliner, in_function)
+        if self.else_block:
+            self.else_block.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        else_block = None
+        if self.else_block:
+            else_block = self.else_block.fold(inliner)
+        return If(self.cond.fold(inliner), self.body.fold(inliner), else_block)
+
     def compile(self, ctx):
         self.cond.compile(ctx)
         ctx.emit(bytecode.JUMP_IF_FALSE, 0)  # to be patched later (1)
@@ -205,6 +632,21 @@ class While(AstNode):
         self.cond = cond
         self.body = body
 
+    def collect_locals(self, ctx):
+        self.cond.collect_locals(ctx)
+        self.body.collect_locals(ctx)
+
+    def collect_names(self, names):
+        self.cond.collect_names(names)
+        self.body.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        self.cond.collect_bindings(inliner, in_function)
+        self.body.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        return While(self.cond.fold(inliner), self.body.fold(inliner))
+
     def compile(self, ctx):
         cond_pos = len(ctx.data)
         self.cond.compile(ctx)
@@ -229,17 +671,79 @@ class FnDef(AstNode):
         self.co_filename = co_filename
         self.co_firstlineno = co_firstlineno
 
+    def collect_locals(self, ctx):
+        ctx.declare(self.name)
+
+    def collect_names(self, names):
+        names[self.name] = None
+        self.body.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        inliner.bind(self.name, in_function)
+        for name in self.arg_list:
+            inliner.bind(name, True)
+        self.body.collect_bindings(inliner, True)
+
     def compile(self, ctx):
-        arg = ctx.register_constant_fn(ctx.compile_ast(
-            self.body, names=self.arg_list,
+        arg = ctx.compile_function(
+            self.body, self.arg_list,
             co_name=self.name,
             co_filename=self.co_filename,
-            co_firstlineno=self.co_firstlineno))
+            co_firstlineno=self.co_firstlineno)
         ctx.emit(bytecode.LOAD_CONSTANT_FN, arg)
         ctx.emit(bytecode.ASSIGN, ctx.register_var(self.name))
         ctx.emit(bytecode.LOAD_CONSTANT_FN, arg)  # case it is an expression
 
 
+class LazyBlock(AstNode):
+
+    ''' Function body that was only pre-parsed (see lexer.skip_body): the
+    part of the source it spans, the names in it and those it may bind are
+    recorded, to parse it by resolve when the function is compiled
+    '''
+    _fields = ('start', 'end', 'lineno', 'columnno')
+
+    def __init__(self, source, start, end, lineno, columnno, filename,
+                 names, bound):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.lineno = lineno
+        self.columnno = columnno
+        self.filename = filename
+        self.names = names
+        self.bound = bound
+
+    def collect_locals(self, ctx):
+        pass  # only known once parsed: all its names may be free variables
+
+    def collect_names(self, names):
+        for name in self.names:
+            names[name] = None
+
+    def collect_bindings(self, inliner, in_function):
+        for name in self.bound:
+            inliner.bind(name, True)
+
+    def resolve(self):
+        ''' The parsed block - syntax errors in it are only found here, on
+        the first call of the function, and raised as an OperationalError
+        '''
+        filename = self.filename or '<unknown>'
+        try:
+            tokens = lexer.tokenize(self.source, self.start, self.end,
+                                    self.lineno, self.columnno, lazy=True)
+            parser = Parser(tokens, self.filename)
+            block = parser.parse_block()
+            parser.expect(lexer.EOF)
+        except LexerError as e:
+            raise OperationalError(e.nice_error_message(filename))
+        except ParseError as e:
+            raise OperationalError(e.nice_error_message(filename,
+                                                        self.source))
+        return block
+
+
 class Return(AstNode):
 
     ''' Return statement
@@ -249,7 +753,28 @@ class Return(AstNode):
     def __init__(self, expr=None):
         self.expr = expr
 
+    def collect_locals(self, ctx):
+        if self.expr:
+            self.expr.collect_locals(ctx)
+
+    def collect_names(self, names):
+        if self.expr:
+            self.expr.collect_names(names)
+
+    def collect_bindings(self, inliner, in_function):
+        if self.expr:
+            self.expr.collect_bindings(inliner, in_function)
+
+    def fold(self, inliner=None):
+        if self.expr:
+            return Return(self.expr.fold(inliner))
+        return self
+
     def compile(self, ctx):
+        if isinstance(self.expr, Call) and ctx.parent is not None:
+            # the frame of the function is replaced by the one of the call
+            self.expr.compile_call(ctx, bytecode.TAIL_CALL)
+            return
         arg = 0
         if self.expr:
             arg = 1
@@ -257,148 +782,342 @@ class Return(AstNode):
         ctx.emit(bytecode.RETURN, arg)
 
 
-class Transformer(object):
+class Inlined(AstNode):
 
-    ''' Transforms AST from the obscure format given to us by the ebnfparser
-    to something easier to work with
+    ''' The body of an inlined function (see js.inliner): the arguments
+    are evaluated in order into the temporary variables standing for them
+    in expr, then expr. Once it is evaluated, the slots of the temporaries
+    are reused by the next inlined call
     '''
+    _fields = ('temps', 'args', 'expr')
+
+    def __init__(self, temps, args, expr):
+        self.temps = temps
+        self.args = args
+        self.expr = expr
+
+    def collect_locals(self, ctx):
+        # the temporaries are bound while compiling, see compile
+        for arg in self.args:
+            arg.collect_locals(ctx)
+        self.expr.collect_locals(ctx)
+
+    def collect_names(self, names):
+        for temp in self.temps:
+            names[temp] = None
+        for arg in self.args:
+            arg.collect_names(names)
+        self.expr.collect_names(names)
+
+    def fold(self, inliner=None):
+        return Inlined(self.temps, [arg.fold(inliner) for arg in self.args],
+                       self.expr.fold(inliner))
+
+    def compile(self, ctx):
+        for i in range(len(self.temps)):
+            self.args[i].compile(ctx)
+            ctx.emit(bytecode.ASSIGN, ctx.bind_temp(self.temps[i]))
+        self.expr.compile(ctx)
+        ctx.release_temps(self.temps)
+
+
+def is_numeric(node):
+    return isinstance(node, ConstantNum) or isinstance(node, ConstantInt)
+
+
+def box_numeric(node):
+    if isinstance(node, ConstantInt):
+        return W_IntObject(node.intval)
+    assert isinstance(node, ConstantNum)
+    return W_FloatObject(node.floatval)
+
+
+def fold_numeric(op, w_left, w_right):
+    ''' Evaluate a binary arithmetic operation on two boxed numeric
+    constants the same way the interpreter would, or return None if it has
+    to be left for runtime
+    '''
+    if op == '+':
+        w_res = w_left.add(w_right)
+    elif op == '-':
+        w_res = w_left.sub(w_right)
+    elif op == '*':
+        w_res = w_left.mul(w_right)
+    elif op == '/':
+        w_res = w_left.div(w_right)
+    elif op == '%':
+        w_res = w_left.mod(w_right)
+    else:
+        return None  # comparisons have no constant form
+    if isinstance(w_res, W_IntObject):
+        return ConstantInt(w_res.intval)
+    if not isfinite(w_res.get_floatval()):
+        return None  # no literal for NaN and infinities
+    return ConstantNum(w_res.get_floatval())
+
+
+def number_literal(text):
+    ''' Integers without a decimal point are ConstantInts, as long as
+    they are exactly representable
+    '''
+    floatval = float(text)
+    if '.' not in text and len(text) <= MAX_INT_LITERAL_DIGITS:
+        return ConstantInt(int(floatval))
+    return ConstantNum(floatval)
+
+
+# longest integer literal that fits a 32 bit machine word
+MAX_INT_LITERAL_DIGITS = 9
+
+
+def signed(op, expr):
+    ''' expr with a leading sign, which only numeric constants can take '''
+    if isinstance(expr, ConstantNum):
+        return ConstantNum(-expr.floatval) if op == '-' else expr
+    elif isinstance(expr, ConstantInt):
+        if op == '+':
+            return expr
+        elif expr.intval == 0:
+            return ConstantNum(-0.0)
+        return ConstantInt(-expr.intval)
+    raise NotImplementedError
+
+
+# binding power of the binary operators - operators of the same precedence
+# group to the right, as the right recursive rules of grammar.txt did
+PRECEDENCE = {
+    lexer.COMP_OPER: 1,
+    lexer.ADD_OPER: 2,
+    lexer.MULT_OPER: 3,
+}
 
-    def _grab_stmts(self, star):
+
+class Parser(object):
+
+    ''' Recursive descent parser over the tokens of js.lexer, building the
+    AST in a single pass. Chains of binary operators are parsed by operator
+    precedence on explicit stacks, so only nesting (parentheses, calls,
+    blocks) takes Python stack
+    '''
+
+    def __init__(self, tokens, filename=None):
+        self.tokens = tokens
+        self.pos = 0
+        self.filename = filename
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        if token.kind != lexer.EOF:
+            self.pos += 1
+        return token
+
+    def check(self, kind):
+        return self.tokens[self.pos].kind == kind
+
+    def accept(self, kind):
+        if self.check(kind):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, kind):
+        token = self.peek()
+        if token.kind != kind:
+            raise self.error(token, [kind])
+        return self.next()
+
+    def error(self, token, expected):
+        return ParseError(token.getsourcepos(),
+                          ErrorInformation(self.pos, expected))
+
+    def parse_main(self):
         stmts = []
-        if isinstance(star, Symbol) and star.additional_info == '}':
-            return stmts
-        while len(star.children) == 2:
-            stmts.append(self.visit_stmt(star.children[0]))
-            star = star.children[1]
-        stmts.append(self.visit_stmt(star.children[0]))
-        return stmts
-
-    def visit_main(self, node):
-        stmts = self._grab_stmts(node.children[0])
+        while not self.check(lexer.EOF):
+            stmts.append(self.parse_stmt())
         return Block(stmts)
 
-    def visit_stmt(self, node):  # noqa
-        if len(node.children) == 2 and node.children[0].symbol == 'expr':
-            return Stmt(self.visit_expr(node.children[0]))
-        head_info = node.children[0].additional_info
-        if head_info == 'while':
-            cond = self.visit_expr(node.children[2])
-            stmts = self._grab_stmts(node.children[5])
-            return While(cond, Block(stmts))
-        elif head_info == 'if':
-            cond = self.visit_expr(node.children[2])
-            stmts = self._grab_stmts(node.children[5])
-            if isinstance(node.children[6], Symbol):
-                assert node.children[6].additional_info == '}'
-                else_block = None
-            else:
-                else_block = Block(self._grab_stmts(
-                    node.children[6].children[3]))
-            return If(cond, Block(stmts), else_block)
-        elif head_info == 'return':
-            if len(node.children) == 2:
-                return Return()
-            elif len(node.children) == 3:
-                return Return(self.visit_expr(node.children[1]))
-            else:
-                raise NotImplementedError
-        elif len(node.children) == 4:
-            return Assignment(head_info, self.visit_expr(node.children[2]))
-        raise NotImplementedError
-
-    def visit_expr(self, node):  # noqa
-        if len(node.children) == 1:
-            if node.symbol == 'atom':
-                return self.visit_atom(node)
-            else:
-                return self.visit_expr(node.children[0])
-        elif node.symbol == 'call':
-            fn = self.visit_expr(node.children[0])
-            if len(node.children) == 4:
-                args = self.visit_csexpr(node.children[2])
-            else:
-                assert len(node.children) == 3
-                args = []
-            return Call(fn, args)
-        elif node.symbol == 'fndef':
-            co_firstlineno = node.getsourcepos().lineno
-            fn_name = node.children[1].additional_info
-            if len(node.children) == 6:  # foo() {};
-                return FnDef(fn_name, [], Block([]),
-                             self.filename, co_firstlineno)
-            elif len(node.children) == 7:  # foo(x) {}; or foo() {x;}
-                if node.children[3].symbol == 'csvar':
-                    return FnDef(fn_name, self.visit_csvar(node.children[3]),
-                                 Block([]), self.filename, co_firstlineno)
-                else:
-                    stmts = self._grab_stmts(node.children[5])
-                    return FnDef(fn_name, [], Block(stmts),
-                                 self.filename, co_firstlineno)
-            elif len(node.children) == 8:  # foo(x) {x;}
-                stmts = self._grab_stmts(node.children[6])
-                return FnDef(fn_name, self.visit_csvar(node.children[3]),
-                             Block(stmts), self.filename, co_firstlineno)
-            else:
-                raise NotImplementedError
-        elif len(node.children) == 2:  # unary op
-            op = node.children[0].additional_info
-            expr = self.visit_expr(node.children[1])
-            if isinstance(expr, ConstantNum):
-                return ConstantNum(-expr.floatval) if op == '-' else expr
-            else:
-                raise NotImplementedError
-                return UnOp(op, expr)
-        elif len(node.children) == 3:  # binary op or (expr)
-            is_par_expr = True
-            for c, br in [(node.children[0], '('), (node.children[2], ')')]:
-                if not (isinstance(c, Symbol) and c.additional_info == br):
-                    is_par_expr = False
-                    break
-            if is_par_expr:
-                return self.visit_expr(node.children[1])
-            else:
-                return BinOp(node.children[1].additional_info,
-                             self.visit_expr(node.children[0]),
-                             self.visit_expr(node.children[2]))
-        else:
-            raise NotImplementedError
+    def parse_block(self):
+        ''' "{" statement* "}" '''
+        self.expect('{')
+        stmts = []
+        while not self.accept('}'):
+            stmts.append(self.parse_stmt())
+        return Block(stmts)
 
-    def visit_csexpr(self, node):
-        ''' Return a list of nodes (comma-separated "expr")
+    def parse_stmt(self):
+        token = self.peek()
+        if token.kind == 'while':
+            self.next()
+            cond = self.parse_paren_expr()
+            return While(cond, self.parse_block())
+        elif token.kind == 'if':
+            self.next()
+            cond = self.parse_paren_expr()
+            body = self.parse_block()
+            else_block = None
+            if self.accept('else'):
+                else_block = self.parse_block()
+            return If(cond, body, else_block)
+        elif token.kind == 'return':
+            self.next()
+            if self.accept(';'):
+                return Return()
+            expr = self.parse_expr()
+            self.expect(';')
+            return Return(expr)
+        elif token.kind == lexer.VARIABLE and \
+                self.tokens[self.pos + 1].kind == '=':
+            self.pos += 2
+            expr = self.parse_expr()
+            self.expect(';')
+            return Assignment(token.text, expr)
+        elif token.kind == lexer.ADD_OPER:
+            expr = self.parse_expr()
+            self.expect(';')
+            return Stmt(expr)
+        target = self.parse_call()
+        if self.accept('='):  # obj.name or obj[i] = expr;
+            expr = self.parse_expr()
+            self.expect(';')
+            if isinstance(target, GetAttr):
+                return SetAttr(target.obj, target.name, expr)
+            elif isinstance(target, GetItem):
+                return SetItem(target.obj, target.index, expr)
+            raise self.error(token,
+                             ['a variable, property or item to assign to'])
+        expr = self.parse_binary(target)
+        self.expect(';')
+        return Stmt(expr)
+
+    def parse_paren_expr(self):
+        self.expect('(')
+        expr = self.parse_expr()
+        self.expect(')')
+        return expr
+
+    def parse_expr(self):
+        ''' Expression, with the signs in front of it - which apply to all
+        of it, not just its first operand
         '''
-        assert len(node.children) in (1, 3)
-        expr_list = [self.visit_expr(node.children[0])]
-        if len(node.children) == 3:
-            expr_list.extend(self.visit_csexpr(node.children[2]))
-        return expr_list
-
-    def visit_csvar(self, node):
-        ''' Return a list of variable names (comma-separated VARIABLE)
+        signs = []
+        while self.check(lexer.ADD_OPER):
+            signs.append(self.next().text)
+        expr = self.parse_binary(self.parse_call())
+        for i in xrange(len(signs) - 1, -1, -1):
+            expr = signed(signs[i], expr)
+        return expr
+
+    def parse_binary(self, left):
+        ''' The chain of binary operations starting with operand left '''
+        if self.peek().kind not in PRECEDENCE:
+            return left
+        operands = [left]
+        operators = []
+        while self.peek().kind in PRECEDENCE:
+            token = self.next()
+            precedence = PRECEDENCE[token.kind]
+            while operators and \
+                    PRECEDENCE[operators[-1].kind] > precedence:
+                self.reduce(operands, operators)
+            operators.append(token)
+            operands.append(self.parse_call())
+        while operators:
+            self.reduce(operands, operators)
+        return operands[0]
+
+    def reduce(self, operands, operators):
+        right = operands.pop()
+        left = operands.pop()
+        operands.append(BinOp(operators.pop().text, left, right))
+
+    def parse_call(self):
+        ''' Function definition or primary expression, followed by calls,
+        attribute and item accesses
         '''
-        assert len(node.children) in (1, 3)
-        assert node.children[0].symbol == 'VARIABLE'
-        name_list = [node.children[0].additional_info]
-        if len(node.children) == 3:
-            name_list.extend(self.visit_csvar(node.children[2]))
-        return name_list
-
-    def visit_atom(self, node):
-        chnode = node.children[0]
-        if chnode.symbol == 'NUMBER':
-            return ConstantNum(float(chnode.additional_info))
-        if chnode.symbol == 'STRING':
-            return ConstantStr(utils.unquote_string(chnode.additional_info))
-        if chnode.symbol == 'VARIABLE':
-            return Variable(chnode.additional_info)
-        raise NotImplementedError(chnode.symbol)
-
-
-def parse(source, filename=None):
-    ''' Parse the source code and produce an AST
+        if self.check('function'):
+            expr = self.parse_fndef()
+        else:
+            expr = self.parse_primary()
+        while True:
+            if self.accept('('):
+                expr = Call(expr, self.parse_list(')'))
+            elif self.accept('.'):
+                expr = GetAttr(expr, self.expect(lexer.VARIABLE).text)
+            elif self.accept('['):
+                index = self.parse_expr()
+                self.expect(']')
+                expr = GetItem(expr, index)
+            else:
+                return expr
+
+    def parse_list(self, end):
+        ''' Comma-separated expressions up to end '''
+        exprs = []
+        if self.accept(end):
+            return exprs
+        exprs.append(self.parse_expr())
+        while self.accept(','):
+            exprs.append(self.parse_expr())
+        self.expect(end)
+        return exprs
+
+    def parse_fndef(self):
+        co_firstlineno = self.next().lineno
+        name = self.expect(lexer.VARIABLE).text
+        self.expect('(')
+        arg_list = []
+        if not self.accept(')'):
+            arg_list.append(self.expect(lexer.VARIABLE).text)
+            while self.accept(','):
+                arg_list.append(self.expect(lexer.VARIABLE).text)
+            self.expect(')')
+        if self.check(lexer.BODY):
+            # only pre-parsed by the lexer
+            token = self.next()
+            assert isinstance(token, lexer.BodyToken)
+            body = LazyBlock(token.source, token.i, token.end, token.lineno,
+                             token.columnno, self.filename, token.names,
+                             token.bound)
+        else:
+            body = self.parse_block()
+        return FnDef(name, arg_list, body, self.filename, co_firstlineno)
+
+    def parse_primary(self):
+        token = self.next()
+        if token.kind == lexer.NUMBER:
+            return number_literal(token.text)
+        elif token.kind == lexer.STRING:
+            end = len(token.text) - 1
+            assert end >= 1
+            return ConstantStr(token.text[1:end])
+        elif token.kind == lexer.VARIABLE:
+            return Variable(token.text)
+        elif token.kind == '(':
+            expr = self.parse_expr()
+            self.expect(')')
+            return expr
+        elif token.kind == '[':
+            return ArrayLiteral(self.parse_list(']'))
+        elif token.kind == '{':
+            names = []
+            values = []
+            if not self.accept('}'):
+                while True:
+                    names.append(self.expect(lexer.VARIABLE).text)
+                    self.expect(':')
+                    values.append(self.parse_expr())
+                    if not self.accept(','):
+                        break
+                self.expect('}')
+            return ObjectLiteral(names, values)
+        raise self.error(token, ['an expression'])
+
+
+def parse(source, filename=None, lazy=False):
+    ''' Parse the source code and produce an AST - in which function bodies
+    are only pre-parsed into LazyBlocks if lazy is True
     '''
-    transformer = Transformer()
-    transformer.filename = filename
-    try:
-        return transformer.visit_main(_parse(source))
-    except (LexerError, ParseError):
-        raise
+    return Parser(lexer.tokenize(source, lazy=lazy), filename).parse_main()
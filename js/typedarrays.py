@@ -0,0 +1,305 @@
+# -*- encoding: utf-8 -*-
+
+
+import math
+
+from rpython.rlib.rarithmetic import ovfcheck
+from rpython.rlib.rfloat import INFINITY, NAN, isnan, isinf
+
+
+from js.base_objects import W_Numeric, W_FloatObject, W_IntObject, \
+    OperationalError, w_Undefined, newint, newbool
+from js.arrays import W_Array, array_index
+
+
+class W_TypedArray(W_Numeric):
+
+    ''' Array of a fixed length and item type, its items unboxed in a flat
+    list. The kernels below loop over it in the host - builtins with loops
+    are not traced into by the JIT, so they always run as compiled code
+    '''
+
+    def length(self):
+        raise NotImplementedError
+
+    def get_float(self, i):
+        raise NotImplementedError
+
+    def set_float(self, i, floatval):
+        raise NotImplementedError
+
+    def getitem(self, i):
+        raise NotImplementedError
+
+    def get_item(self, w_index):
+        i = array_index(w_index)
+        if 0 <= i < self.length():
+            return self.getitem(i)
+        return W_Numeric.get_item(self, w_index)
+
+    def set_item(self, w_index, w_value):
+        i = array_index(w_index)
+        if 0 <= i < self.length():
+            self.set_float(i, to_float(w_value))
+        # typed arrays do not grow, other writes are ignored
+
+    def get_property(self, name):
+        if name == 'length':
+            return newint(self.length())
+        return w_Undefined
+
+    def is_true(self):
+        return True
+
+    def to_string(self):
+        return ','.join([self.getitem(i).to_string()
+                         for i in xrange(self.length())])
+
+    def get_floatval(self):
+        return NAN
+
+    def eq(self, other):
+        return newbool(self is other)
+
+    def eq_bool(self, other):
+        return self is other
+
+
+class W_Float64Array(W_TypedArray):
+
+    def __init__(self, floats):
+        self.floats = floats
+
+    def length(self):
+        return len(self.floats)
+
+    def get_float(self, i):
+        return self.floats[i]
+
+    def set_float(self, i, floatval):
+        self.floats[i] = floatval
+
+    def getitem(self, i):
+        return W_FloatObject(self.floats[i])
+
+    def __repr__(self):
+        ''' NOT_RPYTHON '''
+        return '<W_Float64Array %r>' % (self.floats,)
+
+
+class W_Int32Array(W_TypedArray):
+
+    ''' Items are converted to 32 bit integers when stored, as in JS '''
+
+    def __init__(self, ints):
+        self.ints = ints
+
+    def length(self):
+        return len(self.ints)
+
+    def get_float(self, i):
+        return float(self.ints[i])
+
+    def set_float(self, i, floatval):
+        self.ints[i] = to_int32(floatval)
+
+    def getitem(self, i):
+        return newint(self.ints[i])
+
+    def __repr__(self):
+        ''' NOT_RPYTHON '''
+        return '<W_Int32Array %r>' % (self.ints,)
+
+
+def to_float(w_value):
+    if isinstance(w_value, W_Numeric):
+        return w_value.get_floatval()
+    return NAN
+
+
+def to_int32(floatval):
+    ''' The JS ToInt32 conversion: truncate, then wrap around modulo 2**32
+    '''
+    if isnan(floatval) or isinf(floatval):
+        return 0
+    if floatval < 0.0:
+        floatval = math.ceil(floatval)
+    else:
+        floatval = math.floor(floatval)
+    floatval = math.fmod(floatval, 4294967296.0)
+    if floatval < -2147483648.0:
+        floatval += 4294967296.0
+    elif floatval >= 2147483648.0:
+        floatval -= 4294967296.0
+    return int(floatval)
+
+
+def empty_typed_array(is_float, length):
+    if is_float:
+        return W_Float64Array([0.0] * length)
+    return W_Int32Array([0] * length)
+
+
+def new_typed_array(is_float, w_init):
+    ''' Create a Float64Array or an Int32Array from w_init, either a
+    length or the array-like to copy the items of
+    '''
+    if isinstance(w_init, W_IntObject):
+        if w_init.intval < 0:
+            raise OperationalError('RangeError: invalid typed array length')
+        return empty_typed_array(is_float, w_init.intval)
+    if isinstance(w_init, W_TypedArray):
+        w_res = empty_typed_array(is_float, w_init.length())
+        for i in xrange(w_init.length()):
+            w_res.set_float(i, w_init.get_float(i))
+        return w_res
+    if isinstance(w_init, W_Array):
+        w_res = empty_typed_array(is_float, w_init.length())
+        for i in xrange(w_init.length()):
+            w_res.set_float(i, to_float(w_init.getitem(i)))
+        return w_res
+    raise OperationalError(
+        'TypeError: typed arrays are created from a length or an array')
+
+
+def typed_sum(w_arr):
+    if isinstance(w_arr, W_Float64Array):
+        total = 0.0
+        for f in w_arr.floats:
+            total += f
+        return W_FloatObject(total)
+    assert isinstance(w_arr, W_Int32Array)
+    total = 0
+    try:
+        for i in w_arr.ints:
+            total = ovfcheck(total + i)
+    except OverflowError:
+        floattotal = 0.0
+        for i in w_arr.ints:
+            floattotal += float(i)
+        return W_FloatObject(floattotal)
+    return newint(total)
+
+
+def typed_dot(w_a, w_b):
+    check_same_length(w_a, w_b)
+    total = 0.0
+    if isinstance(w_a, W_Float64Array) and isinstance(w_b, W_Float64Array):
+        a = w_a.floats
+        b = w_b.floats
+        for i in xrange(len(a)):
+            total += a[i] * b[i]
+    else:
+        for i in xrange(w_a.length()):
+            total += w_a.get_float(i) * w_b.get_float(i)
+    return W_FloatObject(total)
+
+
+def typed_scale(w_arr, factor):
+    if isinstance(w_arr, W_Float64Array):
+        floats = w_arr.floats
+        for i in xrange(len(floats)):
+            floats[i] *= factor
+    else:
+        for i in xrange(w_arr.length()):
+            w_arr.set_float(i, w_arr.get_float(i) * factor)
+
+
+def typed_add(w_a, w_b):
+    ''' Add the items of w_b to the items of w_a '''
+    check_same_length(w_a, w_b)
+    if isinstance(w_a, W_Float64Array) and isinstance(w_b, W_Float64Array):
+        a = w_a.floats
+        b = w_b.floats
+        for i in xrange(len(a)):
+            a[i] += b[i]
+    else:
+        for i in xrange(w_a.length()):
+            w_a.set_float(i, w_a.get_float(i) + w_b.get_float(i))
+
+
+def typed_map(w_arr, op):
+    if isinstance(w_arr, W_Float64Array):
+        floats = w_arr.floats
+        for i in xrange(len(floats)):
+            floats[i] = op(floats[i])
+    else:
+        for i in xrange(w_arr.length()):
+            w_arr.set_float(i, op(w_arr.get_float(i)))
+
+
+def typed_fill(w_arr, floatval):
+    for i in xrange(w_arr.length()):
+        w_arr.set_float(i, floatval)
+
+
+def typed_copy(w_arr):
+    if isinstance(w_arr, W_Float64Array):
+        return W_Float64Array(w_arr.floats[:])
+    assert isinstance(w_arr, W_Int32Array)
+    return W_Int32Array(w_arr.ints[:])
+
+
+def check_same_length(w_a, w_b):
+    if w_a.length() != w_b.length():
+        raise OperationalError('RangeError: typed arrays differ in length')
+
+
+def op_abs(x):
+    return math.fabs(x)
+
+
+def op_neg(x):
+    return -x
+
+
+def op_square(x):
+    return x * x
+
+
+def op_sqrt(x):
+    if x < 0.0 or isnan(x):
+        return NAN
+    return math.sqrt(x)
+
+
+def op_floor(x):
+    if isnan(x) or isinf(x):
+        return x
+    return math.floor(x)
+
+
+def op_ceil(x):
+    if isnan(x) or isinf(x):
+        return x
+    return math.ceil(x)
+
+
+def op_exp(x):
+    if isnan(x):
+        return x
+    try:
+        return math.exp(x)
+    except OverflowError:
+        return INFINITY
+
+
+def op_log(x):
+    if x < 0.0 or isnan(x):
+        return NAN
+    if x == 0.0:
+        return -INFINITY
+    return math.log(x)
+
+
+# the operations map() applies to each item, by name
+MAP_OPS = {
+    'abs': op_abs,
+    'neg': op_neg,
+    'square': op_square,
+    'sqrt': op_sqrt,
+    'floor': op_floor,
+    'ceil': op_ceil,
+    'exp': op_exp,
+    'log': op_log,
+}
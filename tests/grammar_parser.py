@@ -0,0 +1,232 @@
+# -*- encoding: utf-8 -*-
+
+
+"""The front end generated from grammar.txt, which js.parser replaced. It
+is kept as the reference the hand-written parser is tested against
+"""
+
+
+from os import path
+
+
+from rpython.rlib.parsing.ebnfparse import parse_ebnf, \
+    check_for_missing_names
+from rpython.rlib.parsing.lexer import Lexer
+from rpython.rlib.parsing.parsing import ParseError, ErrorInformation, \
+    PackratParser
+from rpython.rlib.parsing.tree import Symbol
+
+
+from js import utils
+from js.parser import Block, Stmt, ConstantStr, BinOp, Variable, \
+    Assignment, ObjectLiteral, GetAttr, SetAttr, ArrayLiteral, GetItem, \
+    SetItem, Call, If, While, FnDef, Return, number_literal, signed
+
+
+GRAMMAR = path.join(path.dirname(path.abspath(__file__)), 'grammar.txt')
+
+
+def build_tables(grammar):
+    ''' The lexer and the parser of grammar, as make_parse_function builds
+    them
+    '''
+    regexs, rules, _ = parse_ebnf(grammar)
+    names, regexs = zip(*regexs)
+    check_for_missing_names(names, regexs, rules)
+    ignore = ['IGNORE'] if 'IGNORE' in names else []
+    lexer = Lexer(list(regexs), list(names), ignore=ignore)
+    parser = PackratParser(rules, rules[0].nonterminal)
+    return lexer, parser
+
+
+class Transformer(object):
+
+    ''' Transforms AST from the obscure format given to us by the ebnfparser
+    to something easier to work with
+    '''
+
+    def _grab_stmts(self, star):
+        stmts = []
+        if isinstance(star, Symbol) and star.additional_info == '}':
+            return stmts
+        while len(star.children) == 2:
+            stmts.append(self.visit_stmt(star.children[0]))
+            star = star.children[1]
+        stmts.append(self.visit_stmt(star.children[0]))
+        return stmts
+
+    def visit_main(self, node):
+        stmts = self._grab_stmts(node.children[0])
+        return Block(stmts)
+
+    def visit_stmt(self, node):  # noqa
+        if len(node.children) == 2 and node.children[0].symbol == 'expr':
+            return Stmt(self.visit_expr(node.children[0]))
+        if node.children[0].symbol == 'call':  # obj.name or obj[i] = expr;
+            target = self.visit_expr(node.children[0])
+            expr = self.visit_expr(node.children[2])
+            if isinstance(target, GetAttr):
+                return SetAttr(target.obj, target.name, expr)
+            elif isinstance(target, GetItem):
+                return SetItem(target.obj, target.index, expr)
+            pos = node.children[0].getsourcepos()
+            raise ParseError(pos, ErrorInformation(
+                pos.i, ['a variable, property or item to assign to']))
+        head_info = node.children[0].additional_info
+        if head_info == 'while':
+            cond = self.visit_expr(node.children[2])
+            stmts = self._grab_stmts(node.children[5])
+            return While(cond, Block(stmts))
+        elif head_info == 'if':
+            cond = self.visit_expr(node.children[2])
+            stmts = self._grab_stmts(node.children[5])
+            if isinstance(node.children[6], Symbol):
+                assert node.children[6].additional_info == '}'
+                else_block = None
+            else:
+                else_block = Block(self._grab_stmts(
+                    node.children[6].children[3]))
+            return If(cond, Block(stmts), else_block)
+        elif head_info == 'return':
+            if len(node.children) == 2:
+                return Return()
+            elif len(node.children) == 3:
+                return Return(self.visit_expr(node.children[1]))
+            else:
+                raise NotImplementedError
+        elif len(node.children) == 4:
+            return Assignment(head_info, self.visit_expr(node.children[2]))
+        raise NotImplementedError
+
+    def visit_expr(self, node):  # noqa
+        if node.symbol == 'object':
+            if len(node.children) == 2:  # {}
+                return ObjectLiteral([], [])
+            names, values = self.visit_csprop(node.children[1])
+            return ObjectLiteral(names, values)
+        elif node.symbol == 'array':
+            if len(node.children) == 2:  # []
+                return ArrayLiteral([])
+            return ArrayLiteral(self.visit_csexpr(node.children[1]))
+        elif len(node.children) == 1:
+            if node.symbol == 'atom':
+                return self.visit_atom(node)
+            else:
+                return self.visit_expr(node.children[0])
+        elif node.symbol == 'call':
+            expr = self.visit_expr(node.children[0])
+            plus = node.children[1]
+            while True:  # suffixes from left to right
+                suffix = plus.children[0]
+                if suffix.children[0].additional_info == '.':
+                    expr = GetAttr(expr, suffix.children[1].additional_info)
+                elif suffix.children[0].additional_info == '[':
+                    expr = GetItem(expr, self.visit_expr(suffix.children[1]))
+                elif len(suffix.children) == 3:
+                    expr = Call(expr, self.visit_csexpr(suffix.children[1]))
+                else:
+                    assert len(suffix.children) == 2
+                    expr = Call(expr, [])
+                if len(plus.children) == 1:
+                    return expr
+                plus = plus.children[1]
+        elif node.symbol == 'fndef':
+            co_firstlineno = node.getsourcepos().lineno
+            fn_name = node.children[1].additional_info
+            if len(node.children) == 6:  # foo() {};
+                return FnDef(fn_name, [], Block([]),
+                             self.filename, co_firstlineno)
+            elif len(node.children) == 7:  # foo(x) {}; or foo() {x;}
+                if node.children[3].symbol == 'csvar':
+                    return FnDef(fn_name, self.visit_csvar(node.children[3]),
+                                 Block([]), self.filename, co_firstlineno)
+                else:
+                    stmts = self._grab_stmts(node.children[5])
+                    return FnDef(fn_name, [], Block(stmts),
+                                 self.filename, co_firstlineno)
+            elif len(node.children) == 8:  # foo(x) {x;}
+                stmts = self._grab_stmts(node.children[6])
+                return FnDef(fn_name, self.visit_csvar(node.children[3]),
+                             Block(stmts), self.filename, co_firstlineno)
+            else:
+                raise NotImplementedError
+        elif len(node.children) == 2:  # unary op
+            return signed(node.children[0].additional_info,
+                          self.visit_expr(node.children[1]))
+        elif len(node.children) == 3:  # binary op or (expr)
+            is_par_expr = True
+            for c, br in [(node.children[0], '('), (node.children[2], ')')]:
+                if not (isinstance(c, Symbol) and c.additional_info == br):
+                    is_par_expr = False
+                    break
+            if is_par_expr:
+                return self.visit_expr(node.children[1])
+            else:
+                return BinOp(node.children[1].additional_info,
+                             self.visit_expr(node.children[0]),
+                             self.visit_expr(node.children[2]))
+        else:
+            raise NotImplementedError
+
+    def visit_csexpr(self, node):
+        ''' Return a list of nodes (comma-separated "expr")
+        '''
+        assert len(node.children) in (1, 3)
+        expr_list = [self.visit_expr(node.children[0])]
+        if len(node.children) == 3:
+            expr_list.extend(self.visit_csexpr(node.children[2]))
+        return expr_list
+
+    def visit_csprop(self, node):
+        ''' Return the names and the values of comma-separated "prop"
+        '''
+        names = []
+        values = []
+        while True:
+            prop = node.children[0]
+            names.append(prop.children[0].additional_info)
+            values.append(self.visit_expr(prop.children[2]))
+            if len(node.children) == 1:
+                return names, values
+            node = node.children[2]
+
+    def visit_csvar(self, node):
+        ''' Return a list of variable names (comma-separated VARIABLE)
+        '''
+        assert len(node.children) in (1, 3)
+        assert node.children[0].symbol == 'VARIABLE'
+        name_list = [node.children[0].additional_info]
+        if len(node.children) == 3:
+            name_list.extend(self.visit_csvar(node.children[2]))
+        return name_list
+
+    def visit_atom(self, node):
+        chnode = node.children[0]
+        if chnode.symbol == 'NUMBER':
+            return number_literal(chnode.additional_info)
+        if chnode.symbol == 'STRING':
+            return ConstantStr(utils.unquote_string(chnode.additional_info))
+        if chnode.symbol == 'VARIABLE':
+            return Variable(chnode.additional_info)
+        raise NotImplementedError(chnode.symbol)
+
+
+class GrammarParser(object):
+
+    ''' Parses with the lexer and parser built from grammar.txt - building
+    them takes a while, so one is shared by all the sources to parse
+    '''
+
+    def __init__(self, grammar=None):
+        if grammar is None:
+            with open(GRAMMAR) as f:
+                grammar = f.read()
+        self.lexer, self.parser = build_tables(grammar)
+
+    def parse(self, source, filename=None):
+        ''' Parse the source code and produce an AST
+        '''
+        transformer = Transformer()
+        transformer.filename = filename
+        tree = self.parser.parse(self.lexer.tokenize(source, eof=True))
+        return transformer.visit_main(tree)
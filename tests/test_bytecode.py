@@ -1,14 +1,22 @@
 # -*- encoding: utf-8 -*-
 
-from js.parser import ConstantNum, Variable, Assignment, Stmt, Block, \
-    BinOp, Call, If, While, FnDef, Return
-from js.bytecode import CompilerContext, dis, to_code, \
-    LOAD_CONSTANT_FLOAT, LOAD_CONSTANT_FN, RETURN, LOAD_VAR, ASSIGN, \
+from js.parser import ConstantNum, ConstantInt, Variable, Assignment, Stmt, Block, \
+    BinOp, Call, If, While, FnDef, Return, ObjectLiteral, GetAttr, SetAttr, \
+    ArrayLiteral, GetItem, SetItem
+from js.bytecode import CompilerContext, dis, to_code, assemble, \
+    LOAD_CONSTANT_FLOAT, LOAD_CONSTANT_FN, RETURN, LOAD_FAST, ASSIGN, \
     DISCARD_TOP, BINARY_ADD, BINARY_EQ, BINARY_LT, BINARY_MUL, \
-    BINARY_SUB, BINARY_DIV, BINARY_MOD, JUMP_IF_FALSE, JUMP_ABSOLUTE, CALL
+    BINARY_SUB, BINARY_DIV, BINARY_MOD, JUMP_IF_FALSE, JUMP_ABSOLUTE, CALL, \
+    LOAD_DEREF, LOAD_GLOBAL, LOAD_BUILTIN, EXTENDED_ARG, LOAD_CONSTANT_INT, \
+    NEW_OBJECT, INIT_ATTR, LOAD_ATTR, STORE_ATTR, NEW_ARRAY, LOAD_ITEM, \
+    STORE_ITEM, STORE_CELL, TAIL_CALL
+from js.builtins import BUILTIN_INDEX
+from js.base_objects import W_FloatObject, W_IntObject
 
 
-compile_ast = CompilerContext.compile_ast
+def compile_ast(astnode, **kwargs):
+    kwargs.setdefault('optimize', False)
+    return CompilerContext.compile_ast(astnode, **kwargs)
 
 
 def test_dis():
@@ -16,30 +24,63 @@ def test_dis():
     assert dis(code) == 'LOAD_CONSTANT_FLOAT 1\nRETURN 0'
 
 
+def test_dis_extended_arg():
+    code = to_code([LOAD_CONSTANT_FLOAT, 0x1234, JUMP_ABSOLUTE, 0x10203])
+    assert code == to_code([
+        EXTENDED_ARG, 0x12, LOAD_CONSTANT_FLOAT, 0x34,
+        EXTENDED_ARG, 0x01, EXTENDED_ARG, 0x02, JUMP_ABSOLUTE, 0x03])
+    assert dis(code) == 'LOAD_CONSTANT_FLOAT 4660\nJUMP_ABSOLUTE 66051'
+
+
+def test_assemble():
+    # jump arguments are positions in the data list, and get relocated
+    # when EXTENDED_ARG prefixes are inserted before the target
+    code = assemble([
+        LOAD_CONSTANT_FLOAT, 300,
+        JUMP_IF_FALSE, 8,
+        LOAD_FAST, 2,
+        JUMP_ABSOLUTE, 0,
+        RETURN, 0])
+    assert code == to_code([
+        LOAD_CONSTANT_FLOAT, 300,
+        JUMP_IF_FALSE, 10,
+        LOAD_FAST, 2,
+        JUMP_ABSOLUTE, 0,
+        RETURN, 0])
+
+    # a jump needing a prefix itself moves every later instruction
+    data = [JUMP_IF_FALSE, 2 * 200]
+    data += [LOAD_FAST, 0] * 199
+    data += [RETURN, 0]
+    code = assemble(data)
+    assert len(code) == 2 * 201 + 2
+    assert dis(code).split('\n')[0] == 'JUMP_IF_FALSE 402'
+
+
 def test_const_num():
     bytecode = compile_ast(ConstantNum(10.0))
     assert bytecode.code == to_code([LOAD_CONSTANT_FLOAT, 0, RETURN, 0])
     assert bytecode.names == []
-    assert bytecode.constants_float == [10.0]
+    assert bytecode.constants_float == [W_FloatObject(10.0)]
 
 
 def test_variable():
     bytecode = compile_ast(Variable('x'))
-    assert bytecode.code == to_code([LOAD_VAR, 0, RETURN, 0])
+    assert bytecode.code == to_code([LOAD_FAST, 0, RETURN, 0])
     assert bytecode.names == ['x']
     assert bytecode.constants_float == []
 
     bytecode = compile_ast(Block([
         Variable('zzz'), Variable('y'), Variable('zzz')]))
     assert bytecode.code == to_code([
-        LOAD_VAR, 0, LOAD_VAR, 1, LOAD_VAR, 0, RETURN, 0])
+        LOAD_FAST, 0, LOAD_FAST, 1, LOAD_FAST, 0, RETURN, 0])
     assert bytecode.names == ['zzz', 'y']
     assert bytecode.constants_float == []
 
 
 def test_stmt():
     bytecode = compile_ast(Stmt(Variable('x')))
-    assert bytecode.code == to_code([LOAD_VAR, 0, DISCARD_TOP, 0, RETURN, 0])
+    assert bytecode.code == to_code([LOAD_FAST, 0, DISCARD_TOP, 0, RETURN, 0])
     assert bytecode.names == ['x']
     assert bytecode.constants_float == []
 
@@ -48,11 +89,11 @@ def test_block():
     bytecode = compile_ast(Block([
         Stmt(Variable('xyz')), Stmt(ConstantNum(12.3))]))
     assert bytecode.code == to_code([
-        LOAD_VAR, 0, DISCARD_TOP, 0,
+        LOAD_FAST, 0, DISCARD_TOP, 0,
         LOAD_CONSTANT_FLOAT, 0, DISCARD_TOP, 0,
         RETURN, 0])
     assert bytecode.names == ['xyz']
-    assert bytecode.constants_float == [12.3]
+    assert bytecode.constants_float == [W_FloatObject(12.3)]
 
 
 def test_binop():
@@ -67,8 +108,8 @@ def test_binop():
     ]:
         bytecode = compile_ast(BinOp(op, Variable('x'), Variable('y')))
         assert bytecode.code == to_code([
-            LOAD_VAR, 0,
-            LOAD_VAR, 1,
+            LOAD_FAST, 0,
+            LOAD_FAST, 1,
             bc, 0,
             RETURN, 0])
         assert bytecode.names == ['x', 'y']
@@ -77,16 +118,16 @@ def test_binop():
         bytecode = compile_ast(BinOp(op, ConstantNum(2.0), Variable('y')))
         assert bytecode.code == to_code([
             LOAD_CONSTANT_FLOAT, 0,
-            LOAD_VAR, 0,
+            LOAD_FAST, 0,
             bc, 0,
             RETURN, 0])
         assert bytecode.names == ['y']
-        assert bytecode.constants_float == [2.0]
+        assert bytecode.constants_float == [W_FloatObject(2.0)]
 
 
 def test_assignment():
     bytecode = compile_ast(Assignment('x', Variable('y')))
-    assert bytecode.code == to_code([LOAD_VAR, 0, ASSIGN, 1, RETURN, 0])
+    assert bytecode.code == to_code([LOAD_FAST, 0, ASSIGN, 1, RETURN, 0])
     assert bytecode.names == ['y', 'x']
     assert bytecode.constants_float == []
 
@@ -96,13 +137,13 @@ def test_assignment():
         ASSIGN, 0,
         RETURN, 0])
     assert bytecode.names == ['x']
-    assert bytecode.constants_float == [13.4]
+    assert bytecode.constants_float == [W_FloatObject(13.4)]
 
 
 def test_call():
     bytecode = compile_ast(Call(Variable('fn'), []))
     assert bytecode.code == to_code([
-        LOAD_VAR, 0,
+        LOAD_FAST, 0,
         CALL, 0,
         RETURN, 0])
     assert bytecode.names == ['fn']
@@ -110,35 +151,78 @@ def test_call():
 
     bytecode = compile_ast(Call(Variable('fn'), [ConstantNum(1.0)]))
     assert bytecode.code == to_code([
-        LOAD_VAR, 0,
+        LOAD_FAST, 0,
         LOAD_CONSTANT_FLOAT, 0,
         CALL, 1,
         RETURN, 0])
     assert bytecode.names == ['fn']
-    assert bytecode.constants_float == [1.0]
+    assert bytecode.constants_float == [W_FloatObject(1.0)]
 
     bytecode = compile_ast(Call(Variable('fn'), [
         Variable('z'), ConstantNum(1.0)]))
     assert bytecode.code == to_code([
-        LOAD_VAR, 0,
-        LOAD_VAR, 1,
+        LOAD_FAST, 0,
+        LOAD_FAST, 1,
         LOAD_CONSTANT_FLOAT, 0,
         CALL, 2,
         RETURN, 0])
     assert bytecode.names == ['fn', 'z']
-    assert bytecode.constants_float == [1.0]
+    assert bytecode.constants_float == [W_FloatObject(1.0)]
 
     bytecode = compile_ast(Call(Variable('fn'), [
         Call(Variable('z'), []), ConstantNum(1.0)]))
     assert bytecode.code == to_code([
-        LOAD_VAR, 0,
-        LOAD_VAR, 1,
+        LOAD_FAST, 0,
+        LOAD_FAST, 1,
         CALL, 0,
         LOAD_CONSTANT_FLOAT, 0,
         CALL, 2,
         RETURN, 0])
     assert bytecode.names == ['fn', 'z']
-    assert bytecode.constants_float == [1.0]
+    assert bytecode.constants_float == [W_FloatObject(1.0)]
+
+
+def test_object():
+    bytecode = compile_ast(Block([
+        Assignment('o', ObjectLiteral(['a', 'b'], [
+            ConstantInt(1), ConstantInt(2)])),
+        SetAttr(Variable('o'), 'c', GetAttr(Variable('o'), 'a')),
+    ]))
+    assert bytecode.code == to_code([
+        NEW_OBJECT, 0,
+        LOAD_CONSTANT_INT, 0,
+        INIT_ATTR, 0,
+        LOAD_CONSTANT_INT, 1,
+        INIT_ATTR, 1,
+        ASSIGN, 0,
+        LOAD_FAST, 0,
+        LOAD_FAST, 0,
+        LOAD_ATTR, 0,
+        STORE_ATTR, 2,
+        RETURN, 0])
+    assert bytecode.strings == ['a', 'b', 'c']
+    assert bytecode.co_stacksize == 2
+
+
+def test_array():
+    bytecode = compile_ast(Block([
+        Assignment('a', ArrayLiteral([ConstantInt(1), ConstantInt(2)])),
+        SetItem(Variable('a'), ConstantInt(0),
+                GetItem(Variable('a'), ConstantInt(1))),
+    ]))
+    assert bytecode.code == to_code([
+        LOAD_CONSTANT_INT, 0,
+        LOAD_CONSTANT_INT, 1,
+        NEW_ARRAY, 2,
+        ASSIGN, 0,
+        LOAD_FAST, 0,
+        LOAD_CONSTANT_INT, 2,
+        LOAD_FAST, 0,
+        LOAD_CONSTANT_INT, 0,
+        LOAD_ITEM, 0,
+        STORE_ITEM, 0,
+        RETURN, 0])
+    assert bytecode.co_stacksize == 4
 
 
 def test_if():
@@ -150,7 +234,8 @@ def test_if():
         RETURN, 0])
     assert bytecode.code == expected_code
     assert bytecode.names == []
-    assert bytecode.constants_float == [1.0, 2.0]
+    assert bytecode.constants_float == [
+        W_FloatObject(1.0), W_FloatObject(2.0)]
 
     bytecode = compile_ast(
         If(ConstantNum(1.0), ConstantNum(2.0), ConstantNum(3.0)))
@@ -164,7 +249,8 @@ def test_if():
     print dis(bytecode.code)
     assert bytecode.code == expected_code
     assert bytecode.names == []
-    assert bytecode.constants_float == [1.0, 2.0, 3.0]
+    assert bytecode.constants_float == [
+        W_FloatObject(1.0), W_FloatObject(2.0), W_FloatObject(3.0)]
 
 
 def test_while():
@@ -172,15 +258,15 @@ def test_while():
         Variable('x'),
         While(ConstantNum(1.0), ConstantNum(1.0))]))
     expected_code = to_code([
-        LOAD_VAR, 0,
+        LOAD_FAST, 0,
         LOAD_CONSTANT_FLOAT, 0,
         JUMP_IF_FALSE, 10,
-        LOAD_CONSTANT_FLOAT, 1,
+        LOAD_CONSTANT_FLOAT, 0,
         JUMP_ABSOLUTE, 2,
         RETURN, 0])
     assert bytecode.code == expected_code
     assert bytecode.names == ['x']
-    assert bytecode.constants_float == [1.0, 1.0]
+    assert bytecode.constants_float == [W_FloatObject(1.0)]
 
 
 def test_fn_def():
@@ -213,8 +299,8 @@ def test_fn_def():
         LOAD_CONSTANT_FN, 0,
         RETURN, 0])
     expected_inner_bytecode = to_code([
-        LOAD_VAR, 0,
-        LOAD_VAR, 0,
+        LOAD_FAST, 0,
+        LOAD_FAST, 0,
         BINARY_MUL, 0,
         DISCARD_TOP, 0,
         RETURN, 0
@@ -237,8 +323,8 @@ def test_fn_def():
         LOAD_CONSTANT_FN, 0,
         RETURN, 0])
     expected_inner_bytecode = to_code([
-        LOAD_VAR, 1,
-        LOAD_VAR, 1,
+        LOAD_FAST, 1,
+        LOAD_FAST, 1,
         BINARY_MUL, 0,
         DISCARD_TOP, 0,
         RETURN, 0
@@ -262,7 +348,7 @@ def test_return():
         LOAD_CONSTANT_FN, 0,
         RETURN, 0])
     expected_inner_bytecode = to_code([
-        LOAD_VAR, 0,
+        LOAD_FAST, 0,
         RETURN, 1
     ])
 
@@ -293,9 +379,9 @@ def test_return():
         LOAD_CONSTANT_FN, 0,
         RETURN, 0])
     expected_inner_bytecode = to_code([
-        LOAD_VAR, 0,
+        LOAD_FAST, 0,
         RETURN, 1,
-        LOAD_VAR, 0,
+        LOAD_FAST, 0,
         DISCARD_TOP, 0,
         RETURN, 0,
     ])
@@ -307,3 +393,143 @@ def test_return():
     assert inner.code == expected_inner_bytecode
     assert inner.names == ['x']
     assert inner.constants_float == []
+
+
+def test_scope_resolution():
+    bytecode = compile_ast(Block([
+        Assignment('g', ConstantNum(1.0)),
+        Stmt(FnDef('outer', ['x'], Block([
+            Assignment('y', ConstantNum(2.0)),
+            Stmt(FnDef('inner', [], Block([
+                Return(BinOp('+', Variable('x'), BinOp(
+                    '+', Variable('y'), Variable('g'))))]), None, 0)),
+            Return(Call(Variable('print'), [Variable('inner')])),
+        ]), None, 0)),
+    ]))
+    assert bytecode.names == ['g', 'outer']
+    assert bytecode.cellvars == bytecode.freevars == []
+    assert bytecode.closures == [[]]
+
+    # x and y, loaded by inner, are kept in cells
+    outer = bytecode.constants_fn[0]
+    assert outer.names == ['x', 'y', 'inner']
+    assert outer.cellvars == [0, 1]
+    assert outer.freevars == []
+    assert outer.closures == [[0, 1]]
+    assert outer.code == to_code([
+        LOAD_CONSTANT_FLOAT, 1,
+        STORE_CELL, 1,
+        LOAD_CONSTANT_FN, 0,
+        ASSIGN, 2,
+        LOAD_CONSTANT_FN, 0,
+        DISCARD_TOP, 0,
+        LOAD_BUILTIN, BUILTIN_INDEX['print'],
+        LOAD_FAST, 2,
+        TAIL_CALL, 1])
+
+    inner = outer.constants_fn[0]
+    assert inner.names == []
+    assert inner.cellvars == []
+    assert inner.freevars == ['x', 'y']
+    assert inner.code == to_code([
+        LOAD_DEREF, 0,
+        LOAD_DEREF, 1,
+        LOAD_GLOBAL, 0,
+        BINARY_ADD, 0,
+        BINARY_ADD, 0,
+        RETURN, 1])
+
+
+def test_scope_resolution_undefined():
+    bytecode = compile_ast(FnDef('foo', [], Block([
+        Return(Variable('nowhere'))]), None, 0))
+    inner = bytecode.constants_fn[0]
+    assert inner.names == ['nowhere']
+    assert inner.code == to_code([LOAD_FAST, 0, RETURN, 1])
+
+
+def test_constant_pool():
+    bytecode = compile_ast(Block([
+        Assignment('x', ConstantNum(1.0)),
+        Assignment('y', ConstantNum(-0.0)),
+        Assignment('z', ConstantNum(0.0)),
+        Stmt(FnDef('foo', [], Block([
+            Return(BinOp('+', ConstantNum(1.0), ConstantNum(0.0)))]),
+            None, 0)),
+    ]))
+    assert bytecode.code == to_code([
+        LOAD_CONSTANT_FLOAT, 0,
+        ASSIGN, 0,
+        LOAD_CONSTANT_FLOAT, 1,
+        ASSIGN, 1,
+        LOAD_CONSTANT_FLOAT, 2,
+        ASSIGN, 2,
+        LOAD_CONSTANT_FN, 0,
+        ASSIGN, 3,
+        LOAD_CONSTANT_FN, 0,
+        DISCARD_TOP, 0,
+        RETURN, 0])
+    inner = bytecode.constants_fn[0]
+    assert inner.code == to_code([
+        LOAD_CONSTANT_FLOAT, 0,
+        LOAD_CONSTANT_FLOAT, 2,
+        BINARY_ADD, 0,
+        RETURN, 1])
+    # one list of boxed constants shared by the whole compilation unit
+    assert inner.constants_float is bytecode.constants_float
+    assert len(bytecode.constants_float) == 3
+
+
+def test_constant_pool_int():
+    bytecode = compile_ast(Block([
+        Assignment('x', ConstantInt(1)),
+        Assignment('y', ConstantNum(1.0)),
+        Stmt(FnDef('foo', [], Block([
+            Return(BinOp('+', ConstantInt(2), ConstantInt(1)))]),
+            None, 0)),
+    ]))
+    assert bytecode.code[:8] == to_code([
+        LOAD_CONSTANT_INT, 0,
+        ASSIGN, 0,
+        LOAD_CONSTANT_FLOAT, 0,
+        ASSIGN, 1])
+    inner = bytecode.constants_fn[0]
+    assert inner.code == to_code([
+        LOAD_CONSTANT_INT, 1,
+        LOAD_CONSTANT_INT, 0,
+        BINARY_ADD, 0,
+        RETURN, 1])
+    assert inner.constants_int is bytecode.constants_int
+    assert bytecode.constants_int == [W_IntObject(1), W_IntObject(2)]
+
+
+def test_stacksize():
+    bytecode = compile_ast(Stmt(ConstantNum(1.0)))
+    assert bytecode.co_stacksize == 1
+
+    bytecode = compile_ast(Block([]))
+    assert bytecode.co_stacksize == 0
+
+    bytecode = compile_ast(Call(Variable('fn'), [
+        Variable('x'),
+        BinOp('+', Variable('y'), BinOp('*', Variable('z'), Variable('x'))),
+        ConstantNum(1.0)]))
+    assert bytecode.co_stacksize == 5
+
+    bytecode = compile_ast(FnDef('foo', ['x'], Block([
+        If(Variable('x'),
+           Block([Return(BinOp('+', Variable('x'), Variable('x')))]),
+           Block([While(Variable('x'), Block([
+               Stmt(Call(Variable('foo'), [Variable('x')]))]))]))]),
+        None, 0))
+    assert bytecode.co_stacksize == 1
+    assert bytecode.constants_fn[0].co_stacksize == 2
+
+
+def test_argcount():
+    bytecode = compile_ast(FnDef('foo', ['x', 'y'], Block([
+        Assignment('z', Variable('x'))]), None, 0))
+    assert bytecode.co_argcount == 0
+    inner = bytecode.constants_fn[0]
+    assert inner.names == ['x', 'y', 'z']
+    assert inner.co_argcount == 2
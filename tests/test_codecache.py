@@ -0,0 +1,191 @@
+# -*- encoding: utf-8 -*-
+
+import pytest
+
+from rpython.rlib import rmmap
+
+from js.base_objects import W_FloatObject
+from js.codecache import CacheError, dump, undump, load, store, cache_path, \
+    unit_constants
+from js.interpreter import compile_source, interpret
+from js.main import main
+
+
+SOURCE = '''
+function counter(start) {
+    n = start;
+    function next() {
+        return n + 0.5;
+    };
+    return next;
+};
+x = "text";
+big = 100000000 * 100000000;
+print(counter(-3)());
+'''
+
+
+def assert_same_code(bc, loaded):
+    assert loaded.code == bc.code
+    assert loaded.names == bc.names
+    assert loaded.cellvars == bc.cellvars
+    assert loaded.freevars == bc.freevars
+    assert loaded.closures == bc.closures
+    assert loaded.unbound_ops == bc.unbound_ops
+    assert loaded.unbound_args == bc.unbound_args
+    assert loaded.co_stacksize == bc.co_stacksize
+    assert loaded.co_argcount == bc.co_argcount
+    assert loaded.co_name == bc.co_name
+    assert loaded.co_filename == bc.co_filename
+    assert loaded.co_firstlineno == bc.co_firstlineno
+    assert len(loaded.constants_fn) == len(bc.constants_fn)
+    for i in xrange(len(bc.constants_fn)):
+        assert_same_code(bc.get_constant_fn(i), loaded.get_constant_fn(i))
+
+
+def test_roundtrip(capfd):
+    bc = compile_source(SOURCE, filename='counter.js')
+    loaded = undump(dump(bc, SOURCE), SOURCE)
+    assert_same_code(bc, loaded)
+    # the constants of the functions compiled lazily, for the dump, are
+    # added to the pool
+    assert bc.constants_float == []
+    pool = unit_constants(bc)
+    assert loaded.constants_float == pool.constants_float == \
+        [W_FloatObject(0.5)]
+    assert loaded.constants_int == pool.constants_int
+    assert loaded.constants_string == pool.constants_string
+    # the constant pool stays shared by the nested functions
+    inner = loaded.get_constant_fn(0).get_constant_fn(0)
+    assert inner.constants_float is loaded.constants_float
+    interpret(loaded)
+    out, _ = capfd.readouterr()
+    assert out == '-2.5\n'
+
+
+def test_lazy_functions(tmpdir, capfd):
+    path = str(tmpdir.join('script.jsc'))
+    bc = compile_source(SOURCE)
+    store(path, SOURCE, bc)
+    loaded = load(path, SOURCE)
+    # nested functions are only decoded once they are defined
+    assert loaded.constants_fn == [None]
+    interpret(loaded)
+    out, _ = capfd.readouterr()
+    assert out == '-2.5\n'
+    assert loaded.constants_fn[0].constants_fn[0] is not None
+    # a precompiled image runs without its source
+    assert_same_code(bc, load(path))
+
+
+def test_load_unmaps(tmpdir, monkeypatch):
+    maps = []
+    real_mmap = rmmap.mmap
+
+    def mmap(*args):
+        maps.append(real_mmap(*args))
+        return maps[-1]
+    monkeypatch.setattr('js.codecache.rmmap.mmap', mmap)
+    path = str(tmpdir.join('script.jsc'))
+    store(path, SOURCE, compile_source(SOURCE))
+    assert load(path, SOURCE) is not None
+    # still mapped to decode the nested functions from
+    assert not maps[-1].closed
+    assert load(path, SOURCE + ' ') is None
+    assert maps[-1].closed
+    store(path, 'x = 1;', compile_source('x = 1;'))
+    assert load(path, 'x = 1;') is not None
+    assert maps[-1].closed
+
+
+def test_invalid():
+    bc = compile_source(SOURCE)
+    data = dump(bc, SOURCE)
+    with pytest.raises(CacheError):
+        undump(data, SOURCE + ' ')
+    with pytest.raises(CacheError):
+        undump('JSC\x00' + data[4:], SOURCE)
+    with pytest.raises(CacheError):
+        undump(data[:-3], SOURCE)
+    with pytest.raises(CacheError):
+        undump(data + 'x', SOURCE)
+
+
+def test_cache_path():
+    assert cache_path('dir/script.js') == 'dir/script.jsc'
+    assert cache_path('script') == 'script.jsc'
+    path = cache_path('dir/script.js', '/tmp/cache')
+    assert path.startswith('/tmp/cache/script.js-')
+    assert path.endswith('.jsc')
+    assert path != cache_path('other/script.js', '/tmp/cache')
+
+
+def test_load_and_store(tmpdir):
+    path = str(tmpdir.join('script.jsc'))
+    assert load(path, SOURCE) is None
+    bc = compile_source(SOURCE)
+    store(path, SOURCE, bc)
+    assert_same_code(bc, load(path, SOURCE))
+    assert load(path, SOURCE.replace('-3', '-4')) is None
+    assert load(path, SOURCE, inline=False) is None
+    # an unwritable cache is no error
+    store(str(tmpdir.join('missing', 'script.jsc')), SOURCE, bc)
+
+
+def test_main(tmpdir, capfd, monkeypatch):
+    script = tmpdir.join('script.js')
+    script.write(SOURCE)
+    cache = tmpdir.join('script.jsc')
+
+    assert main(['js', '--no-cache', str(script)]) == 0
+    assert not cache.check()
+    assert main(['js', '--no-inline', str(script)]) == 0
+    assert load(str(cache), SOURCE, inline=False) is not None
+    # the code without inlined calls is not run by default
+    assert load(str(cache), SOURCE) is None
+    assert main(['js', '--compile-only', str(script)]) == 0
+    assert load(str(cache), SOURCE) is not None
+    out, _ = capfd.readouterr()
+    assert out == '-2.5\n' * 2
+
+    # a valid cache is run without compiling the source
+    def fail(*args, **kwargs):
+        raise AssertionError('compiled')
+    monkeypatch.setattr('js.main.compile_source', fail)
+    assert main(['js', str(script)]) == 0
+    out, _ = capfd.readouterr()
+    assert out == '-2.5\n'
+
+    cache_dir = tmpdir.mkdir('cache')
+    monkeypatch.undo()
+    assert main(['js', '--cache-dir', str(cache_dir), '--compile-only',
+                 str(script)]) == 0
+    assert len(cache_dir.listdir()) == 1
+    assert main(['js', '--bogus', str(script)]) == 1
+    for depth in ['abc', '0', '-1']:
+        assert main(['js', '--max-call-depth', depth, str(script)]) == 1
+        out, _ = capfd.readouterr()
+        assert out.startswith('Usage: js')
+    capfd.readouterr()
+
+    # running the image directly
+    script.remove()
+    assert main(['js', str(cache)]) == 0
+    out, _ = capfd.readouterr()
+    assert out == '-2.5\n'
+    cache.write('junk')
+    assert main(['js', str(cache)]) == 1
+
+
+def test_cache_stored_after_run(tmpdir, capfd, monkeypatch):
+    script = tmpdir.join('script.js')
+    script.write(SOURCE)
+    outputs = []
+
+    def store(path, source, bc, inline=True):
+        out, _ = capfd.readouterr()
+        outputs.append(out)
+    monkeypatch.setattr('js.codecache.store', store)
+    assert main(['js', str(script)]) == 0
+    # the functions are compiled for the cache only after the run
+    assert outputs == ['-2.5\n']
@@ -1,35 +1,46 @@
 # -*- encoding: utf-8 -*-
 
-from js.bytecode import to_code, ByteCode, \
-    LOAD_CONSTANT_FLOAT, RETURN, JUMP_IF_FALSE, JUMP_ABSOLUTE
-from js.interpreter import Frame, interpret, interpret_source
-from js.base_objects import W_FloatObject, W_BoolObject
+import pytest
+
+from js import parser, arrays
+from js.bytecode import to_code, ByteCode, CompilerContext, \
+    LOAD_CONSTANT_FLOAT, RETURN, JUMP_IF_FALSE, JUMP_ABSOLUTE, \
+    BINARY_ADD, BINARY_ADD_FLOAT, BINARY_ADD_INT, BINARY_ADD_STRING, \
+    BINARY_SUB, BINARY_SUB_INT, MAX_QUICKEN_MISSES, LOAD_ATTR, \
+    BINARY_SUB_FLOAT, BINARY_DIV, BINARY_LT_FLOAT, read_instruction
+from js.interpreter import Frame, interpret, interpret_source, stats
+from js.base_objects import OperationalError
+from js.base_objects import W_FloatObject, W_IntObject, W_BoolObject, \
+    W_StringObject, w_True, w_False, w_Undefined, newstring
 
 
 def test_frame():
-    bc = ByteCode('', ['x', 'y'], [], [], [])
+    bc = ByteCode('', ['x', 'y'], [], [], [], co_stacksize=2)
     frame = Frame(bc)
     assert len(frame.vars) == 2
-    assert frame.valuestack_pos == 0
+    assert len(frame.locals_stack) == 4
+    assert frame.valuestack_pos == 2
     x, y = object(), object()
     frame.push(x)
-    assert frame.valuestack_pos == 1
+    assert frame.valuestack_pos == 3
     res = frame.pop()
     assert res is x
-    assert frame.valuestack_pos == 0
+    assert frame.valuestack_pos == 2
     frame.push(x)
     frame.push(y)
-    assert frame.valuestack_pos == 2
+    assert frame.valuestack_pos == 4
+    assert frame.test_valuestack == [x, y]
     res = frame.pop()
     assert res is y
-    assert frame.valuestack_pos == 1
+    assert frame.valuestack_pos == 3
+    assert frame.vars == [None, None]
 
 
 def test_load_constant():
     bc = ByteCode(to_code([
         LOAD_CONSTANT_FLOAT, 0,
         RETURN, 0]),
-        [], [12.2], [], [])
+        [], [W_FloatObject(12.2)], [], [])
     frame = interpret(bc)
     assert frame.test_valuestack == [W_FloatObject(12.2)]
     assert frame.vars == []
@@ -65,7 +76,8 @@ def test_jumps():
         JUMP_ABSOLUTE, 10,
         LOAD_CONSTANT_FLOAT, 2,
         RETURN, 0]),
-        [], [0.0, -1.0, 1.0], [], [])
+        [], [W_FloatObject(0.0), W_FloatObject(-1.0), W_FloatObject(1.0)],
+        [], [])
     frame = interpret(bc)
     assert frame.test_valuestack == [W_FloatObject(1.0)]
 
@@ -76,7 +88,8 @@ def test_jumps():
         JUMP_ABSOLUTE, 10,
         LOAD_CONSTANT_FLOAT, 2,
         RETURN, 0]),
-        [], [1.0, -1.0, 2.0], [], [])
+        [], [W_FloatObject(1.0), W_FloatObject(-1.0), W_FloatObject(2.0)],
+        [], [])
     frame = interpret(bc)
     assert frame.test_valuestack == [W_FloatObject(-1.0)]
 
@@ -95,7 +108,7 @@ def test_if():
         x = 10;
     }''')
     assert frame.names == ['x']
-    assert frame.vars == [W_FloatObject(10.0)]
+    assert frame.vars == [W_IntObject(10)]
     assert frame.test_valuestack == []
 
 
@@ -116,7 +129,7 @@ def test_while():
         y = 100;
     }''')
     assert frame.names == ['x', 'y']
-    assert frame.vars == [W_FloatObject(0.0), W_FloatObject(100.0)]
+    assert frame.vars == [W_IntObject(0), W_IntObject(100)]
     assert frame.test_valuestack == []
 
 
@@ -129,6 +142,71 @@ def test_binary_add():
     assert frame.test_valuestack == []
 
 
+def test_string_concatenation():
+    frame = interpret_source('''
+    x = "foo";
+    y = x + "bar";
+    z = y + 1;
+    w = 1 + y;
+    ''')
+    assert frame.vars[1:] == [
+        W_StringObject('foobar'), W_StringObject('foobar1'),
+        W_StringObject('1foobar')]
+
+
+def test_string_rope():
+    frame = interpret_source('''
+    s = "";
+    i = 0;
+    while (i < 20000) {
+        s = s + "ab";
+        i = i + 1;
+    }
+    ''')
+    w_str = frame.vars[0]
+    assert w_str.length == 40000
+    assert w_str.stringval is None  # not flattened yet
+    assert w_str.to_string() == 'ab' * 20000
+    assert w_str.left is None and w_str.right is None
+
+
+def test_string_comparison():
+    frame = interpret_source('''
+    a = "foo" == "foo";
+    b = "foo" == "bar";
+    c = "abc" < "abd";
+    d = "10" == 10;
+    e = "x" + "y" == "xy";
+    ''')
+    assert frame.vars == [w_True, w_False, w_True, w_True, w_True]
+
+
+def test_string_hash():
+    a = W_StringObject('abc')
+    b = W_StringObject(None, W_StringObject('ab'), W_StringObject('d'))
+    assert a.hash == 0 and b.hash == 0
+    assert not a.eq_bool(b)
+    # the hashes are kept, to tell the strings apart next time
+    assert a.hash != 0 and b.hash != 0 and a.hash != b.hash
+    assert a.eq_bool(W_StringObject('abc'))
+
+
+def test_string_interning():
+    frame = interpret_source('''
+    a = "foo";
+    function f() {
+        return "foo";
+    };
+    b = f();
+    c = typeof(1);
+    d = "not an identifier";
+    ''')
+    assert frame.vars[0] is frame.vars[2]
+    assert frame.vars[0].interned
+    assert frame.vars[3] is newstring('number')
+    assert not frame.vars[4].interned
+
+
 def test_binary_bool():
     for binary_op, check_fn in [
             ('<', lambda x, y: x < y),
@@ -147,6 +225,70 @@ def test_binary_bool():
             assert frame.test_valuestack == []
 
 
+def test_singletons(capfd):
+    frame = interpret_source('''
+    function nothing() {
+        return;
+    };
+    a = 1 < 2;
+    b = 2 < 1;
+    c = 1 == 1;
+    d = nothing();
+    e = print(null);
+    f = true;
+    if (undefined) {
+        f = false;
+    }
+    print(d);
+    print(f);
+    ''')
+    out, _ = capfd.readouterr()
+    assert out == 'null\nundefined\ntrue\n'
+    assert frame.vars[1:] == [w_True, w_False, w_True, w_Undefined,
+                              w_Undefined, w_True]
+    assert frame.vars[1] is w_True
+    assert frame.vars[2] is w_False
+    assert frame.vars[5] is w_Undefined
+
+
+def test_integers():
+    frame = interpret_source('''
+    a = 100000000 * 100000000;
+    b = a * a;
+    c = 5 + 5;
+    d = 20 - 10;
+    e = 6 / 3;
+    f = 7 / 2;
+    g = 0 * (-1);
+    ''')
+    assert frame.vars == [
+        W_IntObject(10 ** 16), W_FloatObject(1e32), W_IntObject(10),
+        W_IntObject(10), W_IntObject(2), W_FloatObject(3.5),
+        W_FloatObject(-0.0)]
+    # small ints are shared
+    assert frame.vars[2] is frame.vars[3]
+
+
+def test_number_output(capfd):
+    interpret_source('''
+    print((-7) % 2);
+    print(7 % (-2));
+    print(5.5 % 2);
+    print(5 % 0);
+    print(1 / 0);
+    print((-1) / 0);
+    print(0.1 + 0.2);
+    print(2.0);
+    print(0.0000001);
+    print(typeof(1));
+    print(typeof(1.5));
+    ''')
+    out, _ = capfd.readouterr()
+    assert out.split() == [
+        '-1', '1', '1.5', 'NaN', 'Infinity', '-Infinity',
+        '0.30000000000000004', '2', '1e-7', 'number', 'number']
+
+
 def test_while_loops():
     frame = interpret_source('''
     x = 0;
@@ -155,7 +297,7 @@ def test_while_loops():
     }
     ''')
     assert frame.names == ['x']
-    assert frame.vars == [W_FloatObject(10.0)]
+    assert frame.vars == [W_IntObject(10)]
     assert frame.test_valuestack == []
 
 
@@ -173,12 +315,13 @@ def test_arithmetic_expressions():
     z = (x + y) / x + 3;
     foo = y % 5 + y % 1 + y % 2;
     ''')
-    x = 10.0
+    x = 10
     y = 4 + x * 2
-    z = (x + y) / x + 3
+    z = float(x + y) / x + 3
     foo = y % 5 + y % 1 + y % 2
     assert frame.names == ['x', 'y', 'z', 'foo']
-    assert frame.vars == map(W_FloatObject, [x, y, z, foo])
+    assert frame.vars == [
+        W_IntObject(x), W_IntObject(y), W_FloatObject(z), W_IntObject(foo)]
     assert frame.test_valuestack == []
 
 
@@ -200,7 +343,7 @@ def test_fn_print(capfd):
     foo();
     ''')
     out, _ = capfd.readouterr()
-    assert out == '1.0\n'
+    assert out == '1\n'
     assert frame.names == ['foo']
     assert len(frame.vars) == 1
     assert frame.test_valuestack == []
@@ -214,7 +357,7 @@ def test_fn_args(capfd):
     foo(10);
     ''')
     out, _ = capfd.readouterr()
-    assert out == '10.0\n'
+    assert out == '10\n'
     assert frame.names == ['foo']
     assert len(frame.vars) == 1
     assert frame.test_valuestack == []
@@ -227,7 +370,7 @@ def test_fn_args(capfd):
     foo(10, x);
     ''')
     out, _ = capfd.readouterr()
-    assert out == '30.0\n'
+    assert out == '30\n'
     assert frame.names == ['foo', 'x']
     assert len(frame.vars) == 2
     assert frame.test_valuestack == []
@@ -250,7 +393,7 @@ def test_return():
     z = two(two(11));
     ''')
     assert frame.names == ['two', 'z']
-    assert frame.vars[1] == W_FloatObject(44)
+    assert frame.vars[1] == W_IntObject(44)
 
 
 def test_scope():
@@ -262,7 +405,7 @@ def test_scope():
     y = s();
     ''')
     assert frame.names == ['x', 's', 'y']
-    assert frame.vars[2] == W_FloatObject(10.0)
+    assert frame.vars[2] == W_IntObject(10)
 
     frame = interpret_source('''
     g = 30;
@@ -282,7 +425,33 @@ def test_scope():
     y = scoped();
     ''')
     assert frame.names == ['g', 's', 'scoped', 'y']
-    assert frame.vars[3] == W_FloatObject(10.0)
+    assert frame.vars[3] == W_IntObject(10)
+
+    frame = interpret_source('''
+    a = 1;
+    function f(b) {
+        function g(c) {
+            function h() {
+                return a + b + c;
+            };
+            return h();
+        };
+        return g(10);
+    };
+    y = f(100);
+    ''')
+    assert frame.vars[2] == W_IntObject(111)
+
+
+def test_undefined_variable():
+    with pytest.raises(OperationalError) as excinfo:
+        interpret_source('''
+        function f() {
+            return nowhere;
+        };
+        f();
+        ''')
+    assert str(excinfo.value) == 'Variable "nowhere" is not defined'
 
 
 def test_recursion():
@@ -301,8 +470,620 @@ def test_recursion():
     f10 = fib(10);
     ''')
     assert frame.names == ['fib', 'f1', 'f2', 'f3', 'f4', 'f10']
-    assert frame.vars[1] == W_FloatObject(1.0)
-    assert frame.vars[2] == W_FloatObject(1.0)
-    assert frame.vars[3] == W_FloatObject(2.0)
-    assert frame.vars[4] == W_FloatObject(3.0)
-    assert frame.vars[5] == W_FloatObject(55.0)
+    assert frame.vars[1] == W_IntObject(1)
+    assert frame.vars[2] == W_IntObject(1)
+    assert frame.vars[3] == W_IntObject(2)
+    assert frame.vars[4] == W_IntObject(3)
+    assert frame.vars[5] == W_IntObject(55)
+
+
+def test_argument_order():
+    frame = interpret_source('''
+    function sub(x, y) {
+        return x - y;
+    };
+    r = sub(10, 3);
+    ''')
+    assert frame.vars[1] == W_IntObject(7)
+
+
+def test_argument_count():
+    frame = interpret_source('''
+    function first(x) {
+        y = 2;
+        return x + y;
+    };
+    r = first(1, 5, 6);
+    ''')
+    assert frame.vars[1] == W_IntObject(3)
+    assert frame.test_valuestack == []
+
+    # missing arguments are undefined
+    frame = interpret_source('''
+    function second(x, y) {
+        return y;
+    };
+    r = second(1);
+    ''')
+    assert frame.vars[1] is w_Undefined
+
+
+def test_deep_recursion():
+    # deeper than the host recursion limit, calls do not recurse in execute
+    frame = interpret_source('''
+    function down(n) {
+        if (n < 1) {
+            return 0;
+        }
+        return down(n - 1) + 1;
+    };
+    r = down(5000);
+    ''')
+    assert frame.vars[1] == W_IntObject(5000)
+
+
+def test_call_depth_limit():
+    source = '''
+    function down(n) {
+        if (n < 1) {
+            return 0;
+        }
+        return 1 + down(n - 1);
+    };
+    r = down(100);
+    '''
+    frame = interpret_source(source, max_call_depth=101)
+    assert frame.vars[1] == W_IntObject(100)
+    with pytest.raises(OperationalError) as excinfo:
+        interpret_source(source, max_call_depth=100)
+    assert str(excinfo.value) == \
+        'RangeError: Maximum call stack size exceeded'
+
+
+def test_tail_calls():
+    frame = interpret_source('''
+    function loop(n, acc) {
+        if (n < 1) {
+            return acc;
+        }
+        return loop(n - 1, acc + n);
+    };
+    function even(n) {
+        if (n == 0) {
+            return true;
+        }
+        return odd(n - 1);
+    };
+    function odd(n) {
+        if (n == 0) {
+            return false;
+        }
+        return even(n - 1);
+    };
+    function kind(x) {
+        return typeof(x);
+    };
+    r = loop(100, 0);
+    e = even(1001);
+    k = kind(1);
+    ''', max_call_depth=10)
+    assert frame.vars[4:] == [W_IntObject(5050), w_False,
+                              newstring('number')]
+
+
+def test_deep_tail_recursion():
+    stats.reset()
+    frame = interpret_source('''
+    function down(n) {
+        if (n < 1) {
+            return n;
+        }
+        return down(n - 1);
+    };
+    r = down(10000);
+    ''', max_call_depth=10)
+    assert frame.vars[1] == W_IntObject(0)
+    # the frame of each call replaces the previous one, and is reused
+    assert stats.frames_allocated == 3
+
+
+def test_frame_reuse():
+    stats.reset()
+    frame = interpret_source('''
+    function fib(x) {
+        if (x < 3) {
+            return 1;
+        }
+        return fib(x - 1) + fib(x - 2);
+    };
+    r = fib(10);
+    ''')
+    assert frame.vars[1] == W_IntObject(55)
+    # one frame per level of recursion, plus the top level
+    assert stats.frames_allocated == 10
+    assert stats.frames_reused == 109 - 9
+
+
+def test_closures():
+    stats.reset()
+    frame = interpret_source('''
+    function make(x) {
+        function get() {
+            return x;
+        };
+        x = x * 10;
+        return get;
+    };
+    a = make(1);
+    b = make(2);
+    ra = a();
+    rb = b();
+    ''')
+    # each call has its own cells, which see later assignments
+    assert frame.vars[3:] == [W_IntObject(10), W_IntObject(20)]
+    a = frame.vars[1]
+    assert [cell.w_value for cell in a.closure] == [W_IntObject(10)]
+    # the frames of make are reused, only the cells are kept
+    assert stats.functions_allocated == 3
+    assert stats.frames_allocated == 1 + 1 + 1
+    assert stats.frames_reused == 2
+
+
+def test_closure_of_nested_functions():
+    frame = interpret_source('''
+    function outer(x) {
+        function middle() {
+            function inner() {
+                return x + y;
+            };
+            return inner;
+        };
+        f = middle();
+        y = 2;
+        return f;
+    };
+    r = outer(1)();
+    ''')
+    assert frame.vars[1] == W_IntObject(3)
+    with pytest.raises(OperationalError) as excinfo:
+        interpret_source('''
+        function early() {
+            function get() {
+                return z;
+            };
+            r = get();
+            z = 1;
+        };
+        early();
+        ''')
+    assert str(excinfo.value) == 'Variable "z" is not defined'
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_load_before_assignment(lazy, capfd):
+    # until a local is assigned, its name loads the variable of an
+    # enclosing scope or the builtin
+    interpret_source('''
+    x = 1;
+    function f() {
+        x = x + 1;
+        return x;
+    };
+    function outer() {
+        c = 10;
+        function inner() {
+            c = c + 1;
+            return c;
+        };
+        return inner() + c;
+    };
+    function shadow() {
+        p = print;
+        print = 0;
+        return p;
+    };
+    print(f());
+    print(x);
+    print(outer());
+    shadow()("builtin");
+    ''', lazy=lazy)
+    out, _ = capfd.readouterr()
+    assert out == '2\n1\n21\nbuiltin\n'
+    with pytest.raises(OperationalError) as excinfo:
+        interpret_source('''
+        function f() {
+            y = y + 1;
+        };
+        f();
+        ''', lazy=lazy)
+    assert str(excinfo.value) == 'Variable "y" is not defined'
+
+
+def test_many_arguments():
+    args = ', '.join('a%d' % i for i in range(15))
+    frame = interpret_source('''
+    function sum(%s) {
+        return %s;
+    };
+    x = sum(%s);
+    ''' % (args, ' + '.join(args.split(', ')),
+           ', '.join(str(i) for i in range(15))))
+    assert frame.vars[1] == W_IntObject(105)
+
+
+def test_large_code():
+    # more than 256 constants and names, jumps beyond 255 bytes
+    assignments = '\n'.join(
+        'v%d = %d.5;' % (i, i) for i in range(300))
+    frame = interpret_source('''
+    i = 0;
+    while (i < 3) {
+        %s
+        i = i + 1;
+    }
+    if (i == 3) {
+        %s
+        last = v299 + i;
+    }
+    ''' % (assignments, assignments))
+    assert len(frame.names) == 302
+    assert frame.vars[1] == W_FloatObject(0.5)
+    assert frame.vars[300] == W_FloatObject(299.5)
+    assert frame.vars[301] == W_FloatObject(302.5)
+
+
+def test_lazy_compilation():
+    bc = CompilerContext.compile_ast(parser.parse('''
+    function used(a) {
+        return a + 1;
+    };
+    function unused() {
+        return "never compiled";
+    };
+    function counter(start) {
+        n = start * 2;
+        function get() {
+            return n + 0.5;
+        };
+        return get;
+    };
+    r1 = used(1);
+    get = counter(3);
+    r2 = get();
+    r3 = get();
+    '''), lazy=True)
+    assert bc.constants_fn == [None, None, None]
+    frame = interpret(bc)
+    assert frame.vars[3:] == [W_IntObject(2), frame.vars[4],
+                              W_FloatObject(6.5), W_FloatObject(6.5)]
+    used_bc, unused_bc, counter_bc = bc.constants_fn
+    assert used_bc.co_name == 'used'
+    assert unused_bc is None
+    # the store to n, only loaded by get, is kept although get is
+    # compiled after counter
+    assert counter_bc.constants_fn[0].co_name == 'get'
+    # compiled once, its constant added to the pool
+    assert counter_bc.get_constant_fn(0) is counter_bc.constants_fn[0]
+    assert W_FloatObject(0.5) in counter_bc.constants_fn[0].constants_float
+    assert W_FloatObject(0.5) not in bc.constants_float
+
+
+def test_preparsed_functions():
+    source = '''
+    function counter(start) {
+        n = start * 2;
+        function get() {
+            return n + 0.5;
+        };
+        return get;
+    };
+    function broken() {
+        return 1 +;
+    };
+    r = counter(3)();
+    '''
+    # syntax errors in a function body are only reported when it is called
+    frame = interpret_source(source)
+    assert frame.vars[2] == W_FloatObject(6.5)
+    with pytest.raises(OperationalError) as excinfo:
+        interpret_source(source + 'broken();', filename='test.js')
+    assert 'File test.js, line 10' in str(excinfo.value)
+    # on every call
+    broken = interpret_source(source).vars[1]
+    for _ in range(2):
+        with pytest.raises(OperationalError):
+            broken.get_bytecode()
+
+
+def test_quickening():
+    source = '''
+    function add(a, b) {
+        x = a + b;
+        return x - 1;
+    };
+    r1 = add(%s, %s);
+    '''
+    bc = CompilerContext.compile_ast(
+        parser.parse(source % ('1.5', '2.5')), optimize=False)
+    fn_bc = bc.constants_fn[0]
+    assert fn_bc.quickened[4] == BINARY_ADD
+    frame = interpret(bc)
+    assert frame.vars[1] == W_FloatObject(3.0)
+    assert fn_bc.quickened[4] == BINARY_ADD_FLOAT
+    assert fn_bc.quickened[12] == BINARY_SUB_FLOAT
+    # the code itself, used by the JIT, stays generic
+    assert ord(fn_bc.code[4]) == BINARY_ADD
+    assert ord(fn_bc.code[12]) == BINARY_SUB
+
+    bc = CompilerContext.compile_ast(
+        parser.parse(source % ('1', '2')), optimize=False)
+    fn_bc = bc.constants_fn[0]
+    frame = interpret(bc)
+    assert frame.vars[1] == W_IntObject(2)
+    assert fn_bc.quickened[4] == BINARY_ADD_INT
+    assert fn_bc.quickened[12] == BINARY_SUB_INT
+
+
+def test_quickening_mixed_operands():
+    bc = CompilerContext.compile_ast(parser.parse('''
+    function count(n) {
+        x = 0.5;
+        while (x < n) {
+            x = x + 1;
+        }
+        return x + n / 4;
+    };
+    r1 = count(10);
+    r2 = count(10);
+    r3 = count(10);
+    '''), optimize=False)
+    fn_bc = bc.constants_fn[0]
+    frame = interpret(bc)
+    assert frame.vars[1] == W_FloatObject(13.0)
+    # a float and an int take the float variants
+    assert BINARY_ADD_FLOAT in fn_bc.quickened
+    assert BINARY_LT_FLOAT in fn_bc.quickened
+    # there is no variant for dividing ints, which is only tried so often
+    pc = 0
+    while pc < len(fn_bc.code):
+        op, _, next_pc = read_instruction(fn_bc.code, pc)
+        if op == BINARY_DIV:
+            assert fn_bc.quickened[next_pc - 2] == BINARY_DIV
+            assert fn_bc.quicken_misses[next_pc - 2] == MAX_QUICKEN_MISSES
+        pc = next_pc
+
+
+def test_dequickening():
+    bc = CompilerContext.compile_ast(parser.parse('''
+    function twice(a) {
+        return a + a;
+    };
+    r1 = twice(1);
+    r2 = twice("a");
+    r3 = twice(1 < 2);
+    r4 = twice(1);
+    r5 = twice("a");
+    '''), optimize=False)
+    fn_bc = bc.constants_fn[0]
+    frame = interpret(bc)
+    assert frame.vars[1:] == [
+        W_IntObject(2), W_StringObject('aa'), W_FloatObject(2.0),
+        W_IntObject(2), W_StringObject('aa')]
+    # after too many type misses the instruction stays generic
+    assert fn_bc.quicken_misses[4] == MAX_QUICKEN_MISSES
+    assert fn_bc.quickened[4] == BINARY_ADD
+
+    bc = CompilerContext.compile_ast(parser.parse('''
+    function twice(a) {
+        return a + a;
+    };
+    r1 = twice(1);
+    r2 = twice("a");
+    r3 = twice("b");
+    '''), optimize=False)
+    fn_bc = bc.constants_fn[0]
+    interpret(bc)
+    # the miss goes back to the generic instruction, which quickens again
+    assert fn_bc.quicken_misses[4] == 1
+    assert fn_bc.quickened[4] == BINARY_ADD_STRING
+
+
+def test_objects(capfd):
+    frame = interpret_source('''
+    function point(x, y) {
+        return {x: x, y: y};
+    };
+    p = point(1, 2);
+    p.z = p.x + p.y;
+    p.x = "one";
+    o = {};
+    o.inner = {v: 3};
+    print(o.inner.v);
+    print(p.w);
+    print(o);
+    ''')
+    out, _ = capfd.readouterr()
+    assert out == '3\nundefined\n[object Object]\n'
+    p = frame.vars[1]
+    assert p.storage == [W_StringObject('one'), W_IntObject(2),
+                         W_IntObject(3)]
+    assert sorted(p.map.indexes) == ['x', 'y', 'z']
+
+
+def test_object_maps():
+    frame = interpret_source('''
+    a = {x: 1, y: 2};
+    b = {x: 3};
+    b.y = 4;
+    c = {y: 5, x: 6};
+    ''')
+    a, b, c = frame.vars
+    # the same properties added in the same order share the map
+    assert a.map is b.map
+    assert c.map is not a.map
+    assert c.map.find_index('x') == 1
+
+
+def test_inline_cache():
+    bc = CompilerContext.compile_ast(parser.parse('''
+    function getx(o) {
+        return o.x;
+    };
+    r1 = getx({x: 1});
+    r2 = getx({x: 2});
+    '''))
+    fn_bc = bc.constants_fn[0]
+    frame = interpret(bc)
+    assert frame.vars[1:] == [W_IntObject(1), W_IntObject(2)]
+    pos = fn_bc.code.index(chr(LOAD_ATTR))
+    assert fn_bc.attr_maps[pos].find_index('x') == 0
+    assert fn_bc.attr_indexes[pos] == 0
+
+    # a different map replaces the cached one
+    frame = interpret_source('''
+    function getx(o) {
+        return o.x;
+    };
+    r1 = getx({x: 1});
+    r2 = getx({y: 0, x: 2});
+    r3 = getx({y: 0});
+    ''', inline=False)
+    assert frame.vars[1:] == [W_IntObject(1), W_IntObject(2), w_Undefined]
+
+
+def test_property_of_undefined():
+    with pytest.raises(OperationalError) as excinfo:
+        interpret_source('x = undefined; y = x.a;')
+    assert str(excinfo.value) == \
+        'TypeError: cannot read property "a" of undefined'
+    frame = interpret_source('x = 1; x.a = 2; y = x.a;')
+    assert frame.vars == [W_IntObject(1), w_Undefined]
+
+
+def test_arrays(capfd):
+    frame = interpret_source('''
+    a = [3, 1, 2];
+    n = a.length;
+    a[3] = a[0] + a[1];
+    b = [];
+    b[2] = "x";
+    o = {k: 1};
+    k = o["k"];
+    m = [[1, 2], [3, 4]];
+    m[1][0] = 9;
+    print(a);
+    print(b);
+    print(m[1]);
+    print(a[10]);
+    ''')
+    out, _ = capfd.readouterr()
+    assert out == '3,1,2,4\n,,x\n9,4\nundefined\n'
+    assert frame.vars[1] == W_IntObject(3)
+    assert frame.vars[4] == W_IntObject(1)
+
+
+def test_array_strategies():
+    frame = interpret_source('''
+    a = [];
+    b = [1, 2];
+    c = [1, 2.5];
+    d = [1, "x"];
+    e = [1, 2];
+    e[0] = 0.5;
+    f = [1, 2.5];
+    f[2] = undefined;
+    ''')
+    a, b, c, d, e, f = frame.vars
+    assert a.strategy is arrays.empty_strategy
+    assert b.strategy is arrays.int_strategy
+    assert c.strategy is arrays.float_strategy
+    assert d.strategy is arrays.object_strategy
+    # the storage is generalized when a value does not fit
+    assert e.strategy is arrays.float_strategy
+    assert e.strategy.fetch_all(e) == [
+        W_FloatObject(0.5), W_FloatObject(2.0)]
+    assert f.strategy is arrays.object_strategy
+    assert f.strategy.fetch_all(f) == [
+        W_FloatObject(1.0), W_FloatObject(2.5), w_Undefined]
+
+
+def test_array_builtins(capfd):
+    frame = interpret_source('''
+    a = [5, 3, 9, 1];
+    n = push(a, 7, 2);
+    sort(a);
+    print(a);
+    last = pop(a);
+    print(slice(a, 1, -1));
+    print(slice(a, -2));
+    print(sort([2.5, 1, -3]));
+    print(sort(["b", undefined, "a", 10, 9]));
+    print(sort([10, 9, 1]));
+    print(sort([10, 9.5, 1]));
+    b = [];
+    push(b, 1);
+    c = slice(b);
+    ''')
+    out, _ = capfd.readouterr()
+    assert out.split('\n') == [
+        '1,2,3,5,7,9', '2,3,5', '5,7', '-3,1,2.5', '10,9,a,b,',
+        '1,10,9', '1,10,9.5', '']
+    assert frame.vars[1] == W_IntObject(6)
+    assert frame.vars[2] == W_IntObject(9)
+    b, c = frame.vars[3:]
+    assert b.strategy is arrays.int_strategy
+    assert c.strategy is arrays.int_strategy and c is not b
+    with pytest.raises(OperationalError):
+        interpret_source('push(1, 2);')
+    with pytest.raises(OperationalError) as excinfo:
+        interpret_source('a = []; a[2000000000] = 1;')
+    assert str(excinfo.value) == 'RangeError: Invalid array length'
+
+
+def test_typed_arrays(capfd):
+    frame = interpret_source('''
+    a = Float64Array(3);
+    a[1] = 2;
+    a[5] = 1;
+    b = Int32Array([1, 2.7, -2.7, 4294967297]);
+    b[0] = "10";
+    c = Float64Array(b);
+    print(a);
+    print(b);
+    print(c.length);
+    ''')
+    out, _ = capfd.readouterr()
+    assert out == '0,2,0\n10,2,-2,1\n4\n'
+    assert frame.vars[0].floats == [0.0, 2.0, 0.0]
+    assert frame.vars[1].ints == [10, 2, -2, 1]
+    with pytest.raises(OperationalError):
+        interpret_source('a = Float64Array("x");')
+
+
+def test_typed_array_kernels(capfd):
+    frame = interpret_source('''
+    a = fill(Float64Array(4), 1.5);
+    b = Float64Array([1, 2, 3, 4]);
+    d = dot(a, b);
+    add(b, a);
+    scale(b, 2);
+    s = sum(b);
+    m = map(copy(b), "sqrt");
+    i = Int32Array([3, -1]);
+    map(i, "square");
+    t = sum(i);
+    ''')
+    assert frame.vars[2] == W_FloatObject(15.0)
+    assert frame.vars[1].floats == [5.0, 7.0, 9.0, 11.0]
+    assert frame.vars[3] == W_FloatObject(32.0)
+    assert frame.vars[4].floats == [x ** 0.5 for x in [5.0, 7.0, 9.0, 11.0]]
+    assert frame.vars[5].ints == [9, 1]
+    assert frame.vars[6] == W_IntObject(10)
+    with pytest.raises(OperationalError) as excinfo:
+        interpret_source('dot(Float64Array(2), Float64Array(3));')
+    assert str(excinfo.value) == 'RangeError: typed arrays differ in length'
+    with pytest.raises(OperationalError) as excinfo:
+        interpret_source('map(Float64Array(2), "nothing");')
+    assert str(excinfo.value) == 'TypeError: unknown operation "nothing"'
+    with pytest.raises(OperationalError):
+        interpret_source('sum([1, 2]);')
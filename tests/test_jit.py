@@ -1,7 +1,8 @@
 # -*- encoding: utf-8 -*-
 
 from js import parser
-from js.bytecode import LOAD_VAR, LOAD_CONSTANT_FLOAT, \
+from js.bytecode import LOAD_FAST, LOAD_CONSTANT_FLOAT, LOAD_CONSTANT_INT, \
+    EXTENDED_ARG, \
     CALL, LOAD_CONSTANT_FN, ASSIGN, DISCARD_TOP, RETURN, BINARY_ADD, \
     CompilerContext, to_code
 from js.interpreter import get_printable_location
@@ -17,17 +18,18 @@ def test_get_location():
     foo(1, x);
     '''
     ast = parser.parse(source, filename=filename)
-    bc = CompilerContext.compile_ast(ast, co_filename=filename)
+    bc = CompilerContext.compile_ast(ast, co_filename=filename,
+                                     optimize=False)
     assert bc.code == to_code([
         LOAD_CONSTANT_FN, 0,
         ASSIGN, 0,
         LOAD_CONSTANT_FN, 0,
         DISCARD_TOP, 0,
-        LOAD_CONSTANT_FLOAT, 0,
+        LOAD_CONSTANT_INT, 0,
         ASSIGN, 1,
-        LOAD_VAR, 0,
-        LOAD_CONSTANT_FLOAT, 1,
-        LOAD_VAR, 1,
+        LOAD_FAST, 0,
+        LOAD_CONSTANT_INT, 1,
+        LOAD_FAST, 1,
         CALL, 2,
         DISCARD_TOP, 0,
         RETURN, 0])
@@ -36,8 +38,8 @@ def test_get_location():
     assert bc.co_firstlineno == 0
     inner_bc = bc.constants_fn[0]
     assert inner_bc.code == to_code([
-        LOAD_VAR, 0,
-        LOAD_VAR, 1,
+        LOAD_FAST, 0,
+        LOAD_FAST, 1,
         BINARY_ADD, 0,
         RETURN, 1])
     assert inner_bc.co_name == 'foo'
@@ -48,6 +50,19 @@ def test_get_location():
     assert get_printable_location(2, bc.code, bc) == \
         "<code object __main__, file '_for_test_jit.js', line 1> #2 ASSIGN"
     assert get_printable_location(0, inner_bc.code, inner_bc) == \
-        "<code object foo, file '_for_test_jit.js', line 2> #0 LOAD_VAR"
+        "<code object foo, file '_for_test_jit.js', line 2> #0 LOAD_FAST"
     assert get_printable_location(4, inner_bc.code, inner_bc) == \
         "<code object foo, file '_for_test_jit.js', line 2> #4 BINARY_ADD"
+
+
+def test_get_location_extended_arg():
+    bc = CompilerContext.compile_ast(parser.parse('x = 1; x;'))
+    code = to_code([
+        LOAD_CONSTANT_FLOAT, 1000,
+        ASSIGN, 0,
+        RETURN, 0])
+    assert code[:2] == to_code([EXTENDED_ARG, 3])
+    assert get_printable_location(0, code, bc) == \
+        "<code object __main__, file '__file__', line 1> #0 LOAD_CONSTANT_FLOAT"
+    assert get_printable_location(4, code, bc) == \
+        "<code object __main__, file '__file__', line 1> #4 ASSIGN"
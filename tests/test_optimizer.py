@@ -0,0 +1,410 @@
+# -*- encoding: utf-8 -*-
+
+import pytest
+
+from js import parser
+from js.parser import ConstantNum, ConstantStr, Variable, Assignment, Stmt, \
+    Block, BinOp, If, While, FnDef, Return
+from js.bytecode import CompilerContext, to_code, fuse, LOAD_CONSTANT_INT, \
+    LOAD_CONSTANT_FLOAT, LOAD_CONSTANT_STRING, LOAD_CONSTANT_FN, RETURN, \
+    LOAD_FAST, ASSIGN, BINARY_ADD, BINARY_MUL, BINARY_DIV, BINARY_LT, \
+    JUMP_IF_FALSE, JUMP_ABSOLUTE, JUMP_IF_NOT_LT, INCR_FAST, LOAD_FAST_FAST, \
+    RETURN_BINARY, STORE_CELL, dis_to_list
+from js.inliner import Inliner
+from js.interpreter import interpret, interpret_source
+from js.base_objects import W_Function, W_FloatObject, W_StringObject, \
+    W_IntObject
+
+
+compile_ast = CompilerContext.compile_ast
+
+
+def test_fold_constants():
+    bytecode = compile_ast(BinOp('+', ConstantNum(1.0), BinOp(
+        '*', ConstantNum(2.0), ConstantNum(3.0))))
+    assert bytecode.code == to_code([LOAD_CONSTANT_FLOAT, 0, RETURN, 0])
+    assert bytecode.constants_float == [W_FloatObject(7.0)]
+
+    bytecode = compile_ast(BinOp('+', ConstantStr('foo'), BinOp(
+        '+', ConstantStr('bar'), ConstantStr('baz'))))
+    assert bytecode.code == to_code([LOAD_CONSTANT_STRING, 0, RETURN, 0])
+    assert bytecode.constants_string == [W_StringObject('foobarbaz')]
+
+
+def test_fold_constants_partial():
+    bytecode = compile_ast(BinOp('/', BinOp(
+        '-', ConstantNum(5.0), ConstantNum(1.0)), ConstantNum(0.0)))
+    assert bytecode.code == to_code([
+        LOAD_CONSTANT_FLOAT, 0,
+        LOAD_CONSTANT_FLOAT, 1,
+        BINARY_DIV, 0,
+        RETURN, 0])
+    assert bytecode.constants_float == [
+        W_FloatObject(4.0), W_FloatObject(0.0)]
+
+
+def test_fn_def_statement():
+    bytecode = compile_ast(Block([
+        Stmt(FnDef('foo', [], Block([]), None, 0))]))
+    assert bytecode.code == to_code([
+        LOAD_CONSTANT_FN, 0,
+        ASSIGN, 0,
+        RETURN, 0])
+
+
+def test_jump_threading():
+    bytecode = compile_ast(While(Variable('x'), Block([
+        If(Variable('y'),
+           Block([Assignment('z', ConstantNum(1.0))]),
+           Block([Assignment('z', ConstantNum(2.0))]))])))
+    assert bytecode.code == to_code([
+        LOAD_FAST, 0,
+        JUMP_IF_FALSE, 20,
+        LOAD_FAST, 1,
+        JUMP_IF_FALSE, 14,
+        LOAD_CONSTANT_FLOAT, 0,
+        ASSIGN, 2,
+        JUMP_ABSOLUTE, 0,
+        LOAD_CONSTANT_FLOAT, 1,
+        ASSIGN, 2,
+        JUMP_ABSOLUTE, 0,
+        RETURN, 0])
+
+
+def test_constant_conditions():
+    bytecode = compile_ast(Block([
+        If(ConstantNum(0.0), Block([Assignment('x', ConstantNum(1.0))])),
+        While(ConstantNum(1.0), Block([Assignment('y', ConstantNum(2.0))])),
+    ]))
+    assert bytecode.code == to_code([
+        LOAD_CONSTANT_FLOAT, 2,
+        ASSIGN, 1,
+        JUMP_ABSOLUTE, 0])
+
+
+def test_unreachable_and_dead_stores():
+    bytecode = compile_ast(FnDef('foo', ['x'], Block([
+        Assignment('unused', ConstantNum(1.0)),
+        Return(Variable('x')),
+        Stmt(Variable('x')),
+    ]), None, 0))
+    inner = bytecode.constants_fn[0]
+    assert inner.code == to_code([LOAD_FAST, 0, RETURN, 1])
+
+    # stores at the top level are globals, and captured locals are stored
+    # in cells read by nested functions
+    bytecode = compile_ast(Block([
+        Assignment('unused', ConstantNum(1.0)),
+        Stmt(FnDef('foo', [], Block([
+            Assignment('captured', ConstantNum(2.0)),
+            Return(FnDef('bar', [], Block([
+                Return(Variable('captured'))]), None, 0)),
+        ]), None, 0)),
+    ]))
+    assert bytecode.code == to_code([
+        LOAD_CONSTANT_FLOAT, 0,
+        ASSIGN, 0,
+        LOAD_CONSTANT_FN, 0,
+        ASSIGN, 1,
+        RETURN, 0])
+    inner = bytecode.constants_fn[0]
+    assert inner.code == to_code([
+        LOAD_CONSTANT_FLOAT, 1,
+        STORE_CELL, 0,
+        LOAD_CONSTANT_FN, 0,
+        RETURN, 1])
+
+
+def test_return_in_if():
+    bytecode = compile_ast(FnDef('foo', ['x'], Block([
+        If(Variable('x'), Block([Return(ConstantNum(1.0))]))]), None, 0),
+        optimize=False)
+    inner = bytecode.constants_fn[0]
+    assert inner.code == to_code([
+        LOAD_FAST, 0,
+        JUMP_IF_FALSE, 8,
+        LOAD_CONSTANT_FLOAT, 0,
+        RETURN, 1,
+        RETURN, 0])
+
+
+def test_superinstructions():
+    bytecode = compile_ast(parser.parse(
+        'x = 0; while (x < 10) { x = x + 1; }'))
+    assert bytecode.code == to_code([
+        LOAD_CONSTANT_INT, 0,
+        ASSIGN, 0,
+        LOAD_FAST, 0,
+        LOAD_CONSTANT_INT, 1,
+        JUMP_IF_NOT_LT, 14,
+        INCR_FAST, (0 << 8) | 2,
+        JUMP_ABSOLUTE, 4,
+        RETURN, 0])
+
+    bytecode = compile_ast(parser.parse(
+        'function f(a, b) { return a * b; };'))
+    assert bytecode.constants_fn[0].code == to_code([
+        LOAD_FAST_FAST, (0 << 8) | 1,
+        RETURN_BINARY, BINARY_MUL])
+
+
+def test_superinstructions_jump_target():
+    # instructions that are jumped to start a new group
+    ctx = CompilerContext(names=['x'])
+    ctx.register_constant_int(1)
+    ctx.data = [
+        LOAD_FAST, 0,
+        LOAD_CONSTANT_INT, 0,
+        BINARY_ADD, 0,
+        ASSIGN, 0,
+        LOAD_FAST, 0,
+        LOAD_FAST, 0,
+        BINARY_LT, 0,
+        JUMP_IF_FALSE, 4,
+        JUMP_ABSOLUTE, 10,
+    ]
+    fuse(ctx)
+    assert ctx.data == [
+        LOAD_FAST, 0,
+        LOAD_CONSTANT_INT, 0,
+        BINARY_ADD, 0,
+        ASSIGN, 0,
+        LOAD_FAST, 0,
+        LOAD_FAST, 0,
+        JUMP_IF_NOT_LT, 4,
+        JUMP_ABSOLUTE, 10,
+    ]
+
+
+def values(vars):
+    return [w_value for w_value in vars
+            if not isinstance(w_value, W_Function)]
+
+
+@pytest.mark.parametrize('source', [
+    'x = 1 + 2 * 3 - 4 / 8; y = x % 3; print(y);',
+    '''
+    x = 0;
+    y = 0;
+    while (x < 10) {
+        if (x % 2 == 0) {
+            y = y + x;
+        } else {
+            y = y - 1;
+        }
+        x = x + 1;
+    }
+    print(y);
+    ''',
+    '''
+    function fib(x) {
+        if (x < 3) {
+            return 1;
+        } else {
+            return fib(x - 1) + fib(x - 2);
+        }
+        print(x);
+    };
+    print(fib(12));
+    ''',
+    '''
+    function f(x) {
+        unused = x * 2;
+        function g() {
+            return x + 1;
+        };
+        if (1) {
+            return g();
+        }
+        return 0;
+    };
+    while (0) {
+        print(1);
+    }
+    print(f(3));
+    ''',
+    '''
+    function f(x) {
+        if (x) {
+            return 1;
+        }
+    };
+    print(f(1));
+    z = f(0);
+    ''',
+    '''
+    function count(n) {
+        i = 0;
+        total = 0;
+        while (i < n) {
+            if (i % 3 == 1) {
+                total = total + i;
+            }
+            i = i + 2;
+        }
+        return total * i;
+    };
+    print(count(20));
+    ''',
+])
+def test_equivalence(source, capfd):
+    unoptimized = interpret_source(source, optimize=False)
+    unoptimized_out, _ = capfd.readouterr()
+    optimized = interpret_source(source)
+    optimized_out, _ = capfd.readouterr()
+    assert optimized_out == unoptimized_out
+    assert optimized.names == unoptimized.names
+    assert values(optimized.vars) == values(unoptimized.vars)
+
+
+def test_superinstructions_disabled():
+    source = 'function f(a) { return a + a; }; x = 0; x = x + 1;'
+    ast = parser.parse(source)
+    unfused = compile_ast(ast, optimize=False)
+    for op in [INCR_FAST, LOAD_FAST_FAST, RETURN_BINARY]:
+        assert op not in [ord(c) for c in unfused.code[::2]]
+        assert op not in [ord(c) for c in unfused.constants_fn[0].code[::2]]
+
+
+def test_smaller_code():
+    source = 'function f() { return 2 * 3; }; x = f() + 1;'
+    ast = parser.parse(source)
+    assert len(compile_ast(ast).constants_fn[0].code) < \
+        len(compile_ast(ast, optimize=False).constants_fn[0].code)
+
+
+INLINED = '''
+function sq(x) {
+    return x * x;
+};
+function add(a, b) {
+    return a + b;
+};
+function sum_squares(n) {
+    i = 0;
+    total = 0;
+    while (i < n) {
+        total = add(total, sq(i));
+        i = i + 1;
+    }
+    return total;
+};
+print(sq(3));
+print(add(1, add(2, 3)));
+print(sum_squares(10));
+'''
+
+
+def opnames(code):
+    return [line.split()[0] for line in dis_to_list(code)]
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_inline(lazy, capfd):
+    ast = parser.parse(INLINED, lazy=lazy)
+    inliner = Inliner(ast)
+    assert sorted(inliner.bodies) == ['add', 'sq']
+    bc = compile_ast(ast, lazy=lazy, inliner=inliner)
+    # calls on constants are folded away, the others take temporaries
+    assert W_IntObject(9) in bc.get_constant_fn(2).constants_int
+    assert W_IntObject(6) in bc.get_constant_fn(2).constants_int
+    assert opnames(bc.code).count('CALL') == 4
+    assert 'CALL' not in opnames(bc.get_constant_fn(2).code)
+    interpret(bc)
+    out, _ = capfd.readouterr()
+    assert out == '9\n6\n285\n'
+
+
+def test_inline_switch(capfd):
+    interpret_source(INLINED, inline=False)
+    out, _ = capfd.readouterr()
+    assert out == '9\n6\n285\n'
+    bc = compile_ast(parser.parse(INLINED))
+    assert opnames(bc.code).count('CALL') == 7
+
+
+def test_inline_evaluates_arguments_once(capfd):
+    source = '''
+    function twice(x) {
+        return x + x;
+    };
+    function bump(o) {
+        o.n = o.n + 1;
+        return o.n;
+    };
+    function scaled(x) {
+        return x * scale;
+    };
+    counter = {n: 0};
+    scale = 3;
+    print(twice(bump(counter)));
+    print(counter.n);
+    print(scaled(2) + scaled(2, 1));
+    '''
+    assert sorted(Inliner(parser.parse(source)).bodies) == ['scaled', 'twice']
+    interpret_source(source)
+    out, _ = capfd.readouterr()
+    assert out == '2\n1\n12\n'
+
+
+def test_inline_temporaries(capfd):
+    source = '''
+    function add(a, b) {
+        return a + b;
+    };
+    x = 1;
+    y = 2;
+    print(add(x, add(y, add(x, y))));
+    print(add(add(x, y), y));
+    print(add(y, x));
+    '''
+    ast = parser.parse(source)
+    bc = compile_ast(ast, inliner=Inliner(ast))
+    # the calls inlined one after the other share the slots of their
+    # temporaries, only the nested ones take more
+    assert [name for name in bc.names if name.startswith('inlined.')] == \
+        ['inlined.0', 'inlined.1', 'inlined.2', 'inlined.3']
+    interpret(bc)
+    out, _ = capfd.readouterr()
+    assert out == '6\n5\n3\n'
+
+
+def test_inline_depth():
+    ast = parser.parse('''
+    function f(x) {
+        return g(x) + 1;
+    };
+    function g(x) {
+        return f(x) + 1;
+    };
+    y = f(0);
+    ''')
+    inliner = Inliner(ast)
+    assert sorted(inliner.bodies) == ['f', 'g']
+    # the functions calling each other are only inlined so deep
+    bc = compile_ast(ast, inliner=inliner)
+    assert opnames(bc.code).count('CALL') == 1
+    assert opnames(bc.code).count('BINARY_ADD') == 3
+
+
+@pytest.mark.parametrize('source', [
+    # recursive
+    'function f(x) { return f(x); };',
+    # not a single return
+    'function f(x) { y = x; return y; };',
+    # too big
+    'function f(x) { return x + x + x + x + x + x + x + x + x; };',
+    # not bound to the function everywhere
+    'function f(x) { return x; }; f = 1;',
+    'function f(x) { return x; }; function g() { f = 1; return f; };',
+    'function f(x) { return x; }; function g(f) { return f(1); };',
+    'function g() { function f(x) { return x; }; return 1; }; '
+    'function f(x) { return x; };',
+    # may be called before it is defined
+    'y = 1; function f(x) { return x; };',
+    # y may be a local of the caller
+    'function f(x) { return x + y; }; function g(y) { return f(y); };',
+])
+def test_not_inlined(source):
+    for lazy in [False, True]:
+        assert 'f' not in Inliner(parser.parse(source, lazy=lazy)).bodies
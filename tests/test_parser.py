@@ -1,10 +1,16 @@
 # -*- encoding: utf-8 -*-
 
+from glob import glob
+from os import path
+
 import pytest
 
-from js import parser
-from js.parser import Block, Stmt, Variable, ConstantNum, While, \
-    Assignment, If, Call, BinOp, FnDef, Return
+from js import lexer, parser
+from js.base_objects import OperationalError
+from js.parser import AstNode, LazyBlock, Block, Stmt, Variable, ConstantNum, ConstantInt, \
+    ConstantStr, While, Assignment, If, Call, BinOp, FnDef, Return, \
+    ObjectLiteral, GetAttr, SetAttr, ArrayLiteral, GetItem, SetItem
+from tests.grammar_parser import GrammarParser
 
 
 def test_parse_variable():
@@ -22,11 +28,15 @@ def test_parse_variable():
 
 
 def test_parse_number():
-    for num, value in [
-            ('0', 0.0), ('1', 1.0), ('.123', .123), ('123.123', 123.123),
-            ('+12', 12.0), ('-.12', -0.12)]:
+    for num, node in [
+            ('0', ConstantInt(0)), ('1', ConstantInt(1)),
+            ('.123', ConstantNum(.123)), ('123.123', ConstantNum(123.123)),
+            ('+12', ConstantInt(12)), ('-.12', ConstantNum(-0.12)),
+            ('1.', ConstantNum(1.0)), ('-5', ConstantInt(-5)),
+            ('-0', ConstantNum(-0.0)), ('123456789', ConstantInt(123456789)),
+            ('1234567890', ConstantNum(1234567890.0))]:
         result = parser.parse('%s;' % num)
-        assert result == Block([Stmt(ConstantNum(value))])
+        assert result == Block([Stmt(node)])
 
 
 def test_paser_assignment():
@@ -42,21 +52,21 @@ def test_paser_assignment():
 
 def test_parse_while():
     result = parser.parse('while (1) { a = 3; }')
-    assert result == Block([While(ConstantNum(1.0),
-                                  Block([Assignment('a', ConstantNum(3))]))])
+    assert result == Block([While(ConstantInt(1),
+                                  Block([Assignment('a', ConstantInt(3))]))])
     result = parser.parse('while (1) { }')
-    assert result == Block([While(ConstantNum(1.0), Block([]))])
+    assert result == Block([While(ConstantInt(1), Block([]))])
 
 
 def test_parse_if():
     result = parser.parse('if (y) { x = 10; }')
     assert result == Block([If(Variable('y'),
-                               Block([Assignment('x', ConstantNum(10.0))]))])
+                               Block([Assignment('x', ConstantInt(10))]))])
 
     result = parser.parse('if (y) { x = 10; } else { x = 12; }')
     assert result == Block([If(Variable('y'),
-                               Block([Assignment('x', ConstantNum(10.0))]),
-                               Block([Assignment('x', ConstantNum(12.0))]))])
+                               Block([Assignment('x', ConstantInt(10))]),
+                               Block([Assignment('x', ConstantInt(12))]))])
 
 
 def test_parse_fn_call():
@@ -67,11 +77,11 @@ def test_parse_fn_call():
     assert result == Block([Stmt(Call(Variable('print'), [Variable('x')]))])
 
     result = parser.parse('foo(1);')
-    assert result == Block([Stmt(Call(Variable('foo'), [ConstantNum(1.0)]))])
+    assert result == Block([Stmt(Call(Variable('foo'), [ConstantInt(1)]))])
 
     result = parser.parse('foo(1 + 2);')
     assert result == Block([Stmt(Call(Variable('foo'),
-                                      [BinOp('+', ConstantNum(1.0), ConstantNum(2.0))]))])
+                                      [BinOp('+', ConstantInt(1), ConstantInt(2))]))])
 
     result = parser.parse('foo(x + y);')
     assert result == Block([Stmt(Call(Variable('foo'),
@@ -86,13 +96,13 @@ def test_parse_fn_call():
 
     result = parser.parse('foo(1, f(x), y);')
     assert result == Block([Stmt(Call(Variable('foo'), [
-        ConstantNum(1.0),
+        ConstantInt(1),
         Call(Variable('f'), [Variable('x')]),
         Variable('y')]))])
 
     result = parser.parse('foo(1, f(x), y, z, y);')
     assert result == Block([Stmt(Call(Variable('foo'), [
-        ConstantNum(1.0),
+        ConstantInt(1),
         Call(Variable('f'), [Variable('x')]),
         Variable('y'),
         Variable('z'),
@@ -103,19 +113,19 @@ def test_parse_fn_call():
 def test_parse_binop():
     result = parser.parse('x = 1 + 2;')
     assert result == Block([Assignment('x',
-                                       BinOp('+', ConstantNum(1.0), ConstantNum(2.0)))])
+                                       BinOp('+', ConstantInt(1), ConstantInt(2)))])
     result = parser.parse('x = x - 2;')
     assert result == Block([Assignment('x',
-                                       BinOp('-', Variable('x'), ConstantNum(2.0)))])
+                                       BinOp('-', Variable('x'), ConstantInt(2)))])
     result = parser.parse('x = 1+2;')
     assert result == Block([Assignment('x',
-                                       BinOp('+', ConstantNum(1.0), ConstantNum(2.0)))])
+                                       BinOp('+', ConstantInt(1), ConstantInt(2)))])
     result = parser.parse('x = x-2;')
     assert result == Block([Assignment('x',
-                                       BinOp('-', Variable('x'), ConstantNum(2.0)))])
+                                       BinOp('-', Variable('x'), ConstantInt(2)))])
     result = parser.parse('x = y % 2;')
     assert result == Block([Assignment('x',
-                                       BinOp('%', Variable('y'), ConstantNum(2.0)))])
+                                       BinOp('%', Variable('y'), ConstantInt(2)))])
     result = parser.parse('while (x == y) { }')
     assert result == Block([While(
         BinOp('==', Variable('x'), Variable('y')), Block([]))])
@@ -148,7 +158,7 @@ def test_parse_arithmetic():
                                                Variable('x'),
                                                Variable('y')),
                                            Variable('x')),
-                                       ConstantNum(3.0)))])
+                                       ConstantInt(3)))])
 
 
 def test_parse_fn_def():
@@ -184,3 +194,162 @@ def test_parse_return():
     result = parser.parse('function foo(x, y, z) { return x + y; };')
     assert result == Block([Stmt(FnDef('foo', ['x', 'y', 'z'],
                                        Block([Return(BinOp('+', Variable('x'), Variable('y')))]), None, 0))])
+
+
+def test_parse_object():
+    result = parser.parse('x = {};')
+    assert result == Block([Assignment('x', ObjectLiteral([], []))])
+
+    result = parser.parse('x = {a: 1, b: "two"};')
+    assert result == Block([Assignment('x', ObjectLiteral(
+        ['a', 'b'], [ConstantInt(1), ConstantStr('two')]))])
+
+    result = parser.parse('x = {inner: {a: y}};')
+    assert result == Block([Assignment('x', ObjectLiteral(
+        ['inner'], [ObjectLiteral(['a'], [Variable('y')])]))])
+
+
+def test_parse_attr():
+    result = parser.parse('x.a.b;')
+    assert result == Block([Stmt(GetAttr(GetAttr(Variable('x'), 'a'), 'b'))])
+
+    result = parser.parse('f(1).a(2)();')
+    assert result == Block([Stmt(Call(Call(GetAttr(
+        Call(Variable('f'), [ConstantInt(1)]), 'a'), [ConstantInt(2)]), []))])
+
+    result = parser.parse('x.a.b = x.c + 1;')
+    assert result == Block([SetAttr(GetAttr(Variable('x'), 'a'), 'b', BinOp(
+        '+', GetAttr(Variable('x'), 'c'), ConstantInt(1)))])
+
+    with pytest.raises(parser.ParseError):
+        parser.parse('f() = 1;')
+
+
+def test_parse_array():
+    result = parser.parse('x = [];')
+    assert result == Block([Assignment('x', ArrayLiteral([]))])
+
+    result = parser.parse('x = [1, [y]];')
+    assert result == Block([Assignment('x', ArrayLiteral(
+        [ConstantInt(1), ArrayLiteral([Variable('y')])]))])
+
+    result = parser.parse('x[i + 1][0] = x.a[1];')
+    assert result == Block([SetItem(
+        GetItem(Variable('x'), BinOp('+', Variable('i'), ConstantInt(1))),
+        ConstantInt(0),
+        GetItem(GetAttr(Variable('x'), 'a'), ConstantInt(1)))])
+
+
+def test_tokenize():
+    tokens = lexer.tokenize('x1 = .5 + 0.25;\nwhile (a<=b) {"s\\"";}')
+    assert [(t.kind, t.text) for t in tokens] == [
+        ('VARIABLE', 'x1'), ('=', '='), ('NUMBER', '.5'), ('ADD_OPER', '+'),
+        ('NUMBER', '0.25'), (';', ';'), ('while', 'while'), ('(', '('),
+        ('VARIABLE', 'a'), ('COMP_OPER', '<='), ('VARIABLE', 'b'),
+        (')', ')'), ('{', '{'), ('STRING', '"s\\""'), (';', ';'),
+        ('}', '}'), ('EOF', 'EOF')]
+    assert (tokens[6].lineno, tokens[6].columnno) == (1, 0)
+    for invalid in ('x = @;', 'a ! b;', 'x = "open;', 'x\r;'):
+        with pytest.raises(parser.LexerError):
+            lexer.tokenize(invalid)
+
+
+def example_sources():
+    root = path.dirname(path.dirname(path.abspath(__file__)))
+    sources = []
+    for filename in glob(path.join(root, 'examples', '*.js')) + \
+            glob(path.join(root, 'benchmarks', '*.js')):
+        with open(filename) as f:
+            sources.append(f.read())
+    return sources
+
+
+@pytest.fixture(scope='session')
+def grammar_parser():
+    return GrammarParser()
+
+
+def test_same_ast_as_grammar(grammar_parser):
+    sources = [
+        'a - b - c;', 'a < b == c;', 'a * b + c * d - e / f % g < h;',
+        '- -1;', '+ -0;', '-1 + 2;', 'x = -(1 + 2) * 3;', '0123;', '1.;',
+        'x . y;', '(x.a) = 1;', 'f(a)(b)[c].d = [1, {x: 2}];', '{};',
+        'function f() {}();', '\n\n  function f(a, b) { return; };',
+        'if (x) { y; } else { return z; }', 'while (1) { x = "a\nb"; }',
+        'while = 1;', '(x) = 1;', 'x = 1', '1 * -1;', 'f(1,);', '{a: 1,};',
+        'x.while;', '1..2;', '1.e5;', 'a = b = c;', 'x = y.z = 1;']
+    for source in sources + example_sources():
+        results = []
+        for module in (parser, grammar_parser):
+            try:
+                results.append(module.parse(source, filename='test.js'))
+            except (parser.ParseError, NotImplementedError) as e:
+                results.append(type(e))
+        assert results[0] == results[1], source
+
+
+def test_parse_long_chain():
+    # operator chains take no Python stack
+    result = parser.parse('x = %s1;' % ('1 + ' * 10000))
+    expr = result.stmts[0].expr
+    depth = 0
+    while isinstance(expr, BinOp):
+        assert expr.op == '+'
+        expr = expr.right
+        depth += 1
+    assert depth == 10000
+
+
+def force(node):
+    ''' node with all its pre-parsed function bodies parsed '''
+    if isinstance(node, LazyBlock):
+        return force(node.resolve())
+    if isinstance(node, list):
+        return [force(item) for item in node]
+    if isinstance(node, AstNode):
+        for name, value in node.__dict__.items():
+            setattr(node, name, force(value))
+    return node
+
+
+def test_preparse():
+    source = '''
+    function outer(a) {
+        s = "}\\"{";
+        function inner(b) {
+            return [a, b];
+        };
+        if (a == 0) {
+            s = "{";
+        }
+        return {x: inner};
+    };
+    outer(1);
+    '''
+    result = parser.parse(source, filename='test.js', lazy=True)
+    body = result.stmts[0].expr.body
+    assert isinstance(body, LazyBlock)
+    assert sorted(body.names) == ['a', 'b', 'inner', 's', 'x']
+    # the names it may bind, for js.inliner
+    assert sorted(body.bound) == ['b', 'inner', 's']
+    # nested bodies are pre-parsed when their function is parsed
+    assert isinstance(body.resolve().stmts[1].expr.body, LazyBlock)
+    for source in [source] + example_sources():
+        assert force(parser.parse(source, filename='test.js', lazy=True)) \
+            == parser.parse(source, filename='test.js')
+
+
+def test_preparse_errors():
+    # mismatched brackets are found up front
+    for invalid in ('function f() { (];', 'function f() { x = [1, 2; }',
+                    'function f() { if (x) { y; }'):
+        with pytest.raises(parser.ParseError):
+            parser.parse(invalid, lazy=True)
+    with pytest.raises(parser.LexerError):
+        parser.parse('function f() { "}; f();', lazy=True)
+    # other syntax errors once the body is parsed
+    result = parser.parse('function f() {\n  return 1 +;\n}; f();',
+                          filename='test.js', lazy=True)
+    with pytest.raises(OperationalError) as excinfo:
+        result.stmts[0].expr.body.resolve()
+    assert 'File test.js, line 2' in str(excinfo.value)